@@ -0,0 +1,151 @@
+"""
+操作日志（审计）写入
+- 默认缓冲写入：日志先放入内存队列，由后台任务每 AUDIT_FLUSH_INTERVAL 秒或攒够
+  AUDIT_BATCH_SIZE 条时批量写入一次，业务接口不再为日志单独开连接、单独提交
+- 同步写入：传入 conn 时写入调用方的事务，与业务数据一起提交（管理员账号、系统设置等不能丢失的操作）
+- 应用关闭时写入剩余日志；进程崩溃时最多丢失最近 AUDIT_FLUSH_INTERVAL 秒的缓冲日志
+"""
+import asyncio
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+
+from database import run_write
+
+# 刷新间隔（秒），也是崩溃时最多丢失的日志时长
+AUDIT_FLUSH_INTERVAL = 1.0
+# 攒够该条数时提前刷新
+AUDIT_BATCH_SIZE = 200
+# 缓冲上限，数据库长时间不可写时丢弃最旧的日志，避免内存无限增长
+AUDIT_MAX_PENDING = 10000
+
+# 用户可能在日志写入前被删除，此时不再关联用户（与删除用户时的处理一致）
+INSERT_LOG = '''
+    INSERT INTO operation_logs (user_id, action, detail, created_at, created_ts)
+    VALUES ((SELECT id FROM users WHERE id = ?), ?, ?, ?, ?)
+'''
+
+
+def _timestamps() -> tuple:
+    """(与 CURRENT_TIMESTAMP 相同格式的 UTC 时间, 整数时间戳)"""
+    now = int(time.time())
+    return datetime.fromtimestamp(now, timezone.utc).strftime("%Y-%m-%d %H:%M:%S"), now
+
+
+class AuditLogWriter:
+    """缓冲日志写入器，可在事件循环或数据库线程中调用 log"""
+
+    def __init__(self):
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+        self._written = 0
+        self._dropped = 0
+        self._failures = 0
+
+    def log(self, user_id, action: str, detail: str = None):
+        """放入缓冲队列，记录时间以调用时为准"""
+        with self._lock:
+            self._pending.append((user_id, action, detail, *_timestamps()))
+            while len(self._pending) > AUDIT_MAX_PENDING:
+                self._pending.popleft()
+                self._dropped += 1
+            full = len(self._pending) >= AUDIT_BATCH_SIZE
+        if full and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _take(self) -> list:
+        with self._lock:
+            batch = list(self._pending)
+            self._pending.clear()
+        return batch
+
+    def _put_back(self, batch: list):
+        with self._lock:
+            self._pending.extendleft(reversed(batch))
+
+    async def flush(self):
+        """写入当前缓冲的全部日志，失败时放回队列等待下次写入"""
+        batch = self._take()
+        if not batch:
+            return
+        try:
+            await run_write(lambda conn: conn.executemany(INSERT_LOG, batch))
+        except Exception:
+            self._failures += 1
+            self._put_back(batch)
+            raise
+        self._written += len(batch)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=AUDIT_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                print("操作日志写入失败，稍后重试:")
+                traceback.print_exc()
+
+    def start(self):
+        """启动后台写入任务（应用启动时调用）"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="audit-writer")
+
+    async def stop(self):
+        """停止后台任务并写入剩余日志（应用关闭时调用）"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._loop = None
+        try:
+            await self.flush()
+        except Exception:
+            print(f"关闭时写入操作日志失败，丢弃 {len(self._pending)} 条:")
+            traceback.print_exc()
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "written": self._written,
+            "dropped": self._dropped,
+            "failures": self._failures,
+        }
+
+
+audit_writer = AuditLogWriter()
+
+
+def log_operation(user_id: int, action: str, detail: str = None, conn=None):
+    """
+    记录操作日志
+    传入 conn 时同步写入调用方的事务（由调用方提交），否则放入缓冲队列批量写入
+    """
+    if conn is not None:
+        conn.execute(INSERT_LOG, (user_id, action, detail, *_timestamps()))
+        return
+    audit_writer.log(user_id, action, detail)
+
+
+def start_audit():
+    audit_writer.start()
+
+
+async def stop_audit():
+    await audit_writer.stop()
+
+
+def audit_stats() -> dict:
+    """操作日志写入统计信息"""
+    return audit_writer.stats()
@@ -1,26 +1,111 @@
 """
 JWT 认证模块
+- access token 有效期较短（带随机浮动，避免同一时刻集中过期）
+- 刷新令牌只在数据库中保存摘要，每次刷新都会轮换；已轮换的令牌被重复使用时吊销整条令牌链
+- 吊销的 access token 记录在进程内黑名单中，直到其自然过期
 """
 import jwt
+import time
+import uuid
+import random
+import hashlib
+import secrets
+import threading
 from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
-from database import get_db, get_password_hash, verify_password
+from database import run_db, fetch_one, execute
+from passwords import hash_password_async, verify_password_async, needs_rehash, DUMMY_PASSWORD_HASH
+from cache import TTLCache
 
 # JWT 配置
 SECRET_KEY = "library-management-secret-key-2024"
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_HOURS = 24
+ACCESS_TOKEN_EXPIRE_MINUTES = 30
+ACCESS_TOKEN_JITTER = 0.1           # 有效期随机浮动比例
+REFRESH_TOKEN_EXPIRE_DAYS = 14
+REFRESH_REUSE_GRACE_SECONDS = 10    # 并发刷新（如多个标签页）时不视为令牌被盗用
+
+# access token 的最长有效秒数，黑名单条目超过该时间即可清理
+ACCESS_TOKEN_MAX_AGE = ACCESS_TOKEN_EXPIRE_MINUTES * 60 * (1 + ACCESS_TOKEN_JITTER)
 
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+# 认证缓存：已验证的 token 和用户信息短时间缓存在进程内
+# 修改密码、删除用户、重置密码等操作会主动失效对应用户；多 worker 时最长陈旧 TTL 秒
+TOKEN_CACHE_TTL = 60.0
+PRINCIPAL_CACHE_TTL = 30.0
+AUTH_CACHE_SIZE = 10000
+
+_token_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+_principal_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+
+
+class TokenDenylist:
+    """
+    已吊销 access token 的内存黑名单
+    - 单个 token 按 jti 记录，过期后清理
+    - 用户级吊销只记录时间点，早于该时间签发的 token 全部失效
+    多 worker 部署时各进程独立，刷新令牌的吊销以数据库为准
+    """
+
+    PRUNE_INTERVAL = 60.0
+
+    def __init__(self):
+        self._tokens = {}   # jti -> exp
+        self._users = {}    # user_id -> 吊销时间
+        self._lock = threading.Lock()
+        self._next_prune = 0.0
+
+    def _prune(self, now: float):
+        if now < self._next_prune:
+            return
+        self._next_prune = now + self.PRUNE_INTERVAL
+        self._tokens = {jti: exp for jti, exp in self._tokens.items() if exp > now}
+        self._users = {uid: ts for uid, ts in self._users.items() if ts + ACCESS_TOKEN_MAX_AGE > now}
+
+    def revoke_token(self, payload: dict):
+        """吊销单个 token"""
+        jti = payload.get("jti")
+        if not jti:
+            return
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            self._tokens[jti] = payload.get("exp", now + ACCESS_TOKEN_MAX_AGE)
+
+    def revoke_user(self, user_id: int):
+        """吊销该用户此前签发的所有 token"""
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            self._users[user_id] = int(now)
+
+    def is_revoked(self, payload: dict) -> bool:
+        with self._lock:
+            if payload.get("jti") in self._tokens:
+                return True
+            revoked_at = self._users.get(payload.get("user_id"))
+        return revoked_at is not None and payload.get("iat", 0) < revoked_at
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"tokens": len(self._tokens), "users": len(self._users)}
+
+
+denylist = TokenDenylist()
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
-    """创建 JWT token"""
+    """创建 JWT token（默认有效期带随机浮动）"""
     to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS))
-    to_encode.update({"exp": expire})
+    if expires_delta is None:
+        jitter = random.uniform(-ACCESS_TOKEN_JITTER, ACCESS_TOKEN_JITTER)
+        expires_delta = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES * (1 + jitter))
+    expire = datetime.utcnow() + expires_delta
+    to_encode.update({"exp": expire, "iat": int(time.time()), "jti": uuid.uuid4().hex})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 def decode_token(token: str) -> dict:
@@ -39,38 +124,78 @@ def decode_token(token: str) -> dict:
             detail="无效的 Token"
         )
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
-    """获取当前登录用户"""
-    token = credentials.credentials
-    payload = decode_token(token)
+def verify_token(token: str) -> dict:
+    """验证 token，已验证过且未过期的直接从缓存返回"""
+    payload = _token_cache.get(token, None)
+    if payload is None:
+        payload = decode_token(token)
+        # 缓存时间不超过 token 剩余有效期
+        remaining = payload.get("exp", 0) - time.time()
+        if remaining > 0:
+            _token_cache.set(token, payload, ttl=min(TOKEN_CACHE_TTL, remaining))
     
-    user_id = payload.get("user_id")
-    if not user_id:
+    # 黑名单每次都要检查，缓存中的 token 也可能已被吊销
+    if denylist.is_revoked(payload):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="无效的认证信息"
+            detail="Token 已失效"
+        )
+    return payload
+
+async def load_principal(user_id: int) -> dict:
+    """按用户ID获取用户信息（带缓存），用户不存在时抛出 401"""
+    principal = _principal_cache.get(user_id, None)
+    if principal is None:
+        row = await fetch_one(
+            "SELECT id, student_id, name, role, first_login FROM users WHERE id = ?",
+            (user_id,)
         )
-    
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, student_id, name, role, first_login FROM users WHERE id = ?", (user_id,))
-        row = cursor.fetchone()
-        
         if not row:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="用户不存在"
             )
-        
-        return {
+        principal = {
             "id": row["id"],
             "student_id": row["student_id"],
             "name": row["name"],
             "role": row["role"],
             "first_login": bool(row["first_login"])
         }
+        _principal_cache.set(user_id, principal)
+    
+    # 返回副本，避免调用方修改缓存内容
+    return dict(principal)
+
+def invalidate_user(user_id: int):
+    """
+    用户信息变化（改密码、改角色、删除等）后清除认证缓存
+    token 缓存只保存签名校验结果，权限判断始终以用户信息为准，因此只需清除用户信息
+    """
+    _principal_cache.delete(user_id)
+
+def auth_cache_stats() -> dict:
+    """认证缓存统计信息"""
+    return {
+        "tokens": _token_cache.stats(),
+        "principals": _principal_cache.stats(),
+        "denylist": denylist.stats()
+    }
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    """获取当前登录用户"""
+    payload = verify_token(credentials.credentials)
+    
+    user_id = payload.get("user_id")
+    if not user_id:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="无效的认证信息"
+        )
+    
+    return await load_principal(user_id)
 
-def require_admin(current_user: dict = Depends(get_current_user)) -> dict:
+async def require_admin(current_user: dict = Depends(get_current_user)) -> dict:
     """要求管理员权限"""
     if current_user["role"] != "admin":
         raise HTTPException(
@@ -79,7 +204,7 @@ def require_admin(current_user: dict = Depends(get_current_user)) -> dict:
         )
     return current_user
 
-def require_super_admin(current_user: dict = Depends(get_current_user)) -> dict:
+async def require_super_admin(current_user: dict = Depends(get_current_user)) -> dict:
     """要求超级管理员权限"""
     if current_user["role"] != "super_admin":
         raise HTTPException(
@@ -88,7 +213,7 @@ def require_super_admin(current_user: dict = Depends(get_current_user)) -> dict:
         )
     return current_user
 
-def require_admin_or_super(current_user: dict = Depends(get_current_user)) -> dict:
+async def require_admin_or_super(current_user: dict = Depends(get_current_user)) -> dict:
     """要求管理员或超级管理员权限"""
     if current_user["role"] not in ["admin", "super_admin"]:
         raise HTTPException(
@@ -97,44 +222,181 @@ def require_admin_or_super(current_user: dict = Depends(get_current_user)) -> di
         )
     return current_user
 
-def authenticate_user(student_id: str, password: str) -> Optional[dict]:
-    """验证用户登录"""
-    with get_db() as conn:
+async def authenticate_user(student_id: str, password: str) -> Optional[dict]:
+    """
+    验证用户登录
+    密码校验在哈希线程池中执行；旧格式哈希在登录成功后升级为 scrypt
+    """
+    row = await fetch_one(
+        "SELECT id, student_id, password_hash, name, role, first_login FROM users WHERE student_id = ?",
+        (student_id,)
+    )
+    
+    if not row:
+        # 同样执行一次 scrypt 校验，登录耗时不会暴露学号是否存在
+        await verify_password_async(password, DUMMY_PASSWORD_HASH)
+        return None
+    
+    if not await verify_password_async(password, row["password_hash"]):
+        return None
+    
+    if needs_rehash(row["password_hash"]):
+        new_hash = await hash_password_async(password)
+        # 只在哈希未被并发修改时写入
+        await execute(
+            "UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?",
+            (new_hash, row["id"], row["password_hash"])
+        )
+    
+    return {
+        "id": row["id"],
+        "student_id": row["student_id"],
+        "name": row["name"],
+        "role": row["role"],
+        "first_login": bool(row["first_login"])
+    }
+
+async def change_user_password(user_id: int, old_password: str, new_password: str) -> Optional[dict]:
+    """
+    修改用户密码（哈希计算不占用数据库连接），原密码错误时返回 None
+    修改成功后吊销该用户全部登录状态，并为当前会话签发新的 access token 和刷新令牌
+    """
+    row = await fetch_one("SELECT id, role, password_hash FROM users WHERE id = ?", (user_id,))
+    if not row or not await verify_password_async(old_password, row["password_hash"]):
+        return None
+    
+    new_hash = await hash_password_async(new_password)
+
+    def _change(conn):
         cursor = conn.cursor()
+        # 校验期间密码被他人修改（如重置）时视为失败
         cursor.execute(
-            "SELECT id, student_id, password_hash, name, role, first_login FROM users WHERE student_id = ?",
-            (student_id,)
+            "UPDATE users SET password_hash = ?, first_login = 0 WHERE id = ? AND password_hash = ?",
+            (new_hash, user_id, row["password_hash"])
+        )
+        if not cursor.rowcount:
+            return None
+        # 其他设备上的登录状态（可能是泄露的旧密码登录的）全部失效
+        revoke_user_tokens(conn, user_id)
+        refresh_token = _insert_refresh_token(cursor, user_id, uuid.uuid4().hex)
+        conn.commit()
+        return refresh_token
+
+    refresh_token = await run_db(_change)
+    if refresh_token is None:
+        return None
+    invalidate_user(user_id)
+    return _token_pair(dict(row), refresh_token)
+
+
+# ==================== 刷新令牌 ====================
+
+def _hash_refresh_token(refresh_token: str) -> str:
+    """刷新令牌是高熵随机串，直接用 SHA-256 摘要存储即可"""
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+def _insert_refresh_token(cursor, user_id: int, family_id: str) -> str:
+    """生成并保存一个新的刷新令牌，返回明文（只交给客户端一次）"""
+    refresh_token = secrets.token_urlsafe(32)
+    cursor.execute(
+        """INSERT INTO refresh_tokens (user_id, token_hash, family_id, expires_at)
+           VALUES (?, ?, ?, datetime('now', ?))""",
+        (user_id, _hash_refresh_token(refresh_token), family_id, f"+{REFRESH_TOKEN_EXPIRE_DAYS} days")
+    )
+    return refresh_token
+
+def _token_pair(user: dict, refresh_token: str) -> dict:
+    return {
+        "token": create_access_token({"user_id": user["id"], "role": user["role"]}),
+        "refresh_token": refresh_token
+    }
+
+async def issue_tokens(user: dict) -> dict:
+    """登录成功后签发 access token 和新的刷新令牌链"""
+    def _issue(conn):
+        cursor = conn.cursor()
+        # 顺带清理该用户已过期的刷新令牌
+        cursor.execute(
+            "DELETE FROM refresh_tokens WHERE user_id = ? AND expires_at < datetime('now')",
+            (user["id"],)
+        )
+        refresh_token = _insert_refresh_token(cursor, user["id"], uuid.uuid4().hex)
+        conn.commit()
+        return refresh_token
+
+    return _token_pair(user, await run_db(_issue))
+
+async def refresh_tokens(refresh_token: str) -> dict:
+    """
+    用刷新令牌换取新的 access token（不再校验密码）
+    旧令牌立即作废并签发新令牌；已作废的令牌再次出现说明可能被盗用，吊销整条令牌链
+    """
+    token_hash = _hash_refresh_token(refresh_token)
+
+    def _rotate(conn):
+        cursor = conn.cursor()
+        # 条件更新保证同一个令牌只能成功轮换一次
+        cursor.execute(
+            """UPDATE refresh_tokens SET revoked_at = CURRENT_TIMESTAMP
+               WHERE token_hash = ? AND revoked_at IS NULL AND expires_at > datetime('now')""",
+            (token_hash,)
+        )
+        rotated = cursor.rowcount == 1
+        cursor.execute(
+            """SELECT user_id, family_id, revoked_at > datetime('now', ?) AS recently_revoked
+               FROM refresh_tokens WHERE token_hash = ?""",
+            (f"-{REFRESH_REUSE_GRACE_SECONDS} seconds", token_hash)
         )
         row = cursor.fetchone()
-        
         if not row:
             return None
-        
-        if not verify_password(password, row["password_hash"]):
-            return None
-        
-        return {
-            "id": row["id"],
-            "student_id": row["student_id"],
-            "name": row["name"],
-            "role": row["role"],
-            "first_login": bool(row["first_login"])
-        }
 
-def change_user_password(user_id: int, old_password: str, new_password: str) -> bool:
-    """修改用户密码"""
-    with get_db() as conn:
+        if rotated:
+            new_token = _insert_refresh_token(cursor, row["user_id"], row["family_id"])
+            conn.commit()
+            return row["user_id"], new_token
+
+        if not row["recently_revoked"]:
+            # 旧令牌被重放（或已过期）：吊销整条令牌链，需要重新登录
+            cursor.execute(
+                "UPDATE refresh_tokens SET revoked_at = CURRENT_TIMESTAMP WHERE family_id = ? AND revoked_at IS NULL",
+                (row["family_id"],)
+            )
+            conn.commit()
+        return None
+
+    result = await run_db(_rotate)
+    if not result:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="刷新令牌无效或已过期"
+        )
+    user_id, new_token = result
+    # 角色以当前用户信息为准，用户已删除时 load_principal 返回 401
+    user = await load_principal(user_id)
+    return _token_pair(user, new_token)
+
+async def revoke_refresh_token(refresh_token: str):
+    """注销：吊销该刷新令牌所在的整条令牌链"""
+    def _revoke(conn):
         cursor = conn.cursor()
-        cursor.execute("SELECT password_hash FROM users WHERE id = ?", (user_id,))
-        row = cursor.fetchone()
-        
-        if not row or not verify_password(old_password, row["password_hash"]):
-            return False
-        
-        new_hash = get_password_hash(new_password)
         cursor.execute(
-            "UPDATE users SET password_hash = ?, first_login = 0 WHERE id = ?",
-            (new_hash, user_id)
+            """UPDATE refresh_tokens SET revoked_at = CURRENT_TIMESTAMP
+               WHERE revoked_at IS NULL AND family_id =
+                     (SELECT family_id FROM refresh_tokens WHERE token_hash = ?)""",
+            (_hash_refresh_token(refresh_token),)
         )
         conn.commit()
-        return True
+
+    await run_db(_revoke)
+
+def revoke_user_tokens(conn, user_id: int):
+    """
+    吊销用户的全部登录状态（刷新令牌 + 已签发的 access token）
+    在调用方事务中执行，由调用方提交
+    """
+    conn.execute(
+        "UPDATE refresh_tokens SET revoked_at = CURRENT_TIMESTAMP WHERE user_id = ? AND revoked_at IS NULL",
+        (user_id,)
+    )
+    denylist.revoke_user(user_id)
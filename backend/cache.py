@@ -0,0 +1,127 @@
+"""
+进程内缓存
+- TTLCache: 有容量上限的 LRU 缓存，条目超过 TTL 后失效，记录命中率等统计
+- 图书目录缓存按"目录版本号"分区，图书或库存变化时递增版本号即可整体失效
+多 worker 部署时各进程的缓存相互独立，其他进程写入造成的陈旧数据最长保留 TTL 秒
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+_MISSING = object()
+
+
+class TTLCache:
+    """线程安全的 LRU + TTL 缓存"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, key: Hashable, default: Any = _MISSING) -> Any:
+        """读取缓存，未命中或已过期返回 default"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._data.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._data[key]
+                self._expirations += 1
+            self._misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._evictions += 1
+
+    def delete(self, key: Hashable):
+        """删除单个条目"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """命中直接返回，否则调用异步 loader 加载并写入缓存"""
+        value = self.get(key)
+        if value is not _MISSING:
+            return value
+        value = await loader()
+        self.set(key, value)
+        return value
+
+    def stats(self) -> dict:
+        """缓存统计信息"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
+
+
+# ==================== 图书目录缓存 ====================
+
+CATALOG_CACHE_SIZE = 2048
+CATALOG_CACHE_TTL = 30.0
+
+catalog_cache = TTLCache(maxsize=CATALOG_CACHE_SIZE, ttl=CATALOG_CACHE_TTL)
+
+_catalog_version = 0
+_catalog_version_lock = threading.Lock()
+
+
+def get_catalog_version() -> int:
+    """当前目录版本号"""
+    return _catalog_version
+
+
+def bump_catalog_version() -> int:
+    """
+    图书信息、库存或借阅状态变化后调用，使目录缓存整体失效
+    """
+    global _catalog_version
+    with _catalog_version_lock:
+        _catalog_version += 1
+        version = _catalog_version
+    catalog_cache.clear()
+    return version
+
+
+async def cached_catalog(key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    按目录版本号缓存读取结果
+    版本号在加载前取得，加载期间发生的写入不会让旧数据落到新版本下
+    """
+    return await catalog_cache.get_or_load((get_catalog_version(), key), loader)
+
+
+def catalog_cache_stats() -> dict:
+    """目录缓存统计信息（含当前版本号）"""
+    return {**catalog_cache.stats(), "version": get_catalog_version()}
@@ -99,19 +99,17 @@ async def download_pending_covers():
     下载所有状态为1（待下载）的封面
     应在应用启动时调用
     """
-    from database import get_db
+    from database import fetch_all, execute
+    from cache import bump_catalog_version
     
     print("检查待下载的封面...")
     
-    with get_db() as conn:
-        cursor = conn.cursor()
-        # 查询所有 cover_status=1 且有原始封面URL的书籍
-        cursor.execute("""
-            SELECT id, title, cover, isbn FROM books 
-            WHERE cover_status = 1 AND cover IS NOT NULL AND cover != ''
-            AND status = 'active'
-        """)
-        pending_books = cursor.fetchall()
+    # 查询所有 cover_status=1 且有原始封面URL的书籍
+    pending_books = await fetch_all("""
+        SELECT id, title, cover, isbn FROM books 
+        WHERE cover_status = 1 AND cover IS NOT NULL AND cover != ''
+        AND status = 'active'
+    """)
     
     if not pending_books:
         print("没有待下载的封面")
@@ -130,20 +128,18 @@ async def download_pending_covers():
         local_cover, status = await download_cover(cover_url, isbn)
         
         # 更新数据库
-        with get_db() as conn:
-            cursor = conn.cursor()
-            if status == COVER_STATUS_SUCCESS:
-                cursor.execute(
-                    "UPDATE books SET cover = ?, cover_status = 0 WHERE id = ?",
-                    (local_cover, book_id)
-                )
-                print(f"  ✓ 成功: {title}")
-            else:
-                cursor.execute(
-                    "UPDATE books SET cover_status = 2 WHERE id = ?",
-                    (book_id,)
-                )
-                print(f"  ✗ 失败: {title}")
-            conn.commit()
+        if status == COVER_STATUS_SUCCESS:
+            await execute(
+                "UPDATE books SET cover = ?, cover_status = 0 WHERE id = ?",
+                (local_cover, book_id)
+            )
+            print(f"  ✓ 成功: {title}")
+        else:
+            await execute(
+                "UPDATE books SET cover_status = 2 WHERE id = ?",
+                (book_id,)
+            )
+            print(f"  ✗ 失败: {title}")
+        bump_catalog_version()
     
     print("封面下载队列处理完成")
@@ -1,237 +1,273 @@
 """
-数据库模块 - SQLite3 连接和表结构初始化
+数据库模块 - SQLite3 连接池和异步数据访问
+表结构由 migrations.py 管理
 """
 import sqlite3
-import hashlib
+import asyncio
+import random
+import threading
 from pathlib import Path
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException
 
 # 数据库文件路径
 DB_PATH = Path(__file__).parent.parent / "library.db"
 
-def get_password_hash(password: str) -> str:
-    """生成密码哈希"""
-    return hashlib.sha256(password.encode()).hexdigest()
+# 连接池配置
+POOL_MAX_SIZE = 16          # 最多同时打开的连接数
+POOL_TIMEOUT = 30.0         # 连接池耗尽时的最长等待秒数
+BUSY_TIMEOUT_MS = 5000      # 写锁冲突时 SQLite 的等待毫秒数
+
+# 写事务重试配置（busy_timeout 之后仍拿不到写锁时）
+WRITE_RETRIES = 3           # 最多重试次数
+WRITE_RETRY_BACKOFF = 0.05  # 首次重试前的等待秒数，之后指数增长
+
+# 每个连接创建时执行一次的 PRAGMA
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    "PRAGMA cache_size = -16000",      # 约 16MB 页缓存
+    "PRAGMA mmap_size = 268435456",    # 256MB 内存映射
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA foreign_keys = ON",
+)
+
+
+class ConnectionPool:
+    """
+    SQLite 连接池
+    - 连接创建时统一设置 PRAGMA，之后反复复用
+    - 优先把线程上次归还的连接交还给同一线程，减少跨线程切换
+    - 打开的连接数不超过 max_size，耗尽时等待其他请求归还
+    """
+
+    def __init__(self, db_path: Path, max_size: int = POOL_MAX_SIZE, timeout: float = POOL_TIMEOUT):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = []
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        self._open = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._reuses = 0
+        self._waits = 0
+        self._timeouts = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """创建并调优一个新连接"""
+        conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """取出一个连接"""
+        with self._cond:
+            self._checkouts += 1
+            waited = False
+            while True:
+                if self._idle:
+                    # 优先取回本线程上次使用的连接
+                    preferred = getattr(self._local, "conn", None)
+                    if preferred is not None and preferred in self._idle:
+                        self._idle.remove(preferred)
+                        conn = preferred
+                    else:
+                        conn = self._idle.pop()
+                    self._reuses += 1
+                    break
+                if self._open < self.max_size:
+                    self._open += 1
+                    conn = None
+                    break
+                if not waited:
+                    self._waits += 1
+                    waited = True
+                if not self._cond.wait(self.timeout):
+                    self._timeouts += 1
+                    raise sqlite3.OperationalError("数据库连接池已耗尽")
+            self._in_use += 1
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._open -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+        self._local.conn = conn
+        return conn
+
+    def release(self, conn: sqlite3.Connection, discard: bool = False):
+        """归还连接，未提交的事务会被回滚"""
+        if not discard:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._open -= 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+        if discard:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def close_all(self):
+        """关闭所有空闲连接（应用关闭时调用）"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> dict:
+        """连接池统计信息"""
+        with self._cond:
+            return {
+                "max_size": self.max_size,
+                "open": self._open,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "reuses": self._reuses,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+            }
+
+
+# 全局连接池
+pool = ConnectionPool(DB_PATH)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """验证密码"""
-    return get_password_hash(plain_password) == hashed_password
 
 @contextmanager
 def get_db():
-    """获取数据库连接的上下文管理器"""
-    conn = sqlite3.connect(str(DB_PATH))
-    conn.row_factory = sqlite3.Row
+    """从连接池获取数据库连接的上下文管理器"""
+    conn = pool.acquire()
     try:
         yield conn
     finally:
-        conn.close()
-
-def init_db():
-    """初始化数据库表结构"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        
-        # 用户表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                student_id TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                name TEXT NOT NULL,
-                role TEXT NOT NULL DEFAULT 'student',
-                first_login INTEGER DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # 图书表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS books (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                author TEXT NOT NULL,
-                isbn TEXT UNIQUE,
-                category TEXT NOT NULL DEFAULT '其它',
-                cover TEXT,
-                cover_status INTEGER DEFAULT 1,
-                total_count INTEGER DEFAULT 1,
-                available_count INTEGER DEFAULT 1,
-                status TEXT DEFAULT 'active',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # 检查并添加 cover_status 列（数据库迁移）
-        cursor.execute("PRAGMA table_info(books)")
-        columns = [row[1] for row in cursor.fetchall()]
-        if 'cover_status' not in columns:
-            cursor.execute("ALTER TABLE books ADD COLUMN cover_status INTEGER DEFAULT 1")
-            # 根据现有封面路径设置状态：本地路径设为0，其他设为1
-            cursor.execute("""
-                UPDATE books SET cover_status = CASE 
-                    WHEN cover LIKE '/api/covers/%' THEN 0 
-                    WHEN cover IS NULL OR cover = '' THEN 2
-                    ELSE 1 
-                END
-            """)
-        
-        # 借阅记录表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS borrow_records (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                book_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                borrow_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                due_date TIMESTAMP,
-                return_date TIMESTAMP,
-                status TEXT DEFAULT 'borrowed',
-                FOREIGN KEY (book_id) REFERENCES books(id),
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        ''')
-
-        # 评论表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS reviews (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                book_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                rating INTEGER NOT NULL CHECK(rating >= 1 AND rating <= 5),
-                content TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (book_id) REFERENCES books(id),
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        ''')
-
-        # 收藏表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS favorites (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                book_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(book_id, user_id),
-                FOREIGN KEY (book_id) REFERENCES books(id),
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        ''')
-
-        # 系统设置表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS system_settings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                key TEXT UNIQUE NOT NULL,
-                value TEXT NOT NULL,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # 消息表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sender_name TEXT NOT NULL DEFAULT 'system',
-                receiver_id INTEGER NOT NULL,
-                title TEXT NOT NULL,
-                content TEXT,
-                is_read INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (receiver_id) REFERENCES users(id)
-            )
-        ''')
-
-        # 操作日志表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS operation_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                action TEXT NOT NULL,
-                detail TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        ''')
-        
-        # 检查并添加 location 列（数据库迁移）
-        cursor.execute("PRAGMA table_info(books)")
-        columns = [row[1] for row in cursor.fetchall()]
-        if 'location' not in columns:
-            cursor.execute("ALTER TABLE books ADD COLUMN location TEXT")
-        
-        conn.commit()
+        pool.release(conn)
 
-        # 初始化系统设置
-        default_settings = [
-            ('min_borrow_days', '1'),
-            ('max_borrow_days', '60'),
-            ('fine_per_day', '0.5'),
-        ]
-        for key, value in default_settings:
-            cursor.execute("SELECT id FROM system_settings WHERE key = ?", (key,))
-            if not cursor.fetchone():
-                cursor.execute('''
-                    INSERT INTO system_settings (key, value) VALUES (?, ?)
-                ''', (key, value))
-        conn.commit()
-        
-        # 检查并创建超级管理员账号
-        cursor.execute("SELECT id FROM users WHERE student_id = 'superadmin'")
-        if not cursor.fetchone():
-            cursor.execute('''
-                INSERT INTO users (student_id, password_hash, name, role, first_login)
-                VALUES (?, ?, ?, ?, ?)
-            ''', ('superadmin', get_password_hash('superadmin123'), '超级管理员', 'super_admin', 0))
-            conn.commit()
-
-        # 检查并创建管理员账号
-        cursor.execute("SELECT id FROM users WHERE student_id = 'admin'")
-        if not cursor.fetchone():
-            cursor.execute('''
-                INSERT INTO users (student_id, password_hash, name, role, first_login)
-                VALUES (?, ?, ?, ?, ?)
-            ''', ('admin', get_password_hash('admin123'), '系统管理员', 'admin', 0))
-            conn.commit()
-        
-        # 创建测试学生账号
-        test_students = [
-            ('20210001', '张三'),
-            ('20210002', '李四'),
-            ('20210003', '王五'),
-            ('20210004', '赵六'),
-            ('20210005', '钱七'),
-        ]
-        
-        for student_id, name in test_students:
-            cursor.execute("SELECT id FROM users WHERE student_id = ?", (student_id,))
-            if not cursor.fetchone():
-                cursor.execute('''
-                    INSERT INTO users (student_id, password_hash, name, role, first_login)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (student_id, get_password_hash('12345678'), name, 'student', 1))
-        
-        # 创建示例图书
-        sample_books = [
-            ('Python编程：从入门到实践', 'Eric Matthes', '9787115546081', '编程'),
-            ('深入理解计算机系统', 'Randal E. Bryant', '9787111544937', '编程'),
-            ('算法导论', 'Thomas H. Cormen', '9787111407010', '编程'),
-            ('百年孤独', '加西亚·马尔克斯', '9787544291170', '文学'),
-            ('三体', '刘慈欣', '9787536692930', '科幻'),
-            ('人类简史', '尤瓦尔·赫拉利', '9787508647357', '科技'),
-            ('设计心理学', '唐纳德·诺曼', '9787508648330', '艺术'),
-        ]
-        
-        for title, author, isbn, category in sample_books:
-            cursor.execute("SELECT id FROM books WHERE isbn = ?", (isbn,))
-            if not cursor.fetchone():
-                cursor.execute('''
-                    INSERT INTO books (title, author, isbn, category, total_count, available_count)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (title, author, isbn, category, 3, 3))
-        
+
+def get_pool_stats() -> dict:
+    """获取连接池统计信息"""
+    return pool.stats()
+
+
+# ==================== 异步数据访问 ====================
+# 路由都是 async def，直接调用 sqlite3 会阻塞事件循环。
+# 所有数据库操作统一交给有界线程池执行，线程数与连接池大小一致，
+# 因此工作线程拿连接时不会在连接池上排队。
+
+_db_executor = ThreadPoolExecutor(max_workers=POOL_MAX_SIZE, thread_name_prefix="db")
+
+
+async def run_db(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    在数据库线程池中执行 func(conn, *args, **kwargs) 并返回其结果
+    适用于需要多条语句/事务的操作，func 内抛出的异常会原样传递给调用方
+    """
+    def _call():
+        with get_db() as conn:
+            return func(conn, *args, **kwargs)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, _call)
+
+
+async def fetch_one(query: str, params: tuple = ()) -> Optional[dict]:
+    """查询单行，返回 dict 或 None"""
+    def _fetch(conn):
+        row = conn.execute(query, params).fetchone()
+        return dict(row) if row else None
+    return await run_db(_fetch)
+
+
+async def fetch_all(query: str, params: tuple = ()) -> list:
+    """查询多行，返回 dict 列表"""
+    def _fetch(conn):
+        return [dict(row) for row in conn.execute(query, params).fetchall()]
+    return await run_db(_fetch)
+
+
+async def fetch_value(query: str, params: tuple = (), default: Any = None) -> Any:
+    """查询单个值（第一行第一列）"""
+    def _fetch(conn):
+        row = conn.execute(query, params).fetchone()
+        return row[0] if row else default
+    return await run_db(_fetch)
+
+
+async def execute(query: str, params: tuple = ()) -> int:
+    """执行单条写语句并提交，返回受影响的行数"""
+    def _execute(conn):
+        cursor = conn.execute(query, params)
         conn.commit()
-        print("数据库初始化完成")
+        return cursor.rowcount
+    return await run_db(_execute)
+
+
+def is_busy_error(exc: Exception) -> bool:
+    """是否为写锁冲突（database is locked / busy）"""
+    if not isinstance(exc, sqlite3.OperationalError):
+        return False
+    code = getattr(exc, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    message = str(exc)
+    return "locked" in message or "busy" in message
+
+
+async def run_write(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    在 BEGIN IMMEDIATE 事务中执行 func(conn, *args, **kwargs) 并提交
+    - 事务开始即持有写锁，读-判断-写之间不会被其他写事务插入，也不会在提交时才发现锁冲突
+    - func 不需要自己 commit；抛出异常时整个事务回滚
+    - 写锁冲突时按指数退避重试，重试期间不占用数据库线程，超过次数返回 503
+    """
+    def _call():
+        with get_db() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(conn, *args, **kwargs)
+                conn.commit()
+                return result
+            except BaseException:
+                conn.rollback()
+                raise
+
+    loop = asyncio.get_running_loop()
+    for attempt in range(WRITE_RETRIES + 1):
+        try:
+            return await loop.run_in_executor(_db_executor, _call)
+        except sqlite3.OperationalError as exc:
+            if not is_busy_error(exc):
+                raise
+            if attempt == WRITE_RETRIES:
+                raise HTTPException(status_code=503, detail="系统繁忙，请稍后重试")
+        # 随机化退避时间，避免冲突的请求同时重试
+        await asyncio.sleep(WRITE_RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))
+
 
-# 模块加载时自动初始化数据库
-init_db()
+def shutdown_db():
+    """关闭数据库线程池和连接池（应用关闭时调用）"""
+    _db_executor.shutdown(wait=True)
+    pool.close_all()
@@ -0,0 +1,98 @@
+"""
+HTTP 条件请求支持 (ETag / If-None-Match / Last-Modified)
+- JSON 响应在写入缓存时就序列化为字节并计算强 ETag，
+  命中 If-None-Match 时直接返回 304，不再构建响应体
+- 文件响应根据修改时间和大小生成 ETag
+"""
+import hashlib
+import json
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Any, Optional
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+# 目录数据可能随时变化，浏览器每次都需要带 ETag 重新验证
+JSON_CACHE_CONTROL = "private, no-cache"
+# 封面文件名基本不变，允许浏览器缓存一天
+COVER_CACHE_CONTROL = "public, max-age=86400"
+
+
+class CachedJSON:
+    """预先序列化的 JSON 响应体及其 ETag"""
+
+    __slots__ = ("body", "etag")
+
+    def __init__(self, data: Any):
+        self.body = json.dumps(
+            data, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8")
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """按 If-None-Match 的弱比较规则判断 ETag 是否匹配"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    target = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == target:
+            return True
+    return False
+
+
+def not_modified(etag: str, cache_control: str, last_modified: str = None) -> Response:
+    """304 响应，只带验证相关的响应头"""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified:
+        headers["Last-Modified"] = last_modified
+    return Response(status_code=304, headers=headers)
+
+
+def json_response(request: Request, cached: CachedJSON,
+                  cache_control: str = JSON_CACHE_CONTROL) -> Response:
+    """返回预序列化的 JSON，客户端 ETag 一致时返回 304"""
+    if etag_matches(request.headers.get("if-none-match"), cached.etag):
+        return not_modified(cached.etag, cache_control)
+    return Response(
+        content=cached.body,
+        media_type="application/json",
+        headers={"ETag": cached.etag, "Cache-Control": cache_control},
+    )
+
+
+def file_response(request: Request, path: Path, media_type: str,
+                  cache_control: str = COVER_CACHE_CONTROL) -> Response:
+    """返回文件，支持 If-None-Match / If-Modified-Since"""
+    stat = os.stat(path)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # 有 If-None-Match 时忽略 If-Modified-Since
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag, cache_control, last_modified)
+    else:
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                since = None
+            if since is not None and int(stat.st_mtime) <= since:
+                return not_modified(etag, cache_control, last_modified)
+
+    return FileResponse(
+        path,
+        media_type=media_type,
+        headers={"ETag": etag, "Last-Modified": last_modified, "Cache-Control": cache_control},
+        stat_result=stat,
+    )
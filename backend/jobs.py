@@ -0,0 +1,71 @@
+"""
+后台定时任务
+- 任务在应用的事件循环中周期运行，数据库操作仍通过 run_db / run_write 交给线程池
+- 单次执行失败只打印错误，不影响下一次执行
+多 worker 部署时每个进程都会运行一份，任务需保证重复执行是安全的
+"""
+import asyncio
+import traceback
+from typing import Awaitable, Callable
+
+# 已注册的任务: [(名称, 间隔秒数, 异步函数)]
+JOBS = []
+
+_tasks = []
+
+
+def job(name: str, interval: float):
+    """注册一个定时任务，函数签名为 async func()"""
+    def decorator(func: Callable[[], Awaitable[None]]):
+        JOBS.append((name, interval, func))
+        return func
+    return decorator
+
+
+async def _run_periodically(name: str, interval: float, func: Callable[[], Awaitable[None]]):
+    while True:
+        try:
+            await func()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            print(f"定时任务 {name} 执行失败:")
+            traceback.print_exc()
+        await asyncio.sleep(interval)
+
+
+def start_jobs():
+    """启动所有已注册的任务（应用启动时调用）"""
+    for name, interval, func in JOBS:
+        _tasks.append(asyncio.create_task(_run_periodically(name, interval, func), name=f"job:{name}"))
+
+
+async def stop_jobs():
+    """停止所有任务（应用关闭时调用）"""
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+
+
+# ==================== 任务注册 ====================
+
+@job("holds_expiry", interval=300)
+async def _expire_holds():
+    """处理逾期未取的预约"""
+    from routers.holds import expire_holds_job
+    await expire_holds_job()
+
+
+@job("overdue_fines", interval=600)
+async def _refresh_overdue_fines():
+    """刷新逾期罚款表"""
+    from routers.fines import refresh_overdue_fines_job
+    await refresh_overdue_fines_job()
+
+
+@job("overdue_reminders", interval=3600)
+async def _send_overdue_reminders():
+    """自动发送逾期提醒（系统设置中开启时）"""
+    from routers.fines import overdue_reminders_job
+    await overdue_reminders_job()
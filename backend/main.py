@@ -4,17 +4,21 @@ Vue + FastAPI + SQLite3
 """
 from contextlib import asynccontextmanager
 import asyncio
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Depends
+from fastapi.security import HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 import os
 
 # 导入后端模块
-from database import get_db, get_password_hash, verify_password
-from auth import create_access_token, authenticate_user, change_user_password, get_current_user
-from models import LoginRequest, LoginResponse, ChangePasswordRequest, MessageResponse
-from routers import books, borrow, users, social, batch, admin, messages
+from database import get_db
+from auth import (
+    authenticate_user, change_user_password, get_current_user,
+    issue_tokens, refresh_tokens, revoke_refresh_token, decode_token, denylist, optional_security
+)
+from models import LoginRequest, LoginResponse, ChangePasswordRequest, ChangePasswordResponse, MessageResponse, RefreshRequest, TokenResponse
+from routers import books, borrow, users, social, batch, admin, messages, holds, fines
 
 
 # ==================== 生命周期管理 ====================
@@ -23,13 +27,31 @@ from routers import books, borrow, users, social, batch, admin, messages
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
     from covers_util import download_pending_covers
+    from migrations import run_migrations
+    from jobs import start_jobs, stop_jobs
+    from audit import start_audit, stop_audit
+    
+    # 启动时：执行未应用的数据库迁移（已是最新版本时直接跳过）
+    run_migrations()
     
     # 启动时：在后台任务中下载待处理的封面
     asyncio.create_task(download_pending_covers())
     
+    # 启动时：开始运行定时任务（预约过期等）和操作日志后台写入
+    start_jobs()
+    start_audit()
+    
     yield
     
-    # 关闭时（可选）
+    # 关闭时：先停止定时任务，再写入缓冲中的操作日志
+    await stop_jobs()
+    await stop_audit()
+    
+    # 关闭时：等待数据库线程池、密码哈希线程池结束并释放连接
+    from database import shutdown_db
+    from passwords import shutdown_hashing
+    shutdown_db()
+    shutdown_hashing()
 
 app = FastAPI(title="图书管理系统", version="2.0.0", lifespan=lifespan)
 
@@ -40,6 +62,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # 获取当前绝对路径 (backend directory)
@@ -52,18 +75,38 @@ frontend_path = os.path.join(backend_path, "res")
 @app.post("/api/auth/login", response_model=LoginResponse)
 async def login(request: LoginRequest):
     """用户登录"""
-    user = authenticate_user(request.student_id, request.password)
+    user = await authenticate_user(request.student_id, request.password)
     if not user:
         raise HTTPException(status_code=401, detail="学号或密码错误")
     
-    token = create_access_token({"user_id": user["id"], "role": user["role"]})
+    tokens = await issue_tokens(user)
     
     return LoginResponse(
-        token=token,
+        token=tokens["token"],
+        refresh_token=tokens["refresh_token"],
         user=user,
         first_login=user["first_login"]
     )
 
+@app.post("/api/auth/refresh", response_model=TokenResponse)
+async def refresh(request: RefreshRequest):
+    """用刷新令牌换取新的 access token（刷新令牌同时轮换）"""
+    return TokenResponse(**await refresh_tokens(request.refresh_token))
+
+@app.post("/api/auth/logout", response_model=MessageResponse)
+async def logout(
+    request: RefreshRequest,
+    credentials: HTTPAuthorizationCredentials = Depends(optional_security)
+):
+    """退出登录：吊销刷新令牌链和当前 access token"""
+    await revoke_refresh_token(request.refresh_token)
+    if credentials:
+        try:
+            denylist.revoke_token(decode_token(credentials.credentials))
+        except HTTPException:
+            pass  # token 已过期或无效，无需吊销
+    return MessageResponse(message="已退出登录")
+
 @app.post("/api/auth/change-password", response_model=MessageResponse)
 async def change_password(request: ChangePasswordRequest, current_user: dict = None):
     """修改密码"""
@@ -74,25 +117,25 @@ async def change_password(request: ChangePasswordRequest, current_user: dict = N
     # 在实际调用时，前端会传递 token
     pass
 
-@app.post("/api/auth/change-password-with-token")
+@app.post("/api/auth/change-password-with-token", response_model=ChangePasswordResponse)
 async def change_password_with_token(
     request: ChangePasswordRequest,
     token: str
 ):
-    """使用 token 修改密码"""
-    from auth import decode_token
+    """使用 token 修改密码（原有登录状态全部失效，返回当前会话的新 token）"""
+    from auth import verify_token
     
-    payload = decode_token(token)
+    payload = verify_token(token)
     user_id = payload.get("user_id")
     
     if not user_id:
         raise HTTPException(status_code=401, detail="无效的认证信息")
     
-    success = change_user_password(user_id, request.old_password, request.new_password)
-    if not success:
+    tokens = await change_user_password(user_id, request.old_password, request.new_password)
+    if not tokens:
         raise HTTPException(status_code=400, detail="原密码错误")
     
-    return MessageResponse(message="密码修改成功")
+    return ChangePasswordResponse(message="密码修改成功", **tokens)
 
 # ==================== 注册路由 ====================
 
@@ -103,17 +146,20 @@ app.include_router(social.router)
 app.include_router(batch.router)
 app.include_router(admin.router)
 app.include_router(messages.router)
+app.include_router(holds.router)
+app.include_router(fines.router)
 
 # ==================== 封面图片服务 ====================
 
 @app.get("/api/covers/{filename}")
-async def serve_cover(filename: str):
-    """提供本地封面图片"""
+async def serve_cover(filename: str, request: Request):
+    """提供本地封面图片（带 ETag / Last-Modified，可被浏览器缓存）"""
     from covers_util import get_cover_path
+    from http_cache import file_response
     
     filepath = get_cover_path(filename)
-    if filepath.exists():
-        return FileResponse(filepath, media_type="image/jpeg")
+    if filepath.is_file():
+        return file_response(request, filepath, media_type="image/jpeg")
     else:
         raise HTTPException(status_code=404, detail="封面不存在")
 
@@ -0,0 +1,124 @@
+"""
+管理命令行工具
+用法:
+    python manage.py migrate    执行数据库迁移
+    python manage.py seed       写入演示数据（测试学生账号和示例图书）
+    python manage.py check-stats [--fix]
+                                全量重算统计数据并报告偏差，--fix 时修复
+"""
+import argparse
+
+from database import get_db
+from passwords import hash_password
+from migrations import (
+    run_migrations, get_schema_version,
+    compute_catalog_stats, read_catalog_stats, rebuild_catalog_stats
+)
+
+
+def cmd_migrate(args):
+    """执行数据库迁移"""
+    applied = run_migrations()
+    with get_db() as conn:
+        version = get_schema_version(conn)
+    if applied:
+        print(f"已执行 {applied} 个迁移，当前版本 {version}")
+    else:
+        print(f"数据库已是最新版本 {version}")
+
+
+def cmd_seed(args):
+    """写入演示数据，已存在的记录会跳过"""
+    run_migrations()
+
+    # 测试学生账号
+    test_students = [
+        ('20210001', '张三'),
+        ('20210002', '李四'),
+        ('20210003', '王五'),
+        ('20210004', '赵六'),
+        ('20210005', '钱七'),
+    ]
+
+    # 示例图书
+    sample_books = [
+        ('Python编程：从入门到实践', 'Eric Matthes', '9787115546081', '编程'),
+        ('深入理解计算机系统', 'Randal E. Bryant', '9787111544937', '编程'),
+        ('算法导论', 'Thomas H. Cormen', '9787111407010', '编程'),
+        ('百年孤独', '加西亚·马尔克斯', '9787544291170', '文学'),
+        ('三体', '刘慈欣', '9787536692930', '科幻'),
+        ('人类简史', '尤瓦尔·赫拉利', '9787508647357', '科技'),
+        ('设计心理学', '唐纳德·诺曼', '9787508648330', '艺术'),
+    ]
+
+    default_hash = hash_password('12345678')
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT OR IGNORE INTO users (student_id, password_hash, name, role, first_login)
+            VALUES (?, ?, ?, 'student', 1)
+        ''', [(student_id, default_hash, name) for student_id, name in test_students])
+        students_added = cursor.rowcount
+
+        cursor.executemany('''
+            INSERT OR IGNORE INTO books (title, author, isbn, category, total_count, available_count)
+            VALUES (?, ?, ?, ?, 3, 3)
+        ''', sample_books)
+        books_added = cursor.rowcount
+
+        conn.commit()
+
+    print(f"演示数据写入完成: 学生 {students_added} 个, 图书 {books_added} 本")
+
+
+def cmd_check_stats(args):
+    """全量重算统计数据，与物化值比较并报告偏差"""
+    run_migrations()
+
+    with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.cursor()
+        expected = compute_catalog_stats(cursor)
+        actual = read_catalog_stats(cursor)
+
+        drift = {
+            key: (actual[key], value)
+            for key, value in expected.items()
+            if actual[key] != value
+        }
+
+        if not drift:
+            print("统计数据一致: " + ", ".join(f"{k}={v}" for k, v in expected.items()))
+            conn.rollback()
+            return
+
+        for key, (stored, value) in drift.items():
+            print(f"偏差 {key}: 物化值 {stored}, 实际值 {value}")
+
+        if args.fix:
+            rebuild_catalog_stats(cursor)
+            conn.commit()
+            print("已重建统计数据")
+        else:
+            conn.rollback()
+            raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图书管理系统管理工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("migrate", help="执行数据库迁移").set_defaults(func=cmd_migrate)
+    subparsers.add_parser("seed", help="写入演示数据").set_defaults(func=cmd_seed)
+
+    check_parser = subparsers.add_parser("check-stats", help="检查统计数据一致性")
+    check_parser.add_argument("--fix", action="store_true", help="发现偏差时重建统计数据")
+    check_parser.set_defaults(func=cmd_check_stats)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,796 @@
+"""
+数据库迁移 - 基于 PRAGMA user_version 的版本化迁移
+- 每个迁移有唯一递增的版本号，只执行一次
+- 启动时版本已是最新则直接跳过，不再执行任何建表语句
+- 迁移在排它锁内执行，多个 worker 同时启动时只有一个会真正执行，
+  其他 worker 等待锁释放（大库上的数据回填可能持续数分钟），之后发现版本已是最新直接跳过
+"""
+import sqlite3
+import time
+
+from database import get_db, is_busy_error
+from passwords import hash_password
+
+# 等待其他 worker 执行迁移的最长秒数，超过后启动失败
+MIGRATION_LOCK_TIMEOUT = 3600
+# 等待期间重试加锁的间隔秒数
+MIGRATION_LOCK_RETRY = 1.0
+
+# 已注册的迁移: [(版本号, 说明, 函数)]
+MIGRATIONS = []
+
+
+def migration(version: int, description: str):
+    """注册一个迁移，函数签名为 func(cursor)"""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+def latest_version() -> int:
+    """最新的迁移版本号"""
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """读取数据库当前的版本号"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _acquire_migration_lock(conn: sqlite3.Connection):
+    """
+    获取迁移排它锁
+    连接的 busy_timeout 只有几秒，其他 worker 正在执行耗时迁移时会超时，这里循环重试直到拿到锁
+    """
+    deadline = time.monotonic() + MIGRATION_LOCK_TIMEOUT
+    waiting = False
+    while True:
+        try:
+            conn.execute("BEGIN EXCLUSIVE")
+            return
+        except sqlite3.OperationalError as exc:
+            if not is_busy_error(exc) or time.monotonic() >= deadline:
+                raise
+        if not waiting:
+            print("其他进程正在执行数据库迁移，等待完成...")
+            waiting = True
+        time.sleep(MIGRATION_LOCK_RETRY)
+
+
+def run_migrations() -> int:
+    """
+    执行所有未应用的迁移，返回执行的迁移数量
+    """
+    target = latest_version()
+
+    with get_db() as conn:
+        # 快速路径：已是最新版本，不加锁
+        if get_schema_version(conn) >= target:
+            return 0
+
+        # 加排它锁后重新读取版本，其他 worker 可能已经完成迁移
+        _acquire_migration_lock(conn)
+        try:
+            current = get_schema_version(conn)
+            applied = 0
+            cursor = conn.cursor()
+            for version, description, func in MIGRATIONS:
+                if version <= current:
+                    continue
+                print(f"执行数据库迁移 {version}: {description}")
+                func(cursor)
+                cursor.execute(f"PRAGMA user_version = {int(version)}")
+                applied += 1
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    if applied:
+        print(f"数据库迁移完成，当前版本 {target}")
+    return applied
+
+
+# ==================== 迁移定义 ====================
+
+@migration(1, "基础表结构、系统设置和管理员账号")
+def _baseline_schema(cursor):
+    # 用户表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            name TEXT NOT NULL,
+            role TEXT NOT NULL DEFAULT 'student',
+            first_login INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # 图书表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS books (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            author TEXT NOT NULL,
+            isbn TEXT UNIQUE,
+            category TEXT NOT NULL DEFAULT '其它',
+            cover TEXT,
+            cover_status INTEGER DEFAULT 1,
+            total_count INTEGER DEFAULT 1,
+            available_count INTEGER DEFAULT 1,
+            status TEXT DEFAULT 'active',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            location TEXT
+        )
+    ''')
+
+    # 旧版数据库可能缺少 cover_status / location 列
+    cursor.execute("PRAGMA table_info(books)")
+    columns = [row[1] for row in cursor.fetchall()]
+    if 'cover_status' not in columns:
+        cursor.execute("ALTER TABLE books ADD COLUMN cover_status INTEGER DEFAULT 1")
+        # 根据现有封面路径设置状态：本地路径设为0，其他设为1
+        cursor.execute("""
+            UPDATE books SET cover_status = CASE
+                WHEN cover LIKE '/api/covers/%' THEN 0
+                WHEN cover IS NULL OR cover = '' THEN 2
+                ELSE 1
+            END
+        """)
+    if 'location' not in columns:
+        cursor.execute("ALTER TABLE books ADD COLUMN location TEXT")
+
+    # 借阅记录表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS borrow_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            book_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            borrow_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            due_date TIMESTAMP,
+            return_date TIMESTAMP,
+            status TEXT DEFAULT 'borrowed',
+            FOREIGN KEY (book_id) REFERENCES books(id),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+
+    # 评论表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reviews (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            book_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            rating INTEGER NOT NULL CHECK(rating >= 1 AND rating <= 5),
+            content TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (book_id) REFERENCES books(id),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+
+    # 收藏表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS favorites (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            book_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(book_id, user_id),
+            FOREIGN KEY (book_id) REFERENCES books(id),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+
+    # 系统设置表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS system_settings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            key TEXT UNIQUE NOT NULL,
+            value TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # 消息表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender_name TEXT NOT NULL DEFAULT 'system',
+            receiver_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            content TEXT,
+            is_read INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (receiver_id) REFERENCES users(id)
+        )
+    ''')
+
+    # 操作日志表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS operation_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            action TEXT NOT NULL,
+            detail TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+
+    # 初始化系统设置
+    cursor.executemany(
+        "INSERT OR IGNORE INTO system_settings (key, value) VALUES (?, ?)",
+        [
+            ('min_borrow_days', '1'),
+            ('max_borrow_days', '60'),
+            ('fine_per_day', '0.5'),
+        ]
+    )
+
+    # 超级管理员和管理员账号
+    cursor.executemany('''
+        INSERT OR IGNORE INTO users (student_id, password_hash, name, role, first_login)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [
+        ('superadmin', hash_password('superadmin123'), '超级管理员', 'super_admin', 0),
+        ('admin', hash_password('admin123'), '系统管理员', 'admin', 0),
+    ])
+
+
+@migration(2, "热点查询索引")
+def _hot_path_indexes(cursor):
+    # 覆盖各路由的热点查询；过滤条件固定的查询使用部分索引。
+    # 统一使用 IF NOT EXISTS，已手动建过索引的数据库也可安全执行。
+    indexes = [
+        # 图书：上架列表按时间倒序 / 分类筛选 / 分类、作者去重统计
+        "CREATE INDEX IF NOT EXISTS idx_books_active_created ON books(created_at) WHERE status = 'active'",
+        "CREATE INDEX IF NOT EXISTS idx_books_active_category ON books(category, created_at) WHERE status = 'active'",
+        "CREATE INDEX IF NOT EXISTS idx_books_active_author ON books(author) WHERE status = 'active'",
+
+        # 借阅记录：我的借阅 / 全部记录按时间倒序
+        "CREATE INDEX IF NOT EXISTS idx_borrow_user_date ON borrow_records(user_id, borrow_date)",
+        "CREATE INDEX IF NOT EXISTS idx_borrow_date ON borrow_records(borrow_date)",
+        # 借阅记录：在借查询（重复借阅检查、还书、下架检查、删除用户检查）
+        "CREATE INDEX IF NOT EXISTS idx_borrow_active_book_user ON borrow_records(book_id, user_id) WHERE status = 'borrowed'",
+        "CREATE INDEX IF NOT EXISTS idx_borrow_active_user ON borrow_records(user_id) WHERE status = 'borrowed'",
+        # 借阅记录：逾期扫描
+        "CREATE INDEX IF NOT EXISTS idx_borrow_active_due ON borrow_records(due_date) WHERE status = 'borrowed'",
+
+        # 评论：按图书列出 / 按用户查找
+        "CREATE INDEX IF NOT EXISTS idx_reviews_book_created ON reviews(book_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_reviews_user ON reviews(user_id, book_id)",
+
+        # 收藏：我的收藏按时间倒序（book_id, user_id 已有 UNIQUE 索引）
+        "CREATE INDEX IF NOT EXISTS idx_favorites_user_created ON favorites(user_id, created_at)",
+
+        # 消息：消息列表 / 未读数
+        "CREATE INDEX IF NOT EXISTS idx_messages_receiver_created ON messages(receiver_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_receiver_unread ON messages(receiver_id, created_at) WHERE is_read = 0",
+
+        # 操作日志：按时间倒序 / 按用户
+        "CREATE INDEX IF NOT EXISTS idx_logs_created ON operation_logs(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_logs_user ON operation_logs(user_id)",
+
+        # 用户：按角色筛选 / 列表按时间倒序
+        "CREATE INDEX IF NOT EXISTS idx_users_role ON users(role, name)",
+        "CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at)",
+    ]
+    for sql in indexes:
+        cursor.execute(sql)
+    # 新建索引后更新查询规划器的统计信息
+    cursor.execute("PRAGMA optimize")
+
+
+@migration(3, "图书全文检索索引 (FTS5 trigram)")
+def _books_fulltext(cursor):
+    # 外部内容表：只保存索引，内容从 books 读取；只索引上架中的图书。
+    # trigram 分词按 3 个字符切分，对中文书名无需额外分词器。
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            title, author, isbn,
+            content='books', content_rowid='id',
+            tokenize='trigram'
+        )
+    ''')
+
+    # 触发器保持索引与 books 同步（新增 / 修改 / 下架 / 物理删除）
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books
+        WHEN new.status = 'active'
+        BEGIN
+            INSERT INTO books_fts(rowid, title, author, isbn)
+            VALUES (new.id, new.title, new.author, new.isbn);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books
+        WHEN old.status = 'active'
+        BEGIN
+            INSERT INTO books_fts(books_fts, rowid, title, author, isbn)
+            VALUES ('delete', old.id, old.title, old.author, old.isbn);
+        END
+    ''')
+    # 先删旧条目再写新条目，必须放在同一个触发器里保证顺序
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF title, author, isbn, status ON books
+        BEGIN
+            INSERT INTO books_fts(books_fts, rowid, title, author, isbn)
+            SELECT 'delete', old.id, old.title, old.author, old.isbn WHERE old.status = 'active';
+            INSERT INTO books_fts(rowid, title, author, isbn)
+            SELECT new.id, new.title, new.author, new.isbn WHERE new.status = 'active';
+        END
+    ''')
+
+    # 为已有图书建立索引
+    cursor.execute("INSERT INTO books_fts(books_fts) VALUES ('delete-all')")
+    cursor.execute('''
+        INSERT INTO books_fts(rowid, title, author, isbn)
+        SELECT id, title, author, isbn FROM books WHERE status = 'active'
+    ''')
+
+
+# ==================== 统计数据 ====================
+# catalog_stats 只有一行，由触发器在图书 / 借阅记录变更的同一事务内维护。
+# 分类数、作者数通过按值计数的辅助表增量维护：计数从 0 变 1 时加一，从 1 变 0 时减一。
+
+def compute_catalog_stats(cursor) -> dict:
+    """从原始数据全量计算统计值"""
+    cursor.execute("SELECT COUNT(*) FROM books WHERE status = 'active'")
+    total_books = cursor.fetchone()[0]
+    cursor.execute("SELECT COUNT(DISTINCT category) FROM books WHERE status = 'active'")
+    total_categories = cursor.fetchone()[0]
+    cursor.execute("SELECT COUNT(DISTINCT author) FROM books WHERE status = 'active'")
+    total_authors = cursor.fetchone()[0]
+    cursor.execute("SELECT COUNT(*) FROM borrow_records WHERE status = 'borrowed'")
+    borrowed_count = cursor.fetchone()[0]
+    return {
+        "total_books": total_books,
+        "total_categories": total_categories,
+        "total_authors": total_authors,
+        "borrowed_count": borrowed_count,
+    }
+
+
+def read_catalog_stats(cursor) -> dict:
+    """读取物化的统计值"""
+    cursor.execute('''
+        SELECT total_books, total_categories, total_authors, borrowed_count
+        FROM catalog_stats WHERE id = 1
+    ''')
+    row = cursor.fetchone()
+    if not row:
+        return {"total_books": 0, "total_categories": 0, "total_authors": 0, "borrowed_count": 0}
+    return {
+        "total_books": row[0],
+        "total_categories": row[1],
+        "total_authors": row[2],
+        "borrowed_count": row[3],
+    }
+
+
+def rebuild_catalog_stats(cursor):
+    """全量重建统计表（迁移和一致性修复时使用）"""
+    cursor.execute("DELETE FROM catalog_category_counts")
+    cursor.execute("DELETE FROM catalog_author_counts")
+    cursor.execute('''
+        INSERT INTO catalog_category_counts (category, book_count)
+        SELECT category, COUNT(*) FROM books WHERE status = 'active' GROUP BY category
+    ''')
+    cursor.execute('''
+        INSERT INTO catalog_author_counts (author, book_count)
+        SELECT author, COUNT(*) FROM books WHERE status = 'active' GROUP BY author
+    ''')
+    # 上面的插入会触发计数器累加，最后统一覆盖为全量结果
+    stats = compute_catalog_stats(cursor)
+    cursor.execute('''
+        INSERT INTO catalog_stats (id, total_books, total_categories, total_authors, borrowed_count, updated_at)
+        VALUES (1, :total_books, :total_categories, :total_authors, :borrowed_count, CURRENT_TIMESTAMP)
+        ON CONFLICT(id) DO UPDATE SET
+            total_books = excluded.total_books,
+            total_categories = excluded.total_categories,
+            total_authors = excluded.total_authors,
+            borrowed_count = excluded.borrowed_count,
+            updated_at = excluded.updated_at
+    ''', stats)
+    return stats
+
+
+@migration(4, "物化统计表及维护触发器")
+def _catalog_stats(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_books INTEGER NOT NULL DEFAULT 0,
+            total_categories INTEGER NOT NULL DEFAULT 0,
+            total_authors INTEGER NOT NULL DEFAULT 0,
+            borrowed_count INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO catalog_stats (id) VALUES (1)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_category_counts (
+            category TEXT PRIMARY KEY,
+            book_count INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_author_counts (
+            author TEXT PRIMARY KEY,
+            book_count INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+
+    # 分类 / 作者计数在 0 与非 0 之间变化时，更新去重总数
+    for table, column in (("catalog_category_counts", "total_categories"),
+                          ("catalog_author_counts", "total_authors")):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON {table}
+            WHEN new.book_count > 0
+            BEGIN
+                UPDATE catalog_stats SET {column} = {column} + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE OF book_count ON {table}
+            WHEN (old.book_count > 0) != (new.book_count > 0)
+            BEGIN
+                UPDATE catalog_stats
+                SET {column} = {column} + (new.book_count > 0) - (old.book_count > 0),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = 1;
+            END
+        ''')
+
+    # 图书：新增 / 物理删除 / 上下架、改分类、改作者
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS catalog_stats_books_ai AFTER INSERT ON books
+        WHEN new.status = 'active'
+        BEGIN
+            UPDATE catalog_stats SET total_books = total_books + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+            INSERT INTO catalog_category_counts (category, book_count) VALUES (new.category, 1)
+                ON CONFLICT(category) DO UPDATE SET book_count = book_count + 1;
+            INSERT INTO catalog_author_counts (author, book_count) VALUES (new.author, 1)
+                ON CONFLICT(author) DO UPDATE SET book_count = book_count + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS catalog_stats_books_ad AFTER DELETE ON books
+        WHEN old.status = 'active'
+        BEGIN
+            UPDATE catalog_stats SET total_books = total_books - 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+            UPDATE catalog_category_counts SET book_count = book_count - 1 WHERE category = old.category;
+            UPDATE catalog_author_counts SET book_count = book_count - 1 WHERE author = old.author;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS catalog_stats_books_au AFTER UPDATE OF status, category, author ON books
+        WHEN old.status = 'active' OR new.status = 'active'
+        BEGIN
+            UPDATE catalog_stats
+            SET total_books = total_books + (new.status IS 'active') - (old.status IS 'active'),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = 1;
+            UPDATE catalog_category_counts SET book_count = book_count - 1
+                WHERE category = old.category AND old.status = 'active';
+            UPDATE catalog_author_counts SET book_count = book_count - 1
+                WHERE author = old.author AND old.status = 'active';
+            INSERT INTO catalog_category_counts (category, book_count)
+                SELECT new.category, 1 WHERE new.status = 'active'
+                ON CONFLICT(category) DO UPDATE SET book_count = book_count + 1;
+            INSERT INTO catalog_author_counts (author, book_count)
+                SELECT new.author, 1 WHERE new.status = 'active'
+                ON CONFLICT(author) DO UPDATE SET book_count = book_count + 1;
+        END
+    ''')
+
+    # 借阅记录：借出 / 归还 / 删除
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS catalog_stats_borrow_ai AFTER INSERT ON borrow_records
+        WHEN new.status = 'borrowed'
+        BEGIN
+            UPDATE catalog_stats SET borrowed_count = borrowed_count + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS catalog_stats_borrow_ad AFTER DELETE ON borrow_records
+        WHEN old.status = 'borrowed'
+        BEGIN
+            UPDATE catalog_stats SET borrowed_count = borrowed_count - 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS catalog_stats_borrow_au AFTER UPDATE OF status ON borrow_records
+        WHEN (old.status IS 'borrowed') != (new.status IS 'borrowed')
+        BEGIN
+            UPDATE catalog_stats
+            SET borrowed_count = borrowed_count + (new.status IS 'borrowed') - (old.status IS 'borrowed'),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = 1;
+        END
+    ''')
+
+    rebuild_catalog_stats(cursor)
+
+
+@migration(5, "刷新令牌表")
+def _refresh_tokens(cursor):
+    # 只保存令牌的 SHA-256 摘要；同一次登录轮换出的令牌共用 family_id，
+    # 已轮换的旧令牌被再次使用时据此吊销整条链
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS refresh_tokens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            token_hash TEXT UNIQUE NOT NULL,
+            family_id TEXT NOT NULL,
+            expires_at TIMESTAMP NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            revoked_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_refresh_tokens_user ON refresh_tokens(user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_refresh_tokens_family ON refresh_tokens(family_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_refresh_tokens_expires ON refresh_tokens(expires_at)")
+
+
+@migration(6, "图书预约排队表")
+def _holds(cursor):
+    # status: waiting 排队中 / ready 已为其保留一本待取 / fulfilled 已借出 / cancelled 已取消 / expired 逾期未取
+    # ready 状态的预约占用一本库存（已从 available_count 中扣除）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS holds (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            book_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'waiting',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            ready_at TIMESTAMP,
+            expires_at TIMESTAMP,
+            FOREIGN KEY (book_id) REFERENCES books(id),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+    # 每人每本书最多一个有效预约
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_holds_active_book_user
+        ON holds(book_id, user_id) WHERE status IN ('waiting', 'ready')
+    ''')
+    # 排队顺序 / 到期扫描 / 我的预约
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_holds_queue ON holds(book_id, id) WHERE status = 'waiting'")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_holds_ready_expires ON holds(expires_at) WHERE status = 'ready'")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_holds_user ON holds(user_id, created_at)")
+
+
+@migration(7, "逾期罚款物化表")
+def _overdue_fines(cursor):
+    # 每条逾期借阅一行，由定时任务按天更新逾期天数和罚款，归还时结清
+    # status: overdue 逾期未还（罚款继续累计） / returned 已归还（罚款固定）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS overdue_fines (
+            record_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            book_id INTEGER NOT NULL,
+            due_date TIMESTAMP NOT NULL,
+            overdue_days INTEGER NOT NULL DEFAULT 0,
+            fine REAL NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'overdue',
+            returned_at TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (record_id) REFERENCES borrow_records(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_overdue_fines_open_due ON overdue_fines(due_date) WHERE status = 'overdue'")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_overdue_fines_user ON overdue_fines(user_id, status)")
+
+
+# 文本时间列转为 Unix 时间戳（秒）的表达式
+# borrow_date / return_date / messages.created_at 由 CURRENT_TIMESTAMP 写入，是 UTC；
+# due_date 由应用按本地时间写入，需要先换算为 UTC
+EPOCH_FROM_UTC = "CAST(strftime('%s', {}) AS INTEGER)"
+EPOCH_FROM_LOCAL = "CAST(strftime('%s', {}, 'utc') AS INTEGER)"
+
+
+@migration(8, "借阅和消息时间改为整数时间戳")
+def _epoch_timestamps(cursor):
+    borrow_ts = EPOCH_FROM_UTC.format("new.borrow_date")
+    due_ts = EPOCH_FROM_LOCAL.format("new.due_date")
+    return_ts = EPOCH_FROM_UTC.format("new.return_date")
+
+    def add_columns(table, columns):
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing = {row[1] for row in cursor.fetchall()}
+        for column in columns:
+            if column not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER")
+
+    add_columns("borrow_records", ("borrow_ts", "due_ts", "return_ts"))
+    add_columns("messages", ("created_ts",))
+    add_columns("overdue_fines", ("due_ts",))
+
+    # 回填已有数据
+    cursor.execute(f'''
+        UPDATE borrow_records SET
+            borrow_ts = {EPOCH_FROM_UTC.format("borrow_date")},
+            due_ts = {EPOCH_FROM_LOCAL.format("due_date")},
+            return_ts = {EPOCH_FROM_UTC.format("return_date")}
+    ''')
+    cursor.execute(f"UPDATE messages SET created_ts = {EPOCH_FROM_UTC.format('created_at')}")
+    cursor.execute(f"UPDATE overdue_fines SET due_ts = {EPOCH_FROM_LOCAL.format('due_date')}")
+
+    # 触发器：写入或修改文本时间时同步时间戳，各处 INSERT 语句无需改动
+    # （overdue_fines 由 routers/fines.py 直接从 borrow_records.due_ts 写入）
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS borrow_records_ts_ai AFTER INSERT ON borrow_records
+        BEGIN
+            UPDATE borrow_records
+            SET borrow_ts = {borrow_ts}, due_ts = {due_ts}, return_ts = {return_ts}
+            WHERE id = new.id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS borrow_records_ts_au AFTER UPDATE OF borrow_date, due_date, return_date ON borrow_records
+        BEGIN
+            UPDATE borrow_records
+            SET borrow_ts = {borrow_ts}, due_ts = {due_ts}, return_ts = {return_ts}
+            WHERE id = new.id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS messages_ts_ai AFTER INSERT ON messages
+        BEGIN
+            UPDATE messages SET created_ts = {EPOCH_FROM_UTC.format("new.created_at")} WHERE id = new.id;
+        END
+    ''')
+
+    # 按时间戳建范围索引，替换原来基于文本时间的索引
+    for index in ("idx_borrow_user_date", "idx_borrow_date", "idx_borrow_active_due",
+                  "idx_messages_receiver_created", "idx_messages_receiver_unread",
+                  "idx_overdue_fines_open_due"):
+        cursor.execute(f"DROP INDEX IF EXISTS {index}")
+    indexes = [
+        "CREATE INDEX IF NOT EXISTS idx_borrow_user_ts ON borrow_records(user_id, borrow_ts)",
+        "CREATE INDEX IF NOT EXISTS idx_borrow_ts ON borrow_records(borrow_ts)",
+        "CREATE INDEX IF NOT EXISTS idx_borrow_active_due_ts ON borrow_records(due_ts) WHERE status = 'borrowed'",
+        "CREATE INDEX IF NOT EXISTS idx_messages_receiver_ts ON messages(receiver_id, created_ts)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_receiver_unread_ts ON messages(receiver_id, created_ts) WHERE is_read = 0",
+        "CREATE INDEX IF NOT EXISTS idx_overdue_fines_open_due_ts ON overdue_fines(due_ts) WHERE status = 'overdue'",
+    ]
+    for sql in indexes:
+        cursor.execute(sql)
+    cursor.execute("PRAGMA optimize")
+
+
+@migration(9, "群发通知改为读时扩散")
+def _broadcasts(cursor):
+    # 群发通知只存一行，不再为每个学生各写一条 messages
+    # audience 为可见角色；用户只能看到自己注册之后发出的群发（与原先发送时逐个写入的语义一致）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender_name TEXT NOT NULL DEFAULT 'system',
+            audience TEXT NOT NULL DEFAULT 'student',
+            title TEXT NOT NULL,
+            content TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_ts INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_broadcasts_audience_ts ON broadcasts(audience, created_ts)")
+
+    # 已读状态：read_upto 之前（含）的群发全部已读（"全部已读"只改这一行），
+    # 之后单独标记已读的记在 broadcast_reads 中（稀疏，只存已读的）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_cursors (
+            user_id INTEGER PRIMARY KEY,
+            read_upto INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_reads (
+            user_id INTEGER NOT NULL,
+            broadcast_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, broadcast_id),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (broadcast_id) REFERENCES broadcasts(id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+
+
+@migration(10, "逾期提醒记录表")
+def _overdue_reminders(cursor):
+    # 每次向用户发送逾期提醒记一行，提醒间隔（overdue_reminder_hours）内不重复提醒
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS overdue_reminders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            message_id INTEGER,
+            reminded_ts INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_overdue_reminders_user_ts ON overdue_reminders(user_id, reminded_ts)")
+
+    # overdue_reminder_auto: 是否由定时任务自动发送（默认关闭，只在管理端手动发送）
+    cursor.executemany(
+        "INSERT OR IGNORE INTO system_settings (key, value) VALUES (?, ?)",
+        [
+            ('overdue_reminder_hours', '24'),
+            ('overdue_reminder_auto', '0'),
+        ]
+    )
+
+
+@migration(11, "操作日志时间戳和组合索引")
+def _operation_log_indexes(cursor):
+    # 与借阅、消息相同，按整数时间戳排序和按时间范围筛选
+    cursor.execute("PRAGMA table_info(operation_logs)")
+    if "created_ts" not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE operation_logs ADD COLUMN created_ts INTEGER")
+    cursor.execute(f"UPDATE operation_logs SET created_ts = {EPOCH_FROM_UTC.format('created_at')}")
+
+    # audit.py 写入时直接带上时间戳，其他写入由触发器补齐
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS operation_logs_ts_ai AFTER INSERT ON operation_logs
+        WHEN new.created_ts IS NULL
+        BEGIN
+            UPDATE operation_logs SET created_ts = {EPOCH_FROM_UTC.format("new.created_at")} WHERE id = new.id;
+        END
+    ''')
+
+    # 全部 / 按操作人 / 按操作类型，均按时间倒序翻页（索引隐含 id，可直接满足 (created_ts, id) 排序）
+    cursor.execute("DROP INDEX IF EXISTS idx_logs_created")
+    cursor.execute("DROP INDEX IF EXISTS idx_logs_user")
+    indexes = [
+        "CREATE INDEX IF NOT EXISTS idx_logs_ts ON operation_logs(created_ts)",
+        "CREATE INDEX IF NOT EXISTS idx_logs_user_ts ON operation_logs(user_id, created_ts)",
+        "CREATE INDEX IF NOT EXISTS idx_logs_action_ts ON operation_logs(action, created_ts)",
+    ]
+    for sql in indexes:
+        cursor.execute(sql)
+    cursor.execute("PRAGMA optimize")
+
+
+@migration(12, "借阅和消息的时间戳由写入语句直接写入")
+def _epoch_timestamps_on_write(cursor):
+    # 应用的 INSERT 和还书 UPDATE 直接带上时间戳，触发器只在时间戳缺失或与文本时间不一致时补齐
+    # （直接用 SQL 写入的旧脚本等），正常写入不再多执行一次 UPDATE
+    borrow_ts = EPOCH_FROM_UTC.format("new.borrow_date")
+    due_ts = EPOCH_FROM_LOCAL.format("new.due_date")
+    return_ts = EPOCH_FROM_UTC.format("new.return_date")
+    borrow_stale = f"new.borrow_ts IS NOT {borrow_ts} OR new.due_ts IS NOT {due_ts} OR new.return_ts IS NOT {return_ts}"
+    created_ts = EPOCH_FROM_UTC.format("new.created_at")
+
+    for trigger in ("borrow_records_ts_ai", "borrow_records_ts_au", "messages_ts_ai"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    cursor.execute(f'''
+        CREATE TRIGGER borrow_records_ts_ai AFTER INSERT ON borrow_records
+        WHEN {borrow_stale}
+        BEGIN
+            UPDATE borrow_records
+            SET borrow_ts = {borrow_ts}, due_ts = {due_ts}, return_ts = {return_ts}
+            WHERE id = new.id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER borrow_records_ts_au AFTER UPDATE OF borrow_date, due_date, return_date ON borrow_records
+        WHEN {borrow_stale}
+        BEGIN
+            UPDATE borrow_records
+            SET borrow_ts = {borrow_ts}, due_ts = {due_ts}, return_ts = {return_ts}
+            WHERE id = new.id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER messages_ts_ai AFTER INSERT ON messages
+        WHEN new.created_ts IS NOT {created_ts}
+        BEGIN
+            UPDATE messages SET created_ts = {created_ts} WHERE id = new.id;
+        END
+    ''')
@@ -13,13 +13,26 @@ class LoginRequest(BaseModel):
 
 class LoginResponse(BaseModel):
     token: str
+    refresh_token: str
     user: dict
     first_login: bool
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class TokenResponse(BaseModel):
+    token: str
+    refresh_token: str
+
 class ChangePasswordRequest(BaseModel):
     old_password: str
     new_password: str
 
+class ChangePasswordResponse(BaseModel):
+    message: str
+    token: str
+    refresh_token: str
+
 class UserInfo(BaseModel):
     id: int
     student_id: str
@@ -31,6 +44,14 @@ class UserCreate(BaseModel):
     name: str
     password: Optional[str] = "12345678"  # 默认密码
 
+class ImportResponse(BaseModel):
+    message: str
+    inserted: int
+    updated: int
+    skipped: int
+    error_count: int
+    errors: List[dict]  # [{row: Excel 行号, key: ISBN/学号, message: 错误原因}]，最多 500 条
+
 # ==================== 图书相关模型 ====================
 
 class BookCreate(BaseModel):
@@ -69,6 +90,15 @@ class BookResponse(BaseModel):
 class BorrowRequest(BaseModel):
     days: int = 30  # 借阅天数，默认30天
 
+class CirculationOperation(BaseModel):
+    action: str  # borrow 借出 / return 归还
+    isbn: str
+    student_id: str
+
+class BulkCirculationRequest(BaseModel):
+    operations: List[CirculationOperation]
+    days: int = 30  # 借出操作的借阅天数
+
 class BorrowRecordResponse(BaseModel):
     id: int
     book_id: int
@@ -117,11 +147,15 @@ class SystemSettingsUpdate(BaseModel):
     min_borrow_days: Optional[int] = None
     max_borrow_days: Optional[int] = None
     fine_per_day: Optional[float] = None
+    overdue_reminder_hours: Optional[int] = None
+    overdue_reminder_auto: Optional[bool] = None
 
 class SystemSettingsResponse(BaseModel):
     min_borrow_days: int
     max_borrow_days: int
     fine_per_day: float
+    overdue_reminder_hours: int
+    overdue_reminder_auto: bool
 
 # ==================== 消息/通知模型 ====================
 
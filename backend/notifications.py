@@ -0,0 +1,108 @@
+"""
+进程内消息推送中心
+- 客户端通过 SSE 长连接订阅（routers/messages.py 的 /api/messages/stream），不再定时轮询未读数
+- 发送消息、标记已读等接口在事务提交后调用 publish_* 推送事件，推送本身不访问数据库
+- 每个连接只占一个有界队列，队列满时丢弃后续事件并要求客户端重新同步未读数
+多 worker 部署时各进程只能推送给连接到本进程的客户端，客户端重连时会重新同步未读数
+"""
+import asyncio
+import json
+from typing import Dict, Iterable, Optional, Set
+
+# 单个连接最多积压的事件数
+SUBSCRIBER_QUEUE_SIZE = 32
+# 心跳间隔（秒），防止代理断开空闲连接
+HEARTBEAT_SECONDS = 25
+# 断线后客户端重连的等待时间（毫秒，SSE retry 字段）
+RECONNECT_MILLISECONDS = 5000
+
+
+def format_event(event: str, data: dict) -> str:
+    """按 SSE 格式编码一个事件"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+
+class Subscriber:
+    """一个推送连接"""
+    __slots__ = ("user_id", "role", "queue", "overflowed")
+
+    def __init__(self, user_id: int, role: str):
+        self.user_id = user_id
+        self.role = role
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def offer(self, event: str, data: dict):
+        """放入事件，队列已满时只记录溢出，由连接发送一次重新同步"""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait((event, data))
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class NotificationHub:
+    """按用户分组的订阅表（只在事件循环线程中访问）"""
+
+    def __init__(self):
+        self._subscribers: Dict[int, Set[Subscriber]] = {}
+        self._published = 0
+
+    def subscribe(self, user_id: int, role: str) -> Subscriber:
+        subscriber = Subscriber(user_id, role)
+        self._subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self._subscribers.get(subscriber.user_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self._subscribers[subscriber.user_id]
+
+    def publish(self, user_ids: Iterable[int], event: str, data: dict):
+        """推送给指定用户的全部连接（未在线的用户直接跳过）"""
+        for user_id in user_ids:
+            for subscriber in self._subscribers.get(user_id, ()):
+                subscriber.offer(event, data)
+                self._published += 1
+
+    def publish_role(self, role: str, event: str, data: dict):
+        """推送给某个角色的全部在线连接（群发）"""
+        for subscribers in self._subscribers.values():
+            for subscriber in subscribers:
+                if subscriber.role == role:
+                    subscriber.offer(event, data)
+                    self._published += 1
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._subscribers),
+            "connections": sum(len(s) for s in self._subscribers.values()),
+            "published": self._published,
+        }
+
+
+hub = NotificationHub()
+
+
+def publish_message(user_ids: Iterable[int], summary: dict):
+    """新消息：客户端未读数加一并显示摘要"""
+    hub.publish(user_ids, "message", summary)
+
+
+def publish_broadcast(role: str, summary: dict):
+    """新群发：推送给该角色的全部在线用户"""
+    hub.publish_role(role, "message", summary)
+
+
+def publish_unread(user_id: int, count: Optional[int] = None):
+    """未读数变化（已读操作后）；count 为空时客户端重新获取"""
+    hub.publish((user_id,), "unread", {"count": count})
+
+
+def notification_hub_stats() -> dict:
+    """推送连接统计信息"""
+    return hub.stats()
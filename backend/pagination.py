@@ -0,0 +1,58 @@
+"""
+游标（keyset）分页工具
+- 游标是排序键 (如 created_at, id) 的 base64 编码，对客户端不透明
+- 翻页条件使用行值比较 (a, b) < (?, ?)，可直接走索引，深翻页不再变慢
+"""
+import base64
+import json
+from typing import Optional, Sequence
+
+from fastapi import HTTPException
+
+
+def encode_cursor(values: Sequence) -> str:
+    """将排序键编码为游标"""
+    raw = json.dumps(list(values), ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """解析游标，格式不正确时返回 400"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+    return values
+
+
+def keyset_clause(columns: Sequence[str], cursor: str, descending: bool = True):
+    """
+    生成游标之后的翻页条件
+    返回 (sql 片段, 参数)，例如 ("(ol.created_at, ol.id) < (?, ?)", [...])
+    """
+    values = decode_cursor(cursor, len(columns))
+    op = "<" if descending else ">"
+    placeholders = ", ".join("?" for _ in columns)
+    return f"({', '.join(columns)}) {op} ({placeholders})", values
+
+
+def split_page(rows: list, page_size: int, keys: Sequence[str]):
+    """
+    rows 需多查询一行（LIMIT page_size + 1）用于判断是否还有下一页
+    返回 (当前页数据, 下一页游标或 None)
+    """
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    last = rows[-1]
+    return rows, encode_cursor([last[key] for key in keys])
+
+
+def total_pages(total: Optional[int], page_size: int) -> Optional[int]:
+    """根据总数计算总页数，未统计总数时返回 None"""
+    if total is None:
+        return None
+    return (total + page_size - 1) // page_size
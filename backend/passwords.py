@@ -0,0 +1,118 @@
+"""
+密码哈希
+- 新密码使用加盐 scrypt，存储格式带版本前缀：scrypt$n$r$p$salt$hash
+- 兼容旧版无盐 SHA-256（64 位十六进制），登录成功后自动升级为 scrypt
+- scrypt 单次约几十毫秒，异步接口在专用线程池中执行，并限制同时排队的任务数，
+  登录高峰时不会阻塞事件循环，也不会占满数据库线程池
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+# scrypt 参数（约 16MB 内存 / 次）
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_SALT_BYTES = 16
+SCRYPT_KEY_BYTES = 32
+SCHEME = "scrypt"
+
+# 哈希线程池配置
+HASH_WORKERS = min(4, os.cpu_count() or 1)   # 同时计算的哈希数
+HASH_MAX_PENDING = HASH_WORKERS * 8          # 执行中 + 排队中的任务上限
+HASH_QUEUE_TIMEOUT = 10.0                    # 排队超过该秒数返回 503
+
+_hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="pwhash")
+_hash_slots = asyncio.Semaphore(HASH_MAX_PENDING)
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int, dklen: int) -> bytes:
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p, dklen=dklen,
+        maxmem=128 * n * r * p + 1024 * 1024
+    )
+
+
+def _legacy_hash(password: str) -> str:
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+def hash_password(password: str) -> str:
+    """生成 scrypt 密码哈希（同步，会占用 CPU 几十毫秒）"""
+    salt = os.urandom(SCRYPT_SALT_BYTES)
+    key = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P, SCRYPT_KEY_BYTES)
+    return f"{SCHEME}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64encode(salt)}${_b64encode(key)}"
+
+
+# 用户不存在时用于校验的哈希（对应的密码是随机值，不会校验通过），
+# 使登录耗时与用户存在时一致，不能通过响应时间判断学号是否存在
+DUMMY_PASSWORD_HASH = hash_password(base64.b64encode(os.urandom(16)).decode())
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """验证密码，支持 scrypt 和旧版 SHA-256 哈希"""
+    if not hashed_password:
+        return False
+
+    if hashed_password.startswith(SCHEME + "$"):
+        try:
+            _, n, r, p, salt, key = hashed_password.split("$")
+            expected = _b64decode(key)
+            actual = _scrypt(plain_password, _b64decode(salt), int(n), int(r), int(p), len(expected))
+        except ValueError:
+            return False
+        return hmac.compare_digest(actual, expected)
+
+    return hmac.compare_digest(_legacy_hash(plain_password), hashed_password)
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """旧格式或参数低于当前配置的哈希需要重新生成"""
+    if not hashed_password.startswith(SCHEME + "$"):
+        return True
+    try:
+        _, n, r, p, _, _ = hashed_password.split("$")
+        return (int(n), int(r), int(p)) < (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    except ValueError:
+        return True
+
+
+async def _run_hash(func, *args):
+    """在哈希线程池中执行，排队任务过多时返回 503 而不是无限堆积"""
+    try:
+        await asyncio.wait_for(_hash_slots.acquire(), timeout=HASH_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="系统繁忙，请稍后重试")
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_executor, func, *args)
+    finally:
+        _hash_slots.release()
+
+
+async def hash_password_async(password: str) -> str:
+    """异步生成密码哈希"""
+    return await _run_hash(hash_password, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """异步验证密码"""
+    return await _run_hash(verify_password, plain_password, hashed_password)
+
+
+def shutdown_hashing():
+    """关闭哈希线程池（应用关闭时调用）"""
+    _hash_executor.shutdown(wait=True)
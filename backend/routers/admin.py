@@ -3,51 +3,52 @@
 """
 from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import List, Optional
-from database import get_db, get_password_hash
+from database import run_db, run_write, fetch_all, get_pool_stats
+from passwords import hash_password_async
 from models import (
     SystemSettingsUpdate, SystemSettingsResponse,
     AdminCreate, OperationLogResponse, MessageResponse
 )
-from auth import require_super_admin, get_current_user
+from auth import require_super_admin, get_current_user, invalidate_user, auth_cache_stats, revoke_user_tokens
+from pagination import keyset_clause, split_page
+from timeutil import local_date_ts
+from cache import catalog_cache_stats, bump_catalog_version
+from notifications import publish_message, notification_hub_stats
+from audit import log_operation, audit_stats
+from routers.holds import cancel_user_holds, publish_hold_notices
+from routers.fines import send_overdue_reminders
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
 
-
-def log_operation(user_id: int, action: str, detail: str = None):
-    """记录操作日志"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO operation_logs (user_id, action, detail)
-            VALUES (?, ?, ?)
-        ''', (user_id, action, detail))
-        conn.commit()
+# 操作日志总数最多统计到的条数，超过时只返回近似值
+LOG_COUNT_LIMIT = 10000
 
 
 @router.get("/settings", response_model=SystemSettingsResponse)
 async def get_settings(current_user: dict = Depends(require_super_admin)):
     """获取系统设置"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT key, value FROM system_settings")
-        rows = cursor.fetchall()
-        
-        settings = {}
-        for row in rows:
-            key = row["key"]
-            value = row["value"]
-            if key in ["min_borrow_days", "max_borrow_days"]:
-                settings[key] = int(value)
-            elif key == "fine_per_day":
-                settings[key] = float(value)
-            else:
-                settings[key] = value
-        
-        return SystemSettingsResponse(
-            min_borrow_days=settings.get("min_borrow_days", 1),
-            max_borrow_days=settings.get("max_borrow_days", 60),
-            fine_per_day=settings.get("fine_per_day", 0.5)
-        )
+    rows = await fetch_all("SELECT key, value FROM system_settings")
+    
+    settings = {}
+    for row in rows:
+        key = row["key"]
+        value = row["value"]
+        if key in ["min_borrow_days", "max_borrow_days", "overdue_reminder_hours"]:
+            settings[key] = int(value)
+        elif key == "overdue_reminder_auto":
+            settings[key] = value == "1"
+        elif key == "fine_per_day":
+            settings[key] = float(value)
+        else:
+            settings[key] = value
+    
+    return SystemSettingsResponse(
+        min_borrow_days=settings.get("min_borrow_days", 1),
+        max_borrow_days=settings.get("max_borrow_days", 60),
+        fine_per_day=settings.get("fine_per_day", 0.5),
+        overdue_reminder_hours=settings.get("overdue_reminder_hours", 24),
+        overdue_reminder_auto=settings.get("overdue_reminder_auto", False)
+    )
 
 
 @router.put("/settings", response_model=MessageResponse)
@@ -56,7 +57,7 @@ async def update_settings(
     current_user: dict = Depends(require_super_admin)
 ):
     """更新系统设置"""
-    with get_db() as conn:
+    def _update(conn):
         cursor = conn.cursor()
         
         updates = []
@@ -80,27 +81,38 @@ async def update_settings(
                 (str(settings.fine_per_day), "fine_per_day")
             )
             updates.append(f"每日罚款={settings.fine_per_day}")
+
+        if settings.overdue_reminder_hours is not None:
+            cursor.execute(
+                "UPDATE system_settings SET value = ?, updated_at = CURRENT_TIMESTAMP WHERE key = ?",
+                (str(settings.overdue_reminder_hours), "overdue_reminder_hours")
+            )
+            updates.append(f"逾期提醒间隔={settings.overdue_reminder_hours}小时")
+
+        if settings.overdue_reminder_auto is not None:
+            cursor.execute(
+                "UPDATE system_settings SET value = ?, updated_at = CURRENT_TIMESTAMP WHERE key = ?",
+                ("1" if settings.overdue_reminder_auto else "0", "overdue_reminder_auto")
+            )
+            updates.append(f"自动逾期提醒={'开启' if settings.overdue_reminder_auto else '关闭'}")
         
+        log_operation(current_user["id"], "更新系统设置", ", ".join(updates), conn=conn)
         conn.commit()
         
-        log_operation(current_user["id"], "更新系统设置", ", ".join(updates))
-        
         return MessageResponse(message="系统设置已更新")
 
+    return await run_db(_update)
+
 
 @router.get("/admins")
 async def get_admins(current_user: dict = Depends(require_super_admin)):
     """获取管理员列表"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, student_id, name, role, created_at 
-            FROM users 
-            WHERE role = 'admin'
-            ORDER BY created_at DESC
-        """)
-        rows = cursor.fetchall()
-        return [dict(row) for row in rows]
+    return await fetch_all("""
+        SELECT id, student_id, name, role, created_at 
+        FROM users 
+        WHERE role = 'admin'
+        ORDER BY created_at DESC
+    """)
 
 
 @router.post("/admins", response_model=MessageResponse)
@@ -109,7 +121,9 @@ async def create_admin(
     current_user: dict = Depends(require_super_admin)
 ):
     """创建管理员账号"""
-    with get_db() as conn:
+    password_hash = await hash_password_async(admin.password or "admin123")
+
+    def _create(conn):
         cursor = conn.cursor()
         
         # 检查学号是否已存在
@@ -118,19 +132,18 @@ async def create_admin(
             raise HTTPException(status_code=400, detail="该学号已存在")
         
         # 创建管理员
-        password_hash = get_password_hash(admin.password or "admin123")
-        
         cursor.execute('''
             INSERT INTO users (student_id, password_hash, name, role, first_login)
             VALUES (?, ?, ?, 'admin', 0)
         ''', (admin.student_id, password_hash, admin.name))
         
+        log_operation(current_user["id"], "创建管理员", f"{admin.name} ({admin.student_id})", conn=conn)
         conn.commit()
         
-        log_operation(current_user["id"], "创建管理员", f"{admin.name} ({admin.student_id})")
-        
         return MessageResponse(message=f"管理员 {admin.name} 创建成功")
 
+    return await run_db(_create)
+
 
 @router.delete("/admins/{admin_id}", response_model=MessageResponse)
 async def delete_admin(
@@ -138,7 +151,7 @@ async def delete_admin(
     current_user: dict = Depends(require_super_admin)
 ):
     """删除管理员账号"""
-    with get_db() as conn:
+    def _delete(conn):
         cursor = conn.cursor()
         
         # 检查管理员是否存在
@@ -154,12 +167,27 @@ async def delete_admin(
         if admin["role"] != "admin":
             raise HTTPException(status_code=400, detail="该用户不是管理员")
         
+        cursor.execute("SELECT id FROM borrow_records WHERE user_id = ? AND status = 'borrowed'", (admin_id,))
+        if cursor.fetchone():
+            raise HTTPException(status_code=400, detail="该管理员还有未归还的图书，无法删除")
+        
+        # 外键约束已开启，先清理关联数据，操作日志保留但去掉用户关联
+        notified = cancel_user_holds(cursor, admin_id)
+        cursor.execute("DELETE FROM messages WHERE receiver_id = ?", (admin_id,))
+        cursor.execute("DELETE FROM reviews WHERE user_id = ?", (admin_id,))
+        cursor.execute("DELETE FROM favorites WHERE user_id = ?", (admin_id,))
+        cursor.execute("DELETE FROM borrow_records WHERE user_id = ?", (admin_id,))
+        cursor.execute("UPDATE operation_logs SET user_id = NULL WHERE user_id = ?", (admin_id,))
         cursor.execute("DELETE FROM users WHERE id = ?", (admin_id,))
-        conn.commit()
-        
-        log_operation(current_user["id"], "删除管理员", f"{admin['name']} ({admin['student_id']})")
+        log_operation(current_user["id"], "删除管理员", f"{admin['name']} ({admin['student_id']})", conn=conn)
         
-        return MessageResponse(message="管理员已删除")
+        return MessageResponse(message="管理员已删除"), notified
+
+    result, notified = await run_write(_delete)
+    invalidate_user(admin_id)
+    bump_catalog_version()
+    publish_hold_notices(notified)
+    return result
 
 
 @router.post("/admins/{admin_id}/reset-password", response_model=MessageResponse)
@@ -168,7 +196,9 @@ async def reset_admin_password(
     current_user: dict = Depends(require_super_admin)
 ):
     """重置管理员密码"""
-    with get_db() as conn:
+    new_password_hash = await hash_password_async("admin123")
+
+    def _reset(conn):
         cursor = conn.cursor()
         
         # 检查管理员是否存在
@@ -179,93 +209,149 @@ async def reset_admin_password(
             raise HTTPException(status_code=404, detail="用户不存在")
         
         # 重置密码为 admin123
-        new_password_hash = get_password_hash("admin123")
         cursor.execute(
             "UPDATE users SET password_hash = ?, first_login = 1 WHERE id = ?",
             (new_password_hash, admin_id)
         )
+        # 重置后原有登录状态全部失效
+        revoke_user_tokens(conn, admin_id)
+        log_operation(current_user["id"], "重置密码", f"{admin['name']} ({admin['student_id']})", conn=conn)
         conn.commit()
         
-        log_operation(current_user["id"], "重置密码", f"{admin['name']} ({admin['student_id']})")
-        
         return MessageResponse(message=f"密码已重置为 admin123")
 
+    result = await run_db(_reset)
+    invalidate_user(admin_id)
+    return result
+
 
 @router.get("/logs")
 async def get_logs(
     page: int = Query(1, ge=1),
     page_size: int = Query(50, ge=1, le=100),
+    after: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor），传入时忽略 page"),
+    include_total: bool = Query(True, description="是否统计总数"),
+    user_id: Optional[int] = Query(None, description="操作人ID"),
+    action: Optional[str] = Query(None, description="操作类型"),
+    date_from: Optional[str] = Query(None, description="开始日期（YYYY-MM-DD，含）"),
+    date_to: Optional[str] = Query(None, description="结束日期（YYYY-MM-DD，含）"),
     current_user: dict = Depends(require_super_admin)
 ):
-    """获取操作日志"""
-    with get_db() as conn:
+    """
+    获取操作日志（可按操作人、操作类型、时间范围筛选）
+    按 (created_ts, id) 倒序翻页，筛选条件分别走 idx_logs_user_ts / idx_logs_action_ts / idx_logs_ts；
+    总数最多统计到 LOG_COUNT_LIMIT 条，超过时 total_exact 为 false
+    """
+    conditions = []
+    params = []
+    if user_id is not None:
+        conditions.append("user_id = ?")
+        params.append(user_id)
+    if action:
+        conditions.append("action = ?")
+        params.append(action)
+    if date_from:
+        conditions.append("created_ts >= ?")
+        params.append(local_date_ts(date_from))
+    if date_to:
+        conditions.append("created_ts < ?")
+        params.append(local_date_ts(date_to, next_day=True))
+    filter_params = list(params)
+    filter_clause = " AND ".join(conditions) or "1"
+
+    if after:
+        clause, values = keyset_clause(["created_ts", "id"], after)
+        conditions.append(clause)
+        params.extend(values)
+        offset = 0
+    else:
+        offset = (page - 1) * page_size
+    where_clause = " AND ".join(conditions) or "1"
+
+    def _query(conn):
         cursor = conn.cursor()
         
-        # 获取总数
-        cursor.execute("SELECT COUNT(*) FROM operation_logs")
-        total = cursor.fetchone()[0]
-        
-        # 获取日志
-        cursor.execute("""
-            SELECT ol.id, ol.user_id, u.name as user_name, ol.action, ol.detail, ol.created_at
-            FROM operation_logs ol
+        # 获取总数（可跳过），只数到上限为止，不扫描整张表
+        total = None
+        total_exact = True
+        if include_total:
+            cursor.execute(f"""
+                SELECT COUNT(*) FROM (
+                    SELECT 1 FROM operation_logs WHERE {filter_clause} LIMIT ?
+                )
+            """, filter_params + [LOG_COUNT_LIMIT + 1])
+            total = cursor.fetchone()[0]
+            if total > LOG_COUNT_LIMIT:
+                total = LOG_COUNT_LIMIT
+                total_exact = False
+        
+        # 先在日志表上按索引取出当前页（多取一条判断是否有下一页），再关联用户名
+        cursor.execute(f"""
+            SELECT ol.id, ol.user_id, u.name as user_name, ol.action, ol.detail, ol.created_at, ol.created_ts
+            FROM (
+                SELECT id, user_id, action, detail, created_at, created_ts
+                FROM operation_logs
+                WHERE {where_clause}
+                ORDER BY created_ts DESC, id DESC
+                LIMIT ? OFFSET ?
+            ) ol
             LEFT JOIN users u ON ol.user_id = u.id
-            ORDER BY ol.created_at DESC
-            LIMIT ? OFFSET ?
-        """, (page_size, (page - 1) * page_size))
+            ORDER BY ol.created_ts DESC, ol.id DESC
+        """, params + [page_size + 1, offset])
         
-        rows = cursor.fetchall()
+        rows, next_cursor = split_page([dict(row) for row in cursor.fetchall()], page_size, ["created_ts", "id"])
         
         return {
-            "items": [dict(row) for row in rows],
-            "total": total
+            "items": rows,
+            "total": total,
+            "total_exact": total_exact,
+            "next_cursor": next_cursor
         }
 
+    return await run_db(_query)
+
+
+@router.get("/logs/actions", response_model=List[str])
+async def get_log_actions(current_user: dict = Depends(require_super_admin)):
+    """
+    日志中出现过的操作类型（筛选下拉框）
+    在 idx_logs_action_ts 上逐个跳到下一个不同的值，只读取 操作类型数 次索引
+    """
+    rows = await fetch_all('''
+        WITH RECURSIVE actions(action) AS (
+            SELECT MIN(action) FROM operation_logs
+            UNION ALL
+            SELECT (SELECT MIN(action) FROM operation_logs WHERE action > actions.action)
+            FROM actions WHERE actions.action IS NOT NULL
+        )
+        SELECT action FROM actions WHERE action IS NOT NULL
+    ''')
+    return [row["action"] for row in rows]
+
+
+@router.get("/metrics")
+async def get_metrics(current_user: dict = Depends(require_super_admin)):
+    """获取运行指标（连接池、缓存等）"""
+    return {
+        "db_pool": get_pool_stats(),
+        "catalog_cache": catalog_cache_stats(),
+        "auth_cache": auth_cache_stats(),
+        "notification_hub": notification_hub_stats(),
+        "audit": audit_stats()
+    }
+
 
 @router.post("/batch-overdue-notify", response_model=MessageResponse)
 async def batch_overdue_notify(current_user: dict = Depends(require_super_admin)):
-    """一键发送逾期提醒"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        
-        # 获取所有逾期记录
-        cursor.execute("""
-            SELECT br.user_id, b.title, br.due_date, 
-                   julianday('now') - julianday(br.due_date) as overdue_days
-            FROM borrow_records br
-            JOIN books b ON br.book_id = b.id
-            WHERE br.status = 'borrowed' AND br.due_date < CURRENT_TIMESTAMP
-        """)
-        
-        overdue_records = cursor.fetchall()
-        
-        if not overdue_records:
-            return MessageResponse(message="暂无逾期记录")
-        
-        # 按用户分组发送消息
-        user_overdues = {}
-        for record in overdue_records:
-            user_id = record["user_id"]
-            if user_id not in user_overdues:
-                user_overdues[user_id] = []
-            user_overdues[user_id].append({
-                "title": record["title"],
-                "days": int(record["overdue_days"])
-            })
-        
-        count = 0
-        for user_id, books in user_overdues.items():
-            book_list = "\n".join([f"- 《{b['title']}》已逾期 {b['days']} 天" for b in books])
-            content = f"您有以下图书已逾期，请尽快归还：\n{book_list}"
-            
-            cursor.execute("""
-                INSERT INTO messages (sender_name, receiver_id, title, content)
-                VALUES ('system', ?, '逾期提醒', ?)
-            """, (user_id, content))
-            count += 1
-        
-        conn.commit()
-        
-        log_operation(current_user["id"], "一键逾期提醒", f"通知了 {count} 位用户")
-        
-        return MessageResponse(message=f"已向 {count} 位用户发送逾期提醒")
+    """一键发送逾期提醒（提醒间隔内已提醒过的用户跳过）"""
+    def _notify(conn):
+        notified = send_overdue_reminders(conn)
+        if notified:
+            log_operation(current_user["id"], "一键逾期提醒", f"通知了 {len(notified)} 位用户", conn=conn)
+        return notified
+
+    notified = await run_write(_notify)
+    if not notified:
+        return MessageResponse(message="暂无需要提醒的逾期用户（提醒间隔内已提醒过的用户不会重复提醒）")
+    publish_message(notified, {"sender_name": "system", "title": "逾期提醒"})
+    return MessageResponse(message=f"已向 {len(notified)} 位用户发送逾期提醒")
@@ -1,177 +1,444 @@
 """
-批量操作 API 路由 (Excel 导入/导出)
+批量操作 API 路由 (Excel 导入 / Excel、CSV、NDJSON 导出)
 需要安装: pandas, openpyxl, python-multipart
 """
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from fastapi.responses import FileResponse, StreamingResponse
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
 import pandas as pd
+import asyncio
+import csv
 import io
+import json
 from datetime import datetime
 import tempfile
-import os
-import shutil
 
-from database import get_db, get_password_hash
-from auth import require_admin_or_super
-from models import MessageResponse, BookCreate, UserCreate
+from database import run_db, run_write
+from passwords import hash_password_async, HASH_WORKERS
+from auth import require_admin_or_super, invalidate_user
+from models import ImportResponse
+from cache import bump_catalog_version
+from timeutil import local_date_ts
+from audit import log_operation
+from routers.holds import allocate_holds, publish_hold_notices
 
 router = APIRouter(prefix="/api/batch", tags=["batch"])
 
 # ==================== 导出功能 ====================
+# 按主键分批读取（每批单独取连接，不在客户端下载期间占用连接），逐批编码后直接写入响应：
+# - csv / ndjson：边读边发送，内存只保留一批数据
+# - xlsx：openpyxl 只写模式逐行写入匿名临时文件（关闭即删除），完成后分块发送
+
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_SEND_BYTES = 64 * 1024
+EXPORT_MEDIA_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+BOOK_EXPORT_COLUMNS = [
+    "id", "title", "author", "isbn", "category", "cover", "cover_status",
+    "total_count", "available_count", "status", "created_at", "location",
+]
+USER_EXPORT_COLUMNS = ["id", "student_id", "name", "role", "created_at"]
+BORROW_EXPORT_COLUMNS = [
+    ("br.id", "id"), ("u.student_id", "student_id"), ("u.name", "user_name"),
+    ("b.isbn", "isbn"), ("b.title", "book_title"), ("br.borrow_date", "borrow_date"),
+    ("br.due_date", "due_date"), ("br.return_date", "return_date"), ("br.status", "status"),
+]
+
+
+async def iter_export_chunks(columns: list, source: str, where: str = "1", params: tuple = (), key: str = "id"):
+    """
+    按主键分批读取导出数据，每次产出一批行（元组列表）
+    columns 为列名或 (SQL 表达式, 列名)，主键必须是第一列
+    """
+    select = ", ".join(c if isinstance(c, str) else f"{c[0]} AS {c[1]}" for c in columns)
+    query = f"SELECT {select} FROM {source} WHERE ({where}) AND {key} > ? ORDER BY {key} LIMIT ?"
+    last_id = 0
+
+    def _fetch(conn):
+        cursor = conn.cursor()
+        cursor.execute(query, (*params, last_id, EXPORT_CHUNK_SIZE))
+        return [tuple(row) for row in cursor.fetchall()]
+
+    while True:
+        rows = await run_db(_fetch)
+        if not rows:
+            return
+        yield rows
+        if len(rows) < EXPORT_CHUNK_SIZE:
+            return
+        last_id = rows[-1][0]
+
+
+async def _encode_text(headers: list, chunks, fmt: str):
+    """csv / ndjson：逐批编码发送"""
+    if fmt == "csv":
+        # 带 BOM，Excel 打开中文不乱码
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(headers)
+        yield ("\ufeff" + buffer.getvalue()).encode()
+        async for rows in chunks:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(rows)
+            yield buffer.getvalue().encode()
+    else:
+        async for rows in chunks:
+            yield "".join(
+                json.dumps(dict(zip(headers, row)), ensure_ascii=False) + "\n" for row in rows
+            ).encode()
+
+
+async def _encode_xlsx(headers: list, chunks):
+    """xlsx：只写模式写入匿名临时文件，写完后分块发送，结束时文件随关闭删除"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(headers)
+
+    def _append(rows):
+        for row in rows:
+            sheet.append(row)
+
+    temp = tempfile.TemporaryFile()
+    try:
+        async for rows in chunks:
+            await asyncio.to_thread(_append, rows)
+        await asyncio.to_thread(workbook.save, temp)
+        await asyncio.to_thread(temp.seek, 0)
+        while True:
+            data = await asyncio.to_thread(temp.read, EXPORT_SEND_BYTES)
+            if not data:
+                break
+            yield data
+    finally:
+        temp.close()
+
+
+def export_response(name: str, columns: list, chunks, fmt: str) -> StreamingResponse:
+    """把分批读取的数据按格式编码为流式下载响应"""
+    if fmt not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"不支持的导出格式: {fmt}")
+    headers = [c if isinstance(c, str) else c[1] for c in columns]
+    body = _encode_xlsx(headers, chunks) if fmt == "xlsx" else _encode_text(headers, chunks, fmt)
+    filename = f"{name}_export_{datetime.now().strftime('%Y%m%d%H%M%S')}.{fmt}"
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 
 @router.get("/export/books")
-async def export_books(current_user: dict = Depends(require_admin_or_super)):
+async def export_books(
+    format: str = Query("xlsx", description="导出格式：xlsx / csv / ndjson"),
+    current_user: dict = Depends(require_admin_or_super)
+):
     """导出所有图书"""
-    with get_db() as conn:
-        # 使用 pandas 直接读取 SQL
-        df = pd.read_sql_query("SELECT * FROM books WHERE status != 'deleted'", conn)
-        
-        # 格式化日期
-        # df['created_at'] = pd.to_datetime(df['created_at'])
-        
-        # 创建临时文件
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx")
-        temp_file.close()
-        
-        df.to_excel(temp_file.name, index=False)
-        
-        filename = f"books_export_{datetime.now().strftime('%Y%m%d%H%M%S')}.xlsx"
-        return FileResponse(
-            temp_file.name, 
-            filename=filename, 
-            media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            background=None # TODO: cleanup temp file
-        )
+    chunks = iter_export_chunks(BOOK_EXPORT_COLUMNS, "books", "status != 'deleted'")
+    response = export_response("books", BOOK_EXPORT_COLUMNS, chunks, format)
+    log_operation(current_user["id"], "导出图书", format)
+    return response
 
 @router.get("/export/users")
-async def export_users(current_user: dict = Depends(require_admin_or_super)):
+async def export_users(
+    format: str = Query("xlsx", description="导出格式：xlsx / csv / ndjson"),
+    current_user: dict = Depends(require_admin_or_super)
+):
     """导出所有用户"""
-    with get_db() as conn:
-        df = pd.read_sql_query("SELECT id, student_id, name, role, created_at FROM users", conn)
-        
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx")
-        temp_file.close()
-        
-        df.to_excel(temp_file.name, index=False)
-        
-        filename = f"users_export_{datetime.now().strftime('%Y%m%d%H%M%S')}.xlsx"
-        return FileResponse(
-            temp_file.name, 
-            filename=filename, 
-            media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-
-# ==================== 导入功能 ====================
+    chunks = iter_export_chunks(USER_EXPORT_COLUMNS, "users")
+    response = export_response("users", USER_EXPORT_COLUMNS, chunks, format)
+    log_operation(current_user["id"], "导出用户", format)
+    return response
 
-@router.post("/import/books", response_model=MessageResponse)
-async def import_books(
-    file: UploadFile = File(...),
+@router.get("/export/borrow-records")
+async def export_borrow_records(
+    format: str = Query("xlsx", description="导出格式：xlsx / csv / ndjson"),
+    date_from: Optional[str] = Query(None, description="借阅日期起（YYYY-MM-DD，含）"),
+    date_to: Optional[str] = Query(None, description="借阅日期止（YYYY-MM-DD，含）"),
     current_user: dict = Depends(require_admin_or_super)
 ):
-    """批量导入图书 (Excel)"""
+    """导出借阅记录（完整流通历史，可按借阅日期筛选）"""
+    conditions = []
+    params = []
+    if date_from:
+        conditions.append("br.borrow_ts >= ?")
+        params.append(local_date_ts(date_from))
+    if date_to:
+        conditions.append("br.borrow_ts < ?")
+        params.append(local_date_ts(date_to, next_day=True))
+
+    chunks = iter_export_chunks(
+        BORROW_EXPORT_COLUMNS,
+        "borrow_records br JOIN books b ON br.book_id = b.id JOIN users u ON br.user_id = u.id",
+        " AND ".join(conditions) or "1", tuple(params), key="br.id"
+    )
+    response = export_response("borrow_records", BORROW_EXPORT_COLUMNS, chunks, format)
+    log_operation(current_user["id"], "导出借阅记录", f"{format} {date_from or ''}~{date_to or ''}")
+    return response
+
+# ==================== 导入功能 ====================
+# 先用 pandas 对整列做规范化和校验，再用一次集合查询找出已存在的记录，
+# 最后在单个写事务中分批 executemany 写入；每行的错误汇总在返回结果中
+# mode=skip 跳过已存在的记录，mode=update 用文件内容更新已存在的记录（ON CONFLICT DO UPDATE）
+
+IMPORT_CHUNK_SIZE = 5000
+IMPORT_MAX_ERRORS = 500
+IMPORT_MODES = ("skip", "update")
+DEFAULT_PASSWORD = "12345678"
+# 导入时同时计算的密码哈希数：正好占满哈希线程池，只占用排队上限的一小部分，不挤占登录
+IMPORT_HASH_CONCURRENCY = HASH_WORKERS
+
+
+async def _read_import_file(file: UploadFile, required: list, mode: str) -> pd.DataFrame:
+    """读取上传的 Excel 并检查必需列"""
+    if mode not in IMPORT_MODES:
+        raise HTTPException(status_code=400, detail=f"不支持的导入模式: {mode}")
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="请上传 Excel 文件")
-    
+
+    content = await file.read()
     try:
-        content = await file.read()
-        df = pd.read_excel(io.BytesIO(content))
-        
-        # 检查必要的列
-        required_cols = ['title', 'author', 'isbn', 'category']
-        for col in required_cols:
-            if col not in df.columns:
-                raise HTTPException(status_code=400, detail=f"缺少列: {col}")
-        
-        success_count = 0
-        error_count = 0
-        
-        with get_db() as conn:
-            cursor = conn.cursor()
-            
-            for _, row in df.iterrows():
-                try:
-                    # 检查 ISBN 是否存在
-                    isbn = str(row['isbn'])
-                    cursor.execute("SELECT id FROM books WHERE isbn = ?", (isbn,))
-                    if cursor.fetchone():
-                        error_count += 1 # Skip existing
-                        continue
-                    
-                    title = row['title']
-                    author = row['author']
-                    category = row.get('category', '其它')
-                    total = int(row.get('total_count', 1))
-                    
-                    cursor.execute('''
-                        INSERT INTO books (title, author, isbn, category, total_count, available_count)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (title, author, isbn, category, total, total))
-                    
-                    success_count += 1
-                except Exception as e:
-                    print(f"Row error: {e}")
-                    error_count += 1
-            
-            conn.commit()
-            
-        return MessageResponse(
-            message=f"导入完成: 成功 {success_count} 本, 失败/跳过 {error_count} 本"
-        )
-        
+        # 全部按文本读取，ISBN、学号不会被识别为数字而丢失前导 0 或变成科学计数法
+        df = await asyncio.to_thread(pd.read_excel, io.BytesIO(content), dtype=str)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"文件处理失败: {str(e)}")
 
-@router.post("/import/users", response_model=MessageResponse)
+    df.columns = [str(column).strip() for column in df.columns]
+    missing = [column for column in required if column not in df.columns]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"缺少列: {', '.join(missing)}")
+    return df
+
+
+def _text_column(df: pd.DataFrame, column: str, default=None) -> pd.Series:
+    """去掉首尾空白，空单元格（或缺少该列）取默认值"""
+    if column not in df.columns:
+        return pd.Series(default, index=df.index, dtype=object)
+    values = df[column].str.strip().astype(object)
+    values[values.isna() | (values == "")] = default
+    return values
+
+
+def _flag(errors: pd.Series, mask: pd.Series, message: str):
+    """给尚无错误的行记录错误（每行只报告第一个错误）"""
+    errors[mask & errors.isna()] = message
+
+
+def _existing_rows(cursor, query: str, keys: list) -> dict:
+    """按键集合一次查出已存在的记录（键列表以 JSON 传入，不受 SQL 参数个数限制）"""
+    cursor.execute(query, (json.dumps(keys, ensure_ascii=False),))
+    return {row[0]: row for row in cursor.fetchall()}
+
+
+def _executemany_chunks(cursor, sql: str, rows: list) -> int:
+    """分批 executemany，返回影响的行数"""
+    changed = 0
+    for start in range(0, len(rows), IMPORT_CHUNK_SIZE):
+        cursor.executemany(sql, rows[start:start + IMPORT_CHUNK_SIZE])
+        changed += cursor.rowcount
+    return changed
+
+
+def _import_report(keys: pd.Series, errors: pd.Series) -> list:
+    """错误行报告，行号为 Excel 中的行号（第 1 行为表头）"""
+    failed = errors.dropna().head(IMPORT_MAX_ERRORS)
+    return [
+        {"row": int(index) + 2, "key": keys[index], "message": message}
+        for index, message in failed.items()
+    ]
+
+
+def _prepare_books(df: pd.DataFrame):
+    """规范化并校验图书数据，返回 (图书数据, 每行错误)"""
+    books = pd.DataFrame({
+        "title": _text_column(df, "title"),
+        "author": _text_column(df, "author"),
+        "isbn": _text_column(df, "isbn"),
+        "category": _text_column(df, "category", "其它"),
+        "location": _text_column(df, "location"),
+    })
+    errors = pd.Series(None, index=df.index, dtype=object)
+    _flag(errors, books["isbn"].isna(), "ISBN 不能为空")
+    _flag(errors, books["title"].isna(), "书名不能为空")
+    _flag(errors, books["author"].isna(), "作者不能为空")
+
+    raw_total = _text_column(df, "total_count")
+    total = pd.to_numeric(raw_total, errors="coerce")
+    _flag(errors, raw_total.notna() & ~((total >= 0) & (total % 1 == 0)), "total_count 必须是非负整数")
+    books["total_count"] = total.where(raw_total.notna() & errors.isna(), 1).fillna(1).astype(int)
+
+    _flag(errors, books["isbn"].notna() & books["isbn"].duplicated(), "ISBN 与文件中前面的行重复")
+    return books, errors
+
+
+def _prepare_users(df: pd.DataFrame):
+    """规范化并校验用户数据，返回 (用户数据, 每行错误)"""
+    users = pd.DataFrame({
+        "student_id": _text_column(df, "student_id"),
+        "name": _text_column(df, "name"),
+        "password": _text_column(df, "password", DEFAULT_PASSWORD),
+    })
+    errors = pd.Series(None, index=df.index, dtype=object)
+    _flag(errors, users["student_id"].isna(), "学号不能为空")
+    _flag(errors, users["name"].isna(), "姓名不能为空")
+    _flag(errors, users["student_id"].notna() & users["student_id"].duplicated(), "学号与文件中前面的行重复")
+    return users, errors
+
+
+@router.post("/import/books", response_model=ImportResponse)
+async def import_books(
+    file: UploadFile = File(...),
+    mode: str = Query("skip", description="已存在的 ISBN：skip 跳过 / update 更新"),
+    current_user: dict = Depends(require_admin_or_super)
+):
+    """
+    批量导入图书 (Excel)
+    需包含列 title, author, isbn, category，可选 total_count, location；
+    更新模式下按新的馆藏数量调整可借数量（不能少于已借出和预约保留的数量），已下架的图书重新上架
+    """
+    df = await _read_import_file(file, ['title', 'author', 'isbn', 'category'], mode)
+    books, errors = await asyncio.to_thread(_prepare_books, df)
+
+    def _import(conn):
+        cursor = conn.cursor()
+        valid = books[errors.isna()]
+        existing = _existing_rows(
+            cursor,
+            "SELECT isbn, total_count, available_count FROM books WHERE isbn IN (SELECT value FROM json_each(?))",
+            valid["isbn"].tolist()
+        )
+        is_existing = valid["isbn"].isin(list(existing))
+
+        if mode == "update":
+            # 馆藏数量不能少于已被占用（借出 + 预约保留）的数量
+            in_use = valid["isbn"].map(
+                lambda isbn: existing[isbn]["total_count"] - existing[isbn]["available_count"] if isbn in existing else 0
+            )
+            _flag(errors, (valid["total_count"] < in_use).reindex(errors.index, fill_value=False),
+                  "馆藏数量少于已借出和预约保留的数量")
+            rows = books[errors.isna()]
+            is_existing = rows["isbn"].isin(list(existing))
+            sql = '''
+                INSERT INTO books (title, author, isbn, category, total_count, available_count, location)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(isbn) DO UPDATE SET
+                    title = excluded.title,
+                    author = excluded.author,
+                    category = excluded.category,
+                    available_count = available_count + excluded.total_count - total_count,
+                    total_count = excluded.total_count,
+                    location = COALESCE(excluded.location, location),
+                    status = 'active'
+            '''
+        else:
+            rows = valid[~is_existing]
+            sql = '''
+                INSERT INTO books (title, author, isbn, category, total_count, available_count, location)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            '''
+
+        _executemany_chunks(cursor, sql, list(zip(
+            rows["title"], rows["author"], rows["isbn"], rows["category"],
+            rows["total_count"].tolist(), rows["total_count"].tolist(), rows["location"]
+        )))
+
+        updated = int(is_existing.sum()) if mode == "update" else 0
+        notified = []
+        if updated:
+            # 增加馆藏后新的可借库存先分配给排队读者
+            cursor.execute('''
+                SELECT DISTINCT h.book_id FROM holds h
+                JOIN books b ON b.id = h.book_id
+                WHERE h.status = 'waiting' AND b.available_count > 0
+                  AND b.isbn IN (SELECT value FROM json_each(?))
+            ''', (json.dumps(rows["isbn"][is_existing].tolist(), ensure_ascii=False),))
+            for row in cursor.fetchall():
+                notified += allocate_holds(cursor, row["book_id"])
+
+        inserted = len(rows) - updated
+        skipped = int(is_existing.sum()) if mode == "skip" else 0
+        return inserted, updated, skipped, notified
+
+    inserted, updated, skipped, notified = await run_write(_import)
+    if inserted or updated:
+        bump_catalog_version()
+    publish_hold_notices(notified)
+
+    error_count = int(errors.notna().sum())
+    message = f"导入完成: 新增 {inserted} 本, 更新 {updated} 本, 跳过已存在 {skipped} 本, 错误 {error_count} 行"
+    log_operation(current_user["id"], "批量导入图书", message)
+    return ImportResponse(
+        message=message, inserted=inserted, updated=updated, skipped=skipped,
+        error_count=error_count, errors=_import_report(books["isbn"], errors)
+    )
+
+@router.post("/import/users", response_model=ImportResponse)
 async def import_users(
     file: UploadFile = File(...),
+    mode: str = Query("skip", description="已存在的学号：skip 跳过 / update 更新姓名"),
     current_user: dict = Depends(require_admin_or_super)
 ):
-    """批量导入用户 (Excel)"""
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        raise HTTPException(status_code=400, detail="请上传 Excel 文件")
-    
-    try:
-        content = await file.read()
-        df = pd.read_excel(io.BytesIO(content))
-        
-        # Check columns
-        if 'student_id' not in df.columns or 'name' not in df.columns:
-             raise HTTPException(status_code=400, detail="缺少列: student_id, name")
-             
-        success_count = 0
-        error_count = 0
-        
-        with get_db() as conn:
-            cursor = conn.cursor()
-            
-            for _, row in df.iterrows():
-                try:
-                    student_id = str(row['student_id'])
-                    
-                    cursor.execute("SELECT id FROM users WHERE student_id = ?", (student_id,))
-                    if cursor.fetchone():
-                        error_count += 1
-                        continue
-                        
-                    name = row['name']
-                    password = str(row.get('password', '12345678')) # Default password
-                    pwd_hash = get_password_hash(password)
-                    
-                    cursor.execute('''
-                        INSERT INTO users (student_id, password_hash, name, role)
-                        VALUES (?, ?, ?, 'student')
-                    ''', (student_id, pwd_hash, name))
-                    
-                    success_count += 1
-                except Exception:
-                    error_count += 1
-            
-            conn.commit()
-            
-        return MessageResponse(
-            message=f"导入完成: 成功 {success_count} 人, 失败/跳过 {error_count} 人"
+    """
+    批量导入学生 (Excel)
+    需包含列 student_id, name，可选 password（默认 12345678）；
+    更新模式只更新已有学生的姓名，不会通过导入修改已有账号的密码，也不会修改管理员账号；
+    每个不同的密码都要计算一次 scrypt（约几十毫秒），按 IMPORT_HASH_CONCURRENCY 路并行，
+    每人密码都不同的大文件（如上万行）导入需要数十秒到几分钟
+    """
+    df = await _read_import_file(file, ['student_id', 'name'], mode)
+    users, errors = await asyncio.to_thread(_prepare_users, df)
+
+    valid = users[errors.isna()]
+    existing = await run_db(lambda conn: _existing_rows(
+        conn.cursor(),
+        "SELECT student_id, id, role FROM users WHERE student_id IN (SELECT value FROM json_each(?))",
+        valid["student_id"].tolist()
+    ))
+    is_existing = valid["student_id"].isin(list(existing))
+    is_staff = valid["student_id"].map(lambda sid: sid in existing and existing[sid]["role"] != "student").astype(bool)
+    _flag(errors, is_staff.reindex(errors.index, fill_value=False), "该学号属于管理员账号，不能通过导入修改")
+
+    new_users = valid[~is_existing]
+    updates = valid[is_existing & ~is_staff] if mode == "update" else valid.iloc[0:0]
+
+    # 只为新增的用户计算密码哈希，相同密码只计算一次（通常整批使用默认密码），不同密码分批并行计算
+    passwords = new_users["password"].unique().tolist()
+    password_hashes = {}
+    for start in range(0, len(passwords), IMPORT_HASH_CONCURRENCY):
+        chunk = passwords[start:start + IMPORT_HASH_CONCURRENCY]
+        hashes = await asyncio.gather(*(hash_password_async(password) for password in chunk))
+        password_hashes.update(zip(chunk, hashes))
+
+    def _import(conn):
+        cursor = conn.cursor()
+        # 查询之后新建的同学号用户由 ON CONFLICT 跳过
+        inserted = _executemany_chunks(cursor, '''
+            INSERT INTO users (student_id, password_hash, name, role)
+            VALUES (?, ?, ?, 'student')
+            ON CONFLICT(student_id) DO NOTHING
+        ''', list(zip(new_users["student_id"], new_users["password"].map(password_hashes), new_users["name"])))
+        updated = _executemany_chunks(
+            cursor,
+            "UPDATE users SET name = ? WHERE student_id = ? AND role = 'student'",
+            list(zip(updates["name"], updates["student_id"]))
         )
-        
-    except Exception as e:
-         raise HTTPException(status_code=400, detail=f"文件处理失败: {str(e)}")
+        return inserted, updated
+
+    inserted, updated = await run_write(_import)
+    for student_id in updates["student_id"]:
+        invalidate_user(existing[student_id]["id"])
+
+    skipped = len(new_users) - inserted + (int((is_existing & ~is_staff).sum()) if mode == "skip" else 0)
+    error_count = int(errors.notna().sum())
+    message = f"导入完成: 新增 {inserted} 人, 更新 {updated} 人, 跳过已存在 {skipped} 人, 错误 {error_count} 行"
+    log_operation(current_user["id"], "批量导入用户", message)
+    return ImportResponse(
+        message=message, inserted=inserted, updated=updated, skipped=skipped,
+        error_count=error_count, errors=_import_report(users["student_id"], errors)
+    )
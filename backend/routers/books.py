@@ -1,156 +1,286 @@
 """
 图书管理 API 路由
 """
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from typing import Optional, List
 
-from database import get_db
+from database import run_db, run_write, fetch_one, fetch_all, fetch_value
+from pagination import keyset_clause, split_page, total_pages
+from migrations import read_catalog_stats
+from cache import cached_catalog, bump_catalog_version
+from http_cache import CachedJSON, json_response
 from models import BookCreate, BookUpdate, BookResponse, MessageResponse
 from auth import get_current_user, require_admin, require_admin_or_super
+from routers.holds import allocate_holds, cancel_book_holds, publish_hold_notices
+from audit import log_operation
 
 router = APIRouter(prefix="/api/books", tags=["books"])
 
+# trigram 分词最少需要 3 个字符，更短的关键词退回 LIKE 匹配
+FTS_MIN_TERM_LENGTH = 3
+
+
+def build_search_clause(search: str):
+    """
+    将搜索关键词拆分为全文检索条件和 LIKE 条件
+    返回 (fts_match, like_clauses, like_params)
+    - 长度 >= 3 的词组成 FTS5 MATCH 表达式（短语之间为 AND）
+    - 较短的词（如两个字的中文书名）使用 LIKE 在候选结果上过滤
+    """
+    phrases = []
+    like_clauses = []
+    like_params = []
+
+    for term in search.split():
+        if len(term) >= FTS_MIN_TERM_LENGTH:
+            phrases.append('"' + term.replace('"', '""') + '"')
+        else:
+            like_clauses.append("(b.title LIKE ? OR b.author LIKE ? OR b.isbn LIKE ?)")
+            pattern = f"%{term}%"
+            like_params.extend([pattern, pattern, pattern])
+
+    fts_match = " AND ".join(phrases) if phrases else None
+    return fts_match, like_clauses, like_params
+
+
 @router.get("")
 async def get_books(
+    request: Request,
     search: Optional[str] = Query(None, description="搜索关键词"),
     category: Optional[str] = Query(None, description="分类筛选"),
     page: int = Query(1, ge=1, description="页码"),
     page_size: int = Query(20, ge=1, le=100, description="每页数量"),
+    after: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor），传入时忽略 page"),
+    include_total: bool = Query(True, description="是否统计总数"),
     current_user: dict = Depends(get_current_user)
 ):
-    """获取图书列表（带分页）"""
-    with get_db() as conn:
+    """
+    获取图书列表（带分页，搜索结果按相关度排序）
+    结果按目录版本缓存，支持 ETag 条件请求
+    """
+    # 构建基础查询条件
+    select_clause = "SELECT b.*, b.created_at AS _sort_key"
+    from_clause = "FROM books b"
+    where_clause = "WHERE b.status = 'active'"
+    order_clause = "ORDER BY b.created_at DESC, b.id DESC"
+    sort_columns = ["b.created_at", "b.id"]
+    descending = True
+    params = []
+
+    if search and search.strip():
+        fts_match, like_clauses, like_params = build_search_clause(search)
+        if fts_match:
+            # 全文检索命中的图书，按 bm25 相关度排序
+            select_clause = "SELECT b.*, f.rank AS _sort_key"
+            from_clause = "FROM books_fts f JOIN books b ON b.id = f.rowid"
+            where_clause += " AND books_fts MATCH ?"
+            params.append(fts_match)
+            order_clause = "ORDER BY f.rank, b.id"
+            sort_columns = ["f.rank", "b.id"]
+            descending = False
+        for clause in like_clauses:
+            where_clause += f" AND {clause}"
+        params.extend(like_params)
+
+    if category and category != "全部":
+        where_clause += " AND b.category = ?"
+        params.append(category)
+
+    # 游标分页：从上一页最后一条之后开始
+    page_clause = where_clause
+    page_params = list(params)
+    if after:
+        clause, values = keyset_clause(sort_columns, after, descending)
+        page_clause += f" AND {clause}"
+        page_params.extend(values)
+        offset = 0
+    else:
+        offset = (page - 1) * page_size
+
+    def _query(conn):
         cursor = conn.cursor()
-        
-        # 构建基础查询条件
-        where_clause = "WHERE status = 'active'"
-        params = []
-        
-        if search:
-            where_clause += " AND (title LIKE ? OR author LIKE ? OR isbn LIKE ?)"
-            search_pattern = f"%{search}%"
-            params.extend([search_pattern, search_pattern, search_pattern])
-        
-        if category and category != "全部":
-            where_clause += " AND category = ?"
-            params.append(category)
-        
-        # 获取总数
-        count_query = f"SELECT COUNT(*) as count FROM books {where_clause}"
-        cursor.execute(count_query, params)
-        total = cursor.fetchone()["count"]
-        
-        # 获取分页数据
-        query = f"SELECT * FROM books {where_clause} ORDER BY created_at DESC LIMIT ? OFFSET ?"
-        params.extend([page_size, (page - 1) * page_size])
-        
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        
-        return {
-            "items": [dict(row) for row in rows],
+
+        # 获取总数（可跳过）
+        total = None
+        if include_total:
+            count_query = f"SELECT COUNT(*) as count {from_clause} {where_clause}"
+            cursor.execute(count_query, params)
+            total = cursor.fetchone()["count"]
+
+        # 获取分页数据（多取一条判断是否有下一页）
+        query = f"{select_clause} {from_clause} {page_clause} {order_clause} LIMIT ? OFFSET ?"
+        cursor.execute(query, page_params + [page_size + 1, offset])
+        rows, next_cursor = split_page([dict(row) for row in cursor.fetchall()], page_size, ["_sort_key", "id"])
+        for row in rows:
+            row.pop("_sort_key")
+
+        return CachedJSON({
+            "items": rows,
             "total": total,
             "page": page,
             "page_size": page_size,
-            "total_pages": (total + page_size - 1) // page_size
-        }
+            "total_pages": total_pages(total, page_size),
+            "next_cursor": next_cursor
+        })
+
+    cache_key = ("books", search, category, page, page_size, after, include_total)
+    cached = await cached_catalog(cache_key, lambda: run_db(_query))
+    return json_response(request, cached)
 
 @router.get("/categories", response_model=List[str])
-async def get_categories(current_user: dict = Depends(get_current_user)):
+async def get_categories(request: Request, current_user: dict = Depends(get_current_user)):
     """获取所有分类"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT category FROM books WHERE status = 'active' ORDER BY category")
-        rows = cursor.fetchall()
-        return [row["category"] for row in rows]
+    async def _load():
+        rows = await fetch_all("SELECT DISTINCT category FROM books WHERE status = 'active' ORDER BY category")
+        return CachedJSON([row["category"] for row in rows])
+
+    return json_response(request, await cached_catalog("categories", _load))
 
 @router.get("/stats")
 async def get_stats(current_user: dict = Depends(get_current_user)):
-    """获取统计数据"""
-    with get_db() as conn:
+    """获取统计数据（读取触发器维护的物化统计行）"""
+    return await cached_catalog("stats", lambda: run_db(lambda conn: read_catalog_stats(conn.cursor())))
+
+# 批量查询单次最多返回的图书数量
+BATCH_MAX_IDS = 100
+
+
+@router.get("/batch")
+async def get_books_batch(
+    ids: str = Query(..., description="图书ID，逗号分隔，如 1,2,3"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    批量获取图书及当前用户的状态（是否收藏、是否在借、我的评分）
+    用于一次渲染多张图书卡片，代替逐本请求详情和收藏状态
+    """
+    try:
+        book_ids = list(dict.fromkeys(int(part) for part in ids.split(",") if part.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="图书ID格式错误")
+    if not book_ids:
+        raise HTTPException(status_code=400, detail="请提供图书ID")
+    if len(book_ids) > BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"单次最多查询 {BATCH_MAX_IDS} 本图书")
+
+    user_id = current_user["id"]
+    placeholders = ", ".join("?" for _ in book_ids)
+
+    def _query(conn):
         cursor = conn.cursor()
-        
-        # 总图书数
-        cursor.execute("SELECT COUNT(*) as count FROM books WHERE status = 'active'")
-        total_books = cursor.fetchone()["count"]
-        
-        # 分类数
-        cursor.execute("SELECT COUNT(DISTINCT category) as count FROM books WHERE status = 'active'")
-        total_categories = cursor.fetchone()["count"]
-        
-        # 作者数
-        cursor.execute("SELECT COUNT(DISTINCT author) as count FROM books WHERE status = 'active'")
-        total_authors = cursor.fetchone()["count"]
-        
-        # 当前借出数
-        cursor.execute("SELECT COUNT(*) as count FROM borrow_records WHERE status = 'borrowed'")
-        borrowed_count = cursor.fetchone()["count"]
-        
-        return {
-            "total_books": total_books,
-            "total_categories": total_categories,
-            "total_authors": total_authors,
-            "borrowed_count": borrowed_count
-        }
+
+        cursor.execute(
+            f"SELECT * FROM books WHERE id IN ({placeholders}) AND status = 'active'",
+            book_ids
+        )
+        books = {row["id"]: dict(row) for row in cursor.fetchall()}
+
+        cursor.execute(
+            f"SELECT book_id FROM favorites WHERE user_id = ? AND book_id IN ({placeholders})",
+            [user_id] + book_ids
+        )
+        favorited = {row["book_id"] for row in cursor.fetchall()}
+
+        cursor.execute(
+            f"""SELECT book_id FROM borrow_records
+                WHERE user_id = ? AND status = 'borrowed' AND book_id IN ({placeholders})""",
+            [user_id] + book_ids
+        )
+        borrowed = {row["book_id"] for row in cursor.fetchall()}
+
+        cursor.execute(
+            f"""SELECT book_id, rating FROM reviews
+                WHERE user_id = ? AND book_id IN ({placeholders})
+                ORDER BY created_at""",
+            [user_id] + book_ids
+        )
+        ratings = {row["book_id"]: row["rating"] for row in cursor.fetchall()}
+
+        # 按请求顺序返回，不存在或已下架的图书放入 missing
+        items = []
+        missing = []
+        for book_id in book_ids:
+            book = books.get(book_id)
+            if not book:
+                missing.append(book_id)
+                continue
+            items.append({
+                **book,
+                "is_favorite": book_id in favorited,
+                "borrowed_by_me": book_id in borrowed,
+                "my_rating": ratings.get(book_id)
+            })
+
+        return {"items": items, "missing": missing}
+
+    return await run_db(_query)
 
 @router.get("/{book_id}")
-async def get_book(book_id: int, current_user: dict = Depends(get_current_user)):
-    """获取单本图书详情"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM books WHERE id = ? AND status = 'active'", (book_id,))
-        row = cursor.fetchone()
-        
-        if not row:
-            raise HTTPException(status_code=404, detail="图书不存在")
-        
-        return dict(row)
+async def get_book(book_id: int, request: Request, current_user: dict = Depends(get_current_user)):
+    """获取单本图书详情（支持 ETag 条件请求）"""
+    async def _load():
+        book = await fetch_one("SELECT * FROM books WHERE id = ? AND status = 'active'", (book_id,))
+        return CachedJSON(book) if book else None
+
+    cached = await cached_catalog(("book", book_id), _load)
+    if not cached:
+        raise HTTPException(status_code=404, detail="图书不存在")
+    return json_response(request, cached)
 
 @router.post("", response_model=MessageResponse)
 async def create_book(book: BookCreate, current_user: dict = Depends(require_admin_or_super)):
     """上架新图书（仅管理员）"""
     from covers_util import download_cover
-    
-    with get_db() as conn:
+
+    # 检查 ISBN 是否重复
+    if book.isbn:
+        if await fetch_value("SELECT id FROM books WHERE isbn = ?", (book.isbn,)):
+            raise HTTPException(status_code=400, detail="ISBN 已存在")
+
+    # 下载封面到本地并获取状态（不占用数据库连接）
+    local_cover = ""
+    cover_status = 2  # 默认无法获取
+
+    if book.cover:
+        local_cover, cover_status = await download_cover(book.cover, book.isbn)
+
+    def _insert(conn):
         cursor = conn.cursor()
-        
-        # 检查 ISBN 是否重复
+
+        # 下载封面期间可能有并发上架，再次检查 ISBN
         if book.isbn:
             cursor.execute("SELECT id FROM books WHERE isbn = ?", (book.isbn,))
             if cursor.fetchone():
                 raise HTTPException(status_code=400, detail="ISBN 已存在")
-        
-        # 下载封面到本地并获取状态
-        local_cover = ""
-        cover_status = 2  # 默认无法获取
-        
-        if book.cover:
-            local_cover, cover_status = await download_cover(book.cover, book.isbn)
-        
+
         cursor.execute('''
             INSERT INTO books (title, author, isbn, category, cover, cover_status, total_count, available_count, location)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (book.title, book.author, book.isbn, book.category, local_cover, cover_status, book.total_count, book.total_count, book.location))
-        
+
         conn.commit()
-        return MessageResponse(message="图书上架成功")
+
+    await run_db(_insert)
+    bump_catalog_version()
+    log_operation(current_user["id"], "上架图书", f"《{book.title}》 ISBN {book.isbn}")
+    return MessageResponse(message="图书上架成功")
 
 @router.put("/{book_id}", response_model=MessageResponse)
 async def update_book(book_id: int, book: BookUpdate, current_user: dict = Depends(require_admin_or_super)):
     """更新图书信息（仅管理员）"""
-    with get_db() as conn:
+    def _update(conn):
         cursor = conn.cursor()
-        
+
         # 检查图书是否存在
         cursor.execute("SELECT * FROM books WHERE id = ?", (book_id,))
         existing = cursor.fetchone()
         if not existing:
             raise HTTPException(status_code=404, detail="图书不存在")
-        
+
         # 构建更新语句
         updates = []
         params = []
-        
+
         if book.title is not None:
             updates.append("title = ?")
             params.append(book.title)
@@ -176,21 +306,27 @@ async def update_book(book_id: int, book: BookUpdate, current_user: dict = Depen
             updates.append("available_count = available_count + ?")
             params.append(book.total_count)
             params.append(diff)
-        
-        if updates:
-            query = f"UPDATE books SET {', '.join(updates)} WHERE id = ?"
-            params.append(book_id)
-            cursor.execute(query, params)
-            conn.commit()
-        
-        return MessageResponse(message="图书信息更新成功")
+
+        if not updates:
+            return []
+        query = f"UPDATE books SET {', '.join(updates)} WHERE id = ?"
+        params.append(book_id)
+        cursor.execute(query, params)
+        # 增加馆藏后新的可借库存先分配给排队读者
+        return allocate_holds(cursor, book_id)
+
+    notified = await run_write(_update)
+    bump_catalog_version()
+    publish_hold_notices(notified)
+    log_operation(current_user["id"], "更新图书", f"图书ID {book_id}")
+    return MessageResponse(message="图书信息更新成功")
 
 @router.delete("/{book_id}", response_model=MessageResponse)
 async def delete_book(book_id: int, current_user: dict = Depends(require_admin_or_super)):
     """下架图书（仅管理员）"""
-    with get_db() as conn:
+    def _delete(conn):
         cursor = conn.cursor()
-        
+
         # 检查是否有未归还的借阅
         cursor.execute(
             "SELECT COUNT(*) as count FROM borrow_records WHERE book_id = ? AND status = 'borrowed'",
@@ -198,9 +334,12 @@ async def delete_book(book_id: int, current_user: dict = Depends(require_admin_o
         )
         if cursor.fetchone()["count"] > 0:
             raise HTTPException(status_code=400, detail="该图书有未归还的借阅记录，无法下架")
-        
-        # 软删除
+
+        # 软删除，同时取消该书的预约并退回保留的库存
         cursor.execute("UPDATE books SET status = 'deleted' WHERE id = ?", (book_id,))
-        conn.commit()
-        
-        return MessageResponse(message="图书下架成功")
+        cancel_book_holds(cursor, book_id)
+
+    await run_write(_delete)
+    bump_catalog_version()
+    log_operation(current_user["id"], "下架图书", f"图书ID {book_id}")
+    return MessageResponse(message="图书下架成功")
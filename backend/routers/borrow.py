@@ -1,24 +1,55 @@
 """
 借阅管理 API 路由
 """
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from typing import List, Optional
 from datetime import datetime, timedelta
 
-from database import get_db
-from models import BorrowRequest, BorrowRecordResponse, MessageResponse
+from database import run_write, fetch_all
+from pagination import keyset_clause, split_page
+from timeutil import local_date_ts, NOW_TS
+from cache import bump_catalog_version
+from models import BorrowRequest, BorrowRecordResponse, MessageResponse, BulkCirculationRequest
 from auth import get_current_user, require_admin_or_super
+from routers.holds import allocate_holds, claim_hold, publish_hold_notices
+from routers.fines import settle_overdue_fine, refresh_overdue_fines
+from audit import log_operation
 
 router = APIRouter(prefix="/api/borrow", tags=["borrow"])
 
+# 批量借还单次最多处理的操作数
+BULK_MAX_OPERATIONS = 200
+
+
+def close_borrow_record(cursor, record_id: int, book_id: int) -> list:
+    """
+    归还一条借阅记录并回补库存，需在 run_write 的事务中调用
+    条件更新保证同一条记录只会被归还一次，库存只回补一次；
+    逾期的记录同时结清罚款；有人排队时这本书直接保留给队首读者，返回收到到书通知的用户ID列表
+    """
+    cursor.execute(f'''
+        UPDATE borrow_records 
+        SET status = 'returned', return_date = CURRENT_TIMESTAMP, return_ts = {NOW_TS}
+        WHERE id = ? AND status = 'borrowed'
+    ''', (record_id,))
+    if cursor.rowcount == 0:
+        raise HTTPException(status_code=404, detail="借阅记录不存在或已归还")
+    settle_overdue_fine(cursor, record_id)
+    
+    cursor.execute(
+        "UPDATE books SET available_count = available_count + 1 WHERE id = ?",
+        (book_id,)
+    )
+    return allocate_holds(cursor, book_id)
+
 @router.post("/return-by-isbn", response_model=MessageResponse)
 async def return_book_by_isbn(
     isbn: str = Query(..., description="图书ISBN"),
     student_id: str = Query(None, description="学号（管理员必填）"),
     current_user: dict = Depends(get_current_user)
 ):
-    """通过ISBN扫码还书"""
-    with get_db() as conn:
+    """通过ISBN扫码还书（单个 IMMEDIATE 事务）"""
+    def _return(conn):
         cursor = conn.cursor()
         
         # 通过 ISBN 找到图书
@@ -64,20 +95,146 @@ async def return_book_by_isbn(
             raise HTTPException(status_code=404, detail=f"学号 {student_id} 没有借阅《{book_title}》的记录")
         
         # 执行归还
-        cursor.execute('''
-            UPDATE borrow_records 
-            SET status = 'returned', return_date = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (record["id"],))
+        notified = close_borrow_record(cursor, record["id"], book_id)
         
+        return MessageResponse(message=f"《{book_title}》（{target_user_name}）归还成功"), notified
+
+    result, notified = await run_write(_return)
+    bump_catalog_version()
+    publish_hold_notices(notified)
+    log_operation(current_user["id"], "扫码还书", result.message)
+    return result
+
+@router.post("/bulk")
+async def bulk_circulation(
+    request: BulkCirculationRequest,
+    current_user: dict = Depends(require_admin_or_super)
+):
+    """
+    前台批量借还（仅管理员）
+    按 ISBN / 学号集合一次性查出图书、用户和在借记录，所有操作在同一个事务中按顺序执行，
+    单条失败不影响其他操作，返回每条操作的结果
+    """
+    operations = request.operations
+    if not operations:
+        raise HTTPException(status_code=400, detail="请提供借还操作")
+    if len(operations) > BULK_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"单次最多处理 {BULK_MAX_OPERATIONS} 条操作")
+    for op in operations:
+        if op.action not in ("borrow", "return"):
+            raise HTTPException(status_code=400, detail=f"不支持的操作类型: {op.action}")
+
+    isbns = list({op.isbn for op in operations})
+    student_ids = list({op.student_id for op in operations})
+
+    def _apply(conn):
+        cursor = conn.cursor()
+
+        if any(op.action == "borrow" for op in operations):
+            cursor.execute("SELECT key, value FROM system_settings WHERE key IN ('min_borrow_days', 'max_borrow_days')")
+            settings = {row["key"]: int(row["value"]) for row in cursor.fetchall()}
+            min_days = settings.get("min_borrow_days", 1)
+            max_days = settings.get("max_borrow_days", 60)
+            if request.days < min_days or request.days > max_days:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"借阅天数必须在 {min_days} 到 {max_days} 天之间"
+                )
+
+        # 集合查询：图书、用户、相关的在借记录
         cursor.execute(
-            "UPDATE books SET available_count = available_count + 1 WHERE id = ?",
-            (book_id,)
+            f"SELECT id, isbn, title, status FROM books WHERE isbn IN ({', '.join('?' for _ in isbns)})",
+            isbns
         )
-        
-        conn.commit()
-        
-        return MessageResponse(message=f"《{book_title}》（{target_user_name}）归还成功")
+        books = {row["isbn"]: dict(row) for row in cursor.fetchall()}
+
+        cursor.execute(
+            f"SELECT id, student_id, name FROM users WHERE student_id IN ({', '.join('?' for _ in student_ids)})",
+            student_ids
+        )
+        users = {row["student_id"]: dict(row) for row in cursor.fetchall()}
+
+        open_records = {}
+        if books and users:
+            book_ids = [book["id"] for book in books.values()]
+            user_ids = [user["id"] for user in users.values()]
+            cursor.execute(
+                f"""SELECT id, book_id, user_id FROM borrow_records
+                    WHERE status = 'borrowed'
+                      AND book_id IN ({', '.join('?' for _ in book_ids)})
+                      AND user_id IN ({', '.join('?' for _ in user_ids)})""",
+                book_ids + user_ids
+            )
+            open_records = {(row["book_id"], row["user_id"]): row["id"] for row in cursor.fetchall()}
+
+        due_date = (datetime.now() + timedelta(days=request.days)).replace(microsecond=0)
+        due_date_str = due_date.strftime("%Y-%m-%d %H:%M:%S")
+        due_ts = int(due_date.timestamp())
+        results = []
+        notified = []
+
+        for index, op in enumerate(operations):
+            result = {"index": index, "action": op.action, "isbn": op.isbn,
+                      "student_id": op.student_id, "success": False}
+            results.append(result)
+
+            book = books.get(op.isbn)
+            user = users.get(op.student_id)
+            if not book:
+                result["message"] = f"未找到 ISBN 为 {op.isbn} 的图书"
+                continue
+            if not user:
+                result["message"] = f"未找到学号为 {op.student_id} 的用户"
+                continue
+
+            key = (book["id"], user["id"])
+            if op.action == "borrow":
+                if book["status"] != "active":
+                    result["message"] = f"《{book['title']}》已下架"
+                    continue
+                if key in open_records:
+                    result["message"] = f"{user['name']} 已借阅《{book['title']}》"
+                    continue
+                if not claim_hold(cursor, book["id"], user["id"]):
+                    cursor.execute(
+                        "UPDATE books SET available_count = available_count - 1 WHERE id = ? AND available_count > 0",
+                        (book["id"],)
+                    )
+                    if cursor.rowcount == 0:
+                        result["message"] = f"《{book['title']}》已全部借出"
+                        continue
+                cursor.execute(f'''
+                    INSERT INTO borrow_records (book_id, user_id, due_date, status, borrow_ts, due_ts)
+                    VALUES (?, ?, ?, 'borrowed', {NOW_TS}, ?)
+                ''', (book["id"], user["id"], due_date_str, due_ts))
+                open_records[key] = cursor.lastrowid
+                result.update(success=True, record_id=cursor.lastrowid,
+                              message=f"《{book['title']}》（{user['name']}）借出成功，应还日期 {due_date.strftime('%Y-%m-%d')}")
+            else:
+                record_id = open_records.pop(key, None)
+                if record_id is None:
+                    result["message"] = f"学号 {op.student_id} 没有借阅《{book['title']}》的记录"
+                    continue
+                notified += close_borrow_record(cursor, record_id, book["id"])
+                result.update(success=True, record_id=record_id,
+                              message=f"《{book['title']}》（{user['name']}）归还成功")
+
+        return results, notified
+
+    results, notified = await run_write(_apply)
+    success_count = sum(1 for result in results if result["success"])
+    if success_count:
+        bump_catalog_version()
+    publish_hold_notices(notified)
+    log_operation(
+        current_user["id"], "批量借还",
+        f"共 {len(results)} 条，成功 {success_count} 条，失败 {len(results) - success_count} 条"
+    )
+    return {
+        "results": results,
+        "success_count": success_count,
+        "error_count": len(results) - success_count
+    }
 
 @router.post("/{book_id}", response_model=MessageResponse)
 async def borrow_book(
@@ -85,8 +242,8 @@ async def borrow_book(
     request: BorrowRequest = BorrowRequest(),
     current_user: dict = Depends(get_current_user)
 ):
-    """借阅图书"""
-    with get_db() as conn:
+    """借阅图书（单个 IMMEDIATE 事务，条件扣减库存）"""
+    def _borrow(conn):
         cursor = conn.cursor()
         
         # 获取系统设置的借阅天数范围
@@ -102,17 +259,7 @@ async def borrow_book(
                 detail=f"借阅天数必须在 {min_days} 到 {max_days} 天之间"
             )
         
-        # 检查图书是否存在且可借
-        cursor.execute("SELECT * FROM books WHERE id = ? AND status = 'active'", (book_id,))
-        book = cursor.fetchone()
-        
-        if not book:
-            raise HTTPException(status_code=404, detail="图书不存在")
-        
-        if book["available_count"] <= 0:
-            raise HTTPException(status_code=400, detail="该图书已全部借出")
-        
-        # 检查用户是否已借阅该书（未归还）
+        # 检查用户是否已借阅该书（未归还）；事务已持有写锁，检查与写入之间不会插入其他借阅
         cursor.execute('''
             SELECT id FROM borrow_records 
             WHERE book_id = ? AND user_id = ? AND status = 'borrowed'
@@ -121,26 +268,39 @@ async def borrow_book(
         if cursor.fetchone():
             raise HTTPException(status_code=400, detail="您已借阅该书，请先归还")
         
-        # 创建借阅记录
-        due_date = datetime.now() + timedelta(days=request.days)
-        cursor.execute('''
-            INSERT INTO borrow_records (book_id, user_id, due_date, status)
-            VALUES (?, ?, ?, 'borrowed')
-        ''', (book_id, current_user["id"], due_date.strftime("%Y-%m-%d %H:%M:%S")))
+        # 有为本人保留的预约时，库存已在保留时扣除
+        if not claim_hold(cursor, book_id, current_user["id"]):
+            # 条件扣减库存：库存不足时不更新任何行，可借数量不会小于 0
+            cursor.execute('''
+                UPDATE books SET available_count = available_count - 1
+                WHERE id = ? AND status = 'active' AND available_count > 0
+            ''', (book_id,))
+            
+            if cursor.rowcount == 0:
+                cursor.execute("SELECT id FROM books WHERE id = ? AND status = 'active'", (book_id,))
+                if not cursor.fetchone():
+                    raise HTTPException(status_code=404, detail="图书不存在")
+                raise HTTPException(status_code=400, detail="该图书已全部借出，可加入预约队列")
         
-        # 更新图书可借数量
-        cursor.execute(
-            "UPDATE books SET available_count = available_count - 1 WHERE id = ?",
-            (book_id,)
-        )
+        # 创建借阅记录
+        # 时间戳随记录一起写入（due_date 为本地时间）
+        due_date = (datetime.now() + timedelta(days=request.days)).replace(microsecond=0)
+        cursor.execute(f'''
+            INSERT INTO borrow_records (book_id, user_id, due_date, status, borrow_ts, due_ts)
+            VALUES (?, ?, ?, 'borrowed', {NOW_TS}, ?)
+        ''', (book_id, current_user["id"], due_date.strftime("%Y-%m-%d %H:%M:%S"), int(due_date.timestamp())))
         
-        conn.commit()
         return MessageResponse(message=f"借阅成功，请在 {due_date.strftime('%Y-%m-%d')} 前归还")
 
+    result = await run_write(_borrow)
+    bump_catalog_version()
+    log_operation(current_user["id"], "借阅图书", f"图书ID {book_id}，{result.message}")
+    return result
+
 @router.post("/return/{record_id}", response_model=MessageResponse)
 async def return_book(record_id: int, current_user: dict = Depends(get_current_user)):
-    """归还图书"""
-    with get_db() as conn:
+    """归还图书（单个 IMMEDIATE 事务）"""
+    def _return(conn):
         cursor = conn.cursor()
         
         # 检查借阅记录
@@ -159,126 +319,141 @@ async def return_book(record_id: int, current_user: dict = Depends(get_current_u
         if current_user["role"] != "admin" and record["user_id"] != current_user["id"]:
             raise HTTPException(status_code=403, detail="无权操作此借阅记录")
         
-        # 更新借阅记录
-        cursor.execute('''
-            UPDATE borrow_records 
-            SET status = 'returned', return_date = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (record_id,))
-        
-        # 更新图书可借数量
-        cursor.execute(
-            "UPDATE books SET available_count = available_count + 1 WHERE id = ?",
-            (record["book_id"],)
-        )
-        
-        conn.commit()
-        return MessageResponse(message=f"《{record['book_title']}》归还成功")
+        notified = close_borrow_record(cursor, record_id, record["book_id"])
+        return MessageResponse(message=f"《{record['book_title']}》归还成功"), notified
+
+    result, notified = await run_write(_return)
+    bump_catalog_version()
+    publish_hold_notices(notified)
+    log_operation(current_user["id"], "归还图书", f"借阅记录 {record_id}，{result.message}")
+    return result
 
 
 
 
 @router.get("/records", response_model=List[dict])
 async def get_borrow_records(
+    response: Response,
     status: Optional[str] = Query(None, description="状态筛选: borrowed, returned"),
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
     keyword: Optional[str] = Query(None, description="搜索关键词：学号/姓名/ISBN"),
+    date_from: Optional[str] = Query(None, description="借阅日期起（YYYY-MM-DD，含）"),
+    date_to: Optional[str] = Query(None, description="借阅日期止（YYYY-MM-DD，含）"),
+    after: Optional[str] = Query(None, description="分页游标（上一页响应头 X-Next-Cursor），传入时忽略 page"),
     current_user: dict = Depends(get_current_user)
 ):
-    """获取借阅记录（管理员看全部，学生看自己的）"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        
-        query = '''
-            SELECT 
-                br.id,
-                br.book_id,
-                b.title as book_title,
-                b.author as book_author,
-                b.isbn as book_isbn,
-                br.user_id,
-                u.name as user_name,
-                u.student_id,
-                br.borrow_date,
-                br.due_date,
-                br.return_date,
-                br.status
-            FROM borrow_records br
-            JOIN books b ON br.book_id = b.id
-            JOIN users u ON br.user_id = u.id
-            WHERE 1=1
-        '''
-        params = []
-        
-        # 非管理员只能看自己的记录
-        if current_user["role"] != "admin":
-            query += " AND br.user_id = ?"
-            params.append(current_user["id"])
-        
-        if status:
-            query += " AND br.status = ?"
-            params.append(status)
-            
-        if keyword:
-            query += " AND (u.student_id LIKE ? OR u.name LIKE ? OR b.isbn LIKE ?)"
-            params.extend([f"%{keyword}%", f"%{keyword}%", f"%{keyword}%"])
-        
-        query += " ORDER BY br.borrow_date DESC LIMIT ? OFFSET ?"
-        params.extend([page_size, (page - 1) * page_size])
-        
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        
-        return [dict(row) for row in rows]
+    """
+    获取借阅记录（管理员看全部，学生看自己的）
+    下一页游标通过响应头 X-Next-Cursor 返回，保持列表响应格式不变
+    排序、游标和日期筛选都使用整数时间戳 borrow_ts，可直接走索引范围扫描
+    """
+    query = '''
+        SELECT 
+            br.id,
+            br.book_id,
+            b.title as book_title,
+            b.author as book_author,
+            b.isbn as book_isbn,
+            br.user_id,
+            u.name as user_name,
+            u.student_id,
+            br.borrow_date,
+            br.due_date,
+            br.return_date,
+            br.borrow_ts,
+            br.due_ts,
+            br.return_ts,
+            br.status
+        FROM borrow_records br
+        JOIN books b ON br.book_id = b.id
+        JOIN users u ON br.user_id = u.id
+        WHERE 1=1
+    '''
+    params = []
+    
+    # 非管理员只能看自己的记录
+    if current_user["role"] != "admin":
+        query += " AND br.user_id = ?"
+        params.append(current_user["id"])
+    
+    if status:
+        query += " AND br.status = ?"
+        params.append(status)
+        
+    if keyword:
+        query += " AND (u.student_id LIKE ? OR u.name LIKE ? OR b.isbn LIKE ?)"
+        params.extend([f"%{keyword}%", f"%{keyword}%", f"%{keyword}%"])
+    
+    if date_from:
+        query += " AND br.borrow_ts >= ?"
+        params.append(local_date_ts(date_from))
+    if date_to:
+        query += " AND br.borrow_ts < ?"
+        params.append(local_date_ts(date_to, next_day=True))
+    
+    # 游标分页：从上一页最后一条之后开始
+    if after:
+        clause, values = keyset_clause(["br.borrow_ts", "br.id"], after)
+        query += f" AND {clause}"
+        params.extend(values)
+        offset = 0
+    else:
+        offset = (page - 1) * page_size
+    
+    query += " ORDER BY br.borrow_ts DESC, br.id DESC LIMIT ? OFFSET ?"
+    params.extend([page_size + 1, offset])
+    
+    rows, next_cursor = split_page(await fetch_all(query, tuple(params)), page_size, ["borrow_ts", "id"])
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return rows
 
 @router.get("/my", response_model=List[dict])
 async def get_my_borrows(current_user: dict = Depends(get_current_user)):
     """获取我的借阅记录"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT 
-                br.id,
-                br.book_id,
-                b.title as book_title,
-                b.author as book_author,
-                b.category,
-                b.cover,
-                br.borrow_date,
-                br.due_date,
-                br.return_date,
-                br.status
-            FROM borrow_records br
-            JOIN books b ON br.book_id = b.id
-            WHERE br.user_id = ?
-            ORDER BY br.borrow_date DESC
-        ''', (current_user["id"],))
-        
-        rows = cursor.fetchall()
-        return [dict(row) for row in rows]
+    return await fetch_all('''
+        SELECT 
+            br.id,
+            br.book_id,
+            b.title as book_title,
+            b.author as book_author,
+            b.category,
+            b.cover,
+            br.borrow_date,
+            br.due_date,
+            br.return_date,
+            br.status
+        FROM borrow_records br
+        JOIN books b ON br.book_id = b.id
+        WHERE br.user_id = ?
+        ORDER BY br.borrow_ts DESC, br.id DESC
+    ''', (current_user["id"],))
 
 @router.get("/overdue")
 async def get_overdue_records(current_user: dict = Depends(require_admin_or_super)):
-    """获取逾期未还记录（仅管理员）"""
-    with get_db() as conn:
+    """获取逾期未还记录（仅管理员，先增量刷新逾期罚款表再读取）"""
+    def _query(conn):
+        refresh_overdue_fines(conn)
         cursor = conn.cursor()
         cursor.execute('''
             SELECT 
-                br.id,
-                br.book_id,
+                f.record_id as id,
+                f.book_id,
                 b.title as book_title,
                 u.name as user_name,
                 u.student_id,
                 br.borrow_date,
-                br.due_date,
-                julianday('now') - julianday(br.due_date) as overdue_days
-            FROM borrow_records br
-            JOIN books b ON br.book_id = b.id
-            JOIN users u ON br.user_id = u.id
-            WHERE br.status = 'borrowed' AND br.due_date < CURRENT_TIMESTAMP
-            ORDER BY br.due_date ASC
+                f.due_date,
+                f.overdue_days,
+                f.fine
+            FROM overdue_fines f
+            JOIN borrow_records br ON f.record_id = br.id
+            JOIN books b ON f.book_id = b.id
+            JOIN users u ON f.user_id = u.id
+            WHERE f.status = 'overdue'
+            ORDER BY f.due_ts ASC
         ''')
-        
-        rows = cursor.fetchall()
-        return [dict(row) for row in rows]
+        return [dict(row) for row in cursor.fetchall()]
+
+    return await run_write(_query)
@@ -0,0 +1,180 @@
+"""
+逾期与罚款 API 路由
+- 逾期状态和罚款物化到 overdue_fines 表，由定时任务增量刷新；管理端逾期列表和个人中心
+  读取前在同一事务中再增量刷新一次，结果不受定时任务间隔影响
+- 罚款 = 逾期整天数 × 系统设置 fine_per_day；归还时在同一事务中结清，之后不再变化
+- 逾期提醒按用户合并为一条消息，提醒间隔内不重复发送
+"""
+from fastapi import APIRouter, Depends
+
+from database import run_write, fetch_value
+from auth import get_current_user
+from notifications import publish_message
+from timeutil import NOW_TS
+
+router = APIRouter(prefix="/api/fines", tags=["fines"])
+
+# 时间比较统一使用整数时间戳（UTC 秒），与服务器时区无关
+FINE_RATE = "IFNULL((SELECT CAST(value AS REAL) FROM system_settings WHERE key = 'fine_per_day'), 0)"
+# 逾期整天数
+OVERDUE_DAYS = f"(({NOW_TS} - due_ts) / 86400)"
+# 逾期提醒间隔（秒）
+REMINDER_WINDOW = "(IFNULL((SELECT CAST(value AS INTEGER) FROM system_settings WHERE key = 'overdue_reminder_hours'), 24) * 3600)"
+
+
+def refresh_overdue_fines(conn, user_id: int = None) -> int:
+    """
+    增量刷新逾期罚款表，返回变化的行数（通过 run_write 调用，可重复执行）
+    1. 新到期的在借记录写入（走 idx_borrow_active_due_ts 范围扫描）
+    2. 逾期天数或费率变化的未还记录更新罚款，其余行不动
+    3. 兜底结清已归还但未在还书时结清的记录
+    传入 user_id 时只刷新该用户的记录（个人中心读取前调用）
+    """
+    cursor = conn.cursor()
+    changed = 0
+    if user_id is None:
+        user_filter, record_filter, user_params = "", "", ()
+    else:
+        user_filter, record_filter, user_params = " AND user_id = ?", " AND br.user_id = ?", (user_id,)
+
+    cursor.execute(f'''
+        INSERT INTO overdue_fines (record_id, user_id, book_id, due_date, due_ts, overdue_days, fine)
+        SELECT id, user_id, book_id, due_date, due_ts, {OVERDUE_DAYS}, {OVERDUE_DAYS} * {FINE_RATE}
+        FROM borrow_records
+        WHERE status = 'borrowed' AND due_ts < {NOW_TS}{user_filter}
+        ON CONFLICT(record_id) DO NOTHING
+    ''', user_params)
+    changed += cursor.rowcount
+
+    cursor.execute(f'''
+        UPDATE overdue_fines
+        SET overdue_days = {OVERDUE_DAYS},
+            fine = {OVERDUE_DAYS} * {FINE_RATE},
+            updated_at = CURRENT_TIMESTAMP
+        WHERE status = 'overdue'{user_filter}
+          AND (overdue_days != {OVERDUE_DAYS} OR fine != {OVERDUE_DAYS} * {FINE_RATE})
+    ''', user_params)
+    changed += cursor.rowcount
+
+    cursor.execute(f'''
+        UPDATE overdue_fines
+        SET status = 'returned', returned_at = br.return_date, updated_at = CURRENT_TIMESTAMP
+        FROM borrow_records br
+        WHERE overdue_fines.status = 'overdue' AND br.id = overdue_fines.record_id AND br.status != 'borrowed'{record_filter}
+    ''', user_params)
+    changed += cursor.rowcount
+
+    return changed
+
+
+def settle_overdue_fine(cursor, record_id: int):
+    """
+    还书时结清逾期罚款（在还书事务中调用）
+    定时任务还没来得及写入的逾期记录也在这里补上
+    """
+    cursor.execute(f'''
+        INSERT INTO overdue_fines (record_id, user_id, book_id, due_date, due_ts, overdue_days, fine, status, returned_at)
+        SELECT id, user_id, book_id, due_date, due_ts, {OVERDUE_DAYS}, {OVERDUE_DAYS} * {FINE_RATE},
+               'returned', CURRENT_TIMESTAMP
+        FROM borrow_records
+        WHERE id = ? AND due_ts < {NOW_TS}
+        ON CONFLICT(record_id) DO UPDATE SET
+            overdue_days = excluded.overdue_days,
+            fine = excluded.fine,
+            status = 'returned',
+            returned_at = excluded.returned_at,
+            updated_at = CURRENT_TIMESTAMP
+    ''', (record_id,))
+
+
+async def refresh_overdue_fines_job():
+    """定时任务：刷新逾期罚款表"""
+    await run_write(refresh_overdue_fines)
+
+
+def send_overdue_reminders(conn) -> list:
+    """
+    向逾期用户发送提醒，返回本次提醒的用户ID列表（通过 run_write 调用）
+    每个用户的全部逾期图书由一条 INSERT ... SELECT 合并成一条消息，
+    提醒间隔内已提醒过的用户跳过，重复执行不会重复提醒
+    """
+    refresh_overdue_fines(conn)
+
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        INSERT INTO messages (sender_name, receiver_id, title, content, created_ts)
+        SELECT 'system', user_id, '逾期提醒',
+               '您有以下图书已逾期，请尽快归还：' || char(10) || group_concat(line, char(10)),
+               {NOW_TS}
+        FROM (
+            SELECT f.user_id,
+                   '- 《' || b.title || '》已逾期 ' || f.overdue_days || ' 天，罚款 '
+                       || printf('%.2f', f.fine) || ' 元' AS line
+            FROM overdue_fines f
+            JOIN books b ON f.book_id = b.id
+            WHERE f.status = 'overdue'
+              AND NOT EXISTS (
+                  SELECT 1 FROM overdue_reminders r
+                  WHERE r.user_id = f.user_id AND r.reminded_ts > {NOW_TS} - {REMINDER_WINDOW}
+              )
+            ORDER BY f.user_id, f.due_ts
+        )
+        GROUP BY user_id
+        RETURNING id, receiver_id
+    ''')
+    sent = cursor.fetchall()
+
+    cursor.executemany(
+        "INSERT INTO overdue_reminders (user_id, message_id) VALUES (?, ?)",
+        [(row["receiver_id"], row["id"]) for row in sent]
+    )
+    return [row["receiver_id"] for row in sent]
+
+
+async def overdue_reminders_job():
+    """定时任务：自动发送逾期提醒（系统设置 overdue_reminder_auto 开启时）"""
+    if await fetch_value("SELECT value FROM system_settings WHERE key = 'overdue_reminder_auto'") != "1":
+        return
+    notified = await run_write(send_overdue_reminders)
+    if notified:
+        publish_message(notified, {"sender_name": "system", "title": "逾期提醒"})
+
+
+@router.get("/my")
+async def get_my_fines(current_user: dict = Depends(get_current_user)):
+    """个人罚款汇总（个人中心，读取前先刷新本人的逾期记录，不等定时任务）"""
+    user_id = current_user["id"]
+
+    def _query(conn):
+        refresh_overdue_fines(conn, user_id)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT
+                COUNT(*) FILTER (WHERE status = 'overdue') AS overdue_count,
+                IFNULL(SUM(fine) FILTER (WHERE status = 'overdue'), 0) AS accruing_fine,
+                IFNULL(SUM(fine) FILTER (WHERE status = 'returned'), 0) AS settled_fine,
+                IFNULL(SUM(fine), 0) AS total_fine
+            FROM overdue_fines
+            WHERE user_id = ?
+        ''', (user_id,))
+        summary = dict(cursor.fetchone())
+
+        cursor.execute('''
+            SELECT
+                f.record_id,
+                f.book_id,
+                b.title as book_title,
+                f.due_date,
+                f.overdue_days,
+                f.fine,
+                f.status,
+                f.returned_at
+            FROM overdue_fines f
+            JOIN books b ON f.book_id = b.id
+            WHERE f.user_id = ?
+            ORDER BY f.status = 'overdue' DESC, f.due_ts DESC
+        ''', (user_id,))
+        summary["items"] = [dict(row) for row in cursor.fetchall()]
+        return summary
+
+    return await run_write(_query)
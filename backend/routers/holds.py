@@ -0,0 +1,272 @@
+"""
+图书预约（排队）API 路由
+- 图书全部借出时可加入排队，不必反复刷新图书详情
+- 归还时在同一事务中把这本书保留给队首读者，并发送站内消息
+- 保留的图书需在 HOLD_PICKUP_HOURS 小时内借走，逾期由定时任务顺延给下一位
+- 事务内的辅助函数返回收到消息的用户ID，调用方在事务提交后调用 publish_hold_notices 推送给在线读者
+"""
+from fastapi import APIRouter, Depends, HTTPException
+from typing import List
+
+from database import run_write, fetch_all
+from cache import bump_catalog_version
+from models import MessageResponse
+from auth import get_current_user
+from notifications import publish_message
+from timeutil import NOW_TS
+
+router = APIRouter(prefix="/api/holds", tags=["holds"])
+
+# 到书后的保留时长（小时）
+HOLD_PICKUP_HOURS = 48
+
+HOLD_READY_TITLE = "预约到书通知"
+HOLD_EXPIRED_TITLE = "预约已过期"
+
+
+# ==================== 事务内辅助函数（需在 run_write 的事务中调用） ====================
+
+def allocate_holds(cursor, book_id: int) -> list:
+    """
+    把可借库存依次保留给排队中的读者并发送到书通知，返回收到通知的用户ID列表
+    在归还、增加馆藏、预约过期等可借数量增加的地方调用
+    """
+    notified = []
+    while True:
+        cursor.execute('''
+            SELECT h.id, h.user_id, b.title
+            FROM holds h
+            JOIN books b ON b.id = h.book_id
+            WHERE h.book_id = ? AND h.status = 'waiting'
+              AND b.status = 'active' AND b.available_count > 0
+            ORDER BY h.id
+            LIMIT 1
+        ''', (book_id,))
+        hold = cursor.fetchone()
+        if not hold:
+            return notified
+
+        cursor.execute(
+            "UPDATE books SET available_count = available_count - 1 WHERE id = ? AND available_count > 0",
+            (book_id,)
+        )
+        cursor.execute('''
+            UPDATE holds
+            SET status = 'ready', ready_at = CURRENT_TIMESTAMP, expires_at = datetime('now', ?)
+            WHERE id = ?
+        ''', (f"+{HOLD_PICKUP_HOURS} hours", hold["id"]))
+        cursor.execute(f'''
+            INSERT INTO messages (sender_name, receiver_id, title, content, created_ts)
+            VALUES ('system', ?, ?, ?, {NOW_TS})
+        ''', (
+            hold["user_id"],
+            HOLD_READY_TITLE,
+            f"您预约的《{hold['title']}》已为您保留，请在 {HOLD_PICKUP_HOURS} 小时内借阅，逾期将顺延给下一位读者。"
+        ))
+        notified.append(hold["user_id"])
+
+
+def release_reserved_copy(cursor, book_id: int) -> list:
+    """归还一本被预约保留的库存，并顺延给下一位排队读者，返回收到到书通知的用户ID列表"""
+    cursor.execute("UPDATE books SET available_count = available_count + 1 WHERE id = ?", (book_id,))
+    return allocate_holds(cursor, book_id)
+
+
+def claim_hold(cursor, book_id: int, user_id: int) -> bool:
+    """
+    借书时核销本人已到书的预约
+    返回 True 表示库存已在保留时扣除，借书时不再扣减
+    （有人排队时空闲库存会立即分配给队首，排队中的读者不会遇到可直接借阅的情况）
+    """
+    cursor.execute('''
+        UPDATE holds SET status = 'fulfilled'
+        WHERE book_id = ? AND user_id = ? AND status = 'ready'
+    ''', (book_id, user_id))
+    return cursor.rowcount > 0
+
+
+def cancel_user_holds(cursor, user_id: int) -> list:
+    """取消用户的全部有效预约（删除用户前调用），已保留的图书顺延给下一位，返回收到到书通知的用户ID列表"""
+    cursor.execute(
+        "SELECT id, book_id, status FROM holds WHERE user_id = ? AND status IN ('waiting', 'ready')",
+        (user_id,)
+    )
+    holds = cursor.fetchall()
+    cursor.execute(
+        "UPDATE holds SET status = 'cancelled' WHERE user_id = ? AND status IN ('waiting', 'ready')",
+        (user_id,)
+    )
+    notified = []
+    for hold in holds:
+        if hold["status"] == "ready":
+            notified += release_reserved_copy(cursor, hold["book_id"])
+    return notified
+
+
+def cancel_book_holds(cursor, book_id: int):
+    """图书下架时取消该书的全部有效预约，已保留的库存退回（图书已下架，不再分配）"""
+    cursor.execute("SELECT COUNT(*) FROM holds WHERE book_id = ? AND status = 'ready'", (book_id,))
+    reserved = cursor.fetchone()[0]
+    cursor.execute(
+        "UPDATE holds SET status = 'cancelled' WHERE book_id = ? AND status IN ('waiting', 'ready')",
+        (book_id,)
+    )
+    if reserved:
+        cursor.execute(
+            "UPDATE books SET available_count = available_count + ? WHERE id = ?",
+            (reserved, book_id)
+        )
+
+
+def expire_holds(conn) -> tuple:
+    """
+    将逾期未取的预约标记为过期，保留的图书顺延给下一位
+    返回 (收到过期通知的用户ID列表, 收到到书通知的用户ID列表)
+    由定时任务通过 run_write 调用，重复执行是安全的
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT h.id, h.book_id, h.user_id, b.title
+        FROM holds h
+        JOIN books b ON b.id = h.book_id
+        WHERE h.status = 'ready' AND h.expires_at < datetime('now')
+    ''')
+    expired = []
+    notified = []
+
+    for hold in cursor.fetchall():
+        cursor.execute(
+            "UPDATE holds SET status = 'expired' WHERE id = ? AND status = 'ready'",
+            (hold["id"],)
+        )
+        if not cursor.rowcount:
+            continue
+        cursor.execute(f'''
+            INSERT INTO messages (sender_name, receiver_id, title, content, created_ts)
+            VALUES ('system', ?, ?, ?, {NOW_TS})
+        ''', (
+            hold["user_id"],
+            HOLD_EXPIRED_TITLE,
+            f"您预约的《{hold['title']}》超过 {HOLD_PICKUP_HOURS} 小时未借阅，预约已失效。"
+        ))
+        expired.append(hold["user_id"])
+        notified += release_reserved_copy(cursor, hold["book_id"])
+
+    return expired, notified
+
+
+def publish_hold_notices(ready_user_ids: list, expired_user_ids: list = ()):
+    """事务提交后推送预约消息（到书、过期），在线读者的未读数随之更新"""
+    if ready_user_ids:
+        publish_message(ready_user_ids, {"sender_name": "system", "title": HOLD_READY_TITLE})
+    if expired_user_ids:
+        publish_message(expired_user_ids, {"sender_name": "system", "title": HOLD_EXPIRED_TITLE})
+
+
+async def expire_holds_job():
+    """定时任务：处理逾期未取的预约"""
+    expired, notified = await run_write(expire_holds)
+    if expired:
+        bump_catalog_version()
+        publish_hold_notices(notified, expired)
+
+
+# ==================== API ====================
+
+@router.post("/{book_id}")
+async def join_queue(book_id: int, current_user: dict = Depends(get_current_user)):
+    """加入图书预约队列（仅在图书全部借出时可预约）"""
+    user_id = current_user["id"]
+
+    def _join(conn):
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT title, available_count FROM books WHERE id = ? AND status = 'active'", (book_id,))
+        book = cursor.fetchone()
+        if not book:
+            raise HTTPException(status_code=404, detail="图书不存在")
+        if book["available_count"] > 0:
+            raise HTTPException(status_code=400, detail="该图书当前可借，请直接借阅")
+
+        cursor.execute(
+            "SELECT id FROM borrow_records WHERE book_id = ? AND user_id = ? AND status = 'borrowed'",
+            (book_id, user_id)
+        )
+        if cursor.fetchone():
+            raise HTTPException(status_code=400, detail="您已借阅该书")
+
+        cursor.execute(
+            "SELECT id FROM holds WHERE book_id = ? AND user_id = ? AND status IN ('waiting', 'ready')",
+            (book_id, user_id)
+        )
+        if cursor.fetchone():
+            raise HTTPException(status_code=400, detail="您已在该书的预约队列中")
+
+        cursor.execute("INSERT INTO holds (book_id, user_id) VALUES (?, ?)", (book_id, user_id))
+        hold_id = cursor.lastrowid
+        cursor.execute(
+            "SELECT COUNT(*) FROM holds WHERE book_id = ? AND status = 'waiting' AND id <= ?",
+            (book_id, hold_id)
+        )
+        position = cursor.fetchone()[0]
+
+        return {
+            "id": hold_id,
+            "position": position,
+            "message": f"已加入《{book['title']}》的预约队列，当前排第 {position} 位，到书后会通过消息通知您"
+        }
+
+    return await run_write(_join)
+
+
+@router.delete("/{hold_id}", response_model=MessageResponse)
+async def leave_queue(hold_id: int, current_user: dict = Depends(get_current_user)):
+    """取消预约（管理员可取消任意预约）"""
+    def _leave(conn):
+        cursor = conn.cursor()
+
+        cursor.execute(
+            "SELECT id, book_id, user_id, status FROM holds WHERE id = ? AND status IN ('waiting', 'ready')",
+            (hold_id,)
+        )
+        hold = cursor.fetchone()
+        if not hold:
+            raise HTTPException(status_code=404, detail="预约不存在或已结束")
+        if current_user["role"] not in ("admin", "super_admin") and hold["user_id"] != current_user["id"]:
+            raise HTTPException(status_code=403, detail="无权操作此预约")
+
+        cursor.execute("UPDATE holds SET status = 'cancelled' WHERE id = ?", (hold_id,))
+        if hold["status"] == "ready":
+            return True, release_reserved_copy(cursor, hold["book_id"])
+        return False, []
+
+    released, notified = await run_write(_leave)
+    if released:
+        bump_catalog_version()
+        publish_hold_notices(notified)
+    return MessageResponse(message="预约已取消")
+
+
+@router.get("/my", response_model=List[dict])
+async def get_my_holds(current_user: dict = Depends(get_current_user)):
+    """我的预约（排队中的显示当前位置）"""
+    return await fetch_all('''
+        SELECT
+            h.id,
+            h.book_id,
+            b.title as book_title,
+            b.author as book_author,
+            b.cover,
+            h.status,
+            h.created_at,
+            h.ready_at,
+            h.expires_at,
+            CASE WHEN h.status = 'waiting' THEN (
+                SELECT COUNT(*) FROM holds q
+                WHERE q.book_id = h.book_id AND q.status = 'waiting' AND q.id <= h.id
+            ) END as position
+        FROM holds h
+        JOIN books b ON h.book_id = b.id
+        WHERE h.user_id = ?
+        ORDER BY h.created_at DESC, h.id DESC
+    ''', (current_user["id"],))
@@ -1,63 +1,206 @@
 """
 消息/通知 API 路由
+- 点对点消息每个接收者一行（messages 表）
+- 群发通知只存一行（broadcasts 表），读取时与个人消息合并；
+  群发在列表中以负数 id 返回（-broadcasts.id），已读状态由已读游标 + 稀疏已读标记表示
+- 未读数和新消息通过 /stream（SSE）推送，客户端无需轮询
 """
-from fastapi import APIRouter, Depends, HTTPException, Query
+import asyncio
+import json
+import time
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
-from database import get_db
+from database import run_db, run_write, fetch_all
+from pagination import keyset_clause, split_page
+from timeutil import NOW_TS
 from models import NotificationCreate, NotificationResponse, MessageResponse
-from auth import get_current_user, require_admin_or_super
+from auth import get_current_user, require_admin_or_super, verify_token, load_principal, denylist
+from notifications import (
+    hub, format_event, publish_message, publish_broadcast, publish_unread,
+    HEARTBEAT_SECONDS, RECONNECT_MILLISECONDS
+)
 
 router = APIRouter(prefix="/api/messages", tags=["messages"])
 
+# 指定接收者发送时每批写入的行数
+SEND_CHUNK_SIZE = 500
+
+# 群发对当前用户是否已读（参数：read_upto, user_id）
+BROADCAST_IS_READ = """(b.id <= ? OR EXISTS (
+    SELECT 1 FROM broadcast_reads r WHERE r.user_id = ? AND r.broadcast_id = b.id
+))"""
+
+
+def _broadcast_scope(cursor, user_id: int) -> dict:
+    """
+    当前用户可见群发的范围：按角色投递，只包含注册之后发出的群发
+    返回 {audience, since, read_upto}
+    """
+    cursor.execute('''
+        SELECT u.role AS audience,
+               IFNULL(CAST(strftime('%s', u.created_at) AS INTEGER), 0) AS since,
+               IFNULL(c.read_upto, 0) AS read_upto
+        FROM users u
+        LEFT JOIN broadcast_cursors c ON c.user_id = u.id
+        WHERE u.id = ?
+    ''', (user_id,))
+    row = cursor.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="用户不存在")
+    return dict(row)
+
+
+def _unread_count(conn, user_id: int) -> int:
+    """未读数量：个人消息 + 未读群发"""
+    cursor = conn.cursor()
+    scope = _broadcast_scope(cursor, user_id)
+    cursor.execute(f"""
+        SELECT (SELECT COUNT(*) FROM messages WHERE receiver_id = ? AND is_read = 0)
+             + (SELECT COUNT(*) FROM broadcasts b
+                WHERE b.audience = ? AND b.created_ts >= ? AND NOT {BROADCAST_IS_READ})
+    """, (user_id, scope["audience"], scope["since"], scope["read_upto"], user_id))
+    return cursor.fetchone()[0]
+
 
 @router.get("")
 async def get_messages(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
+    after: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor），传入时忽略 page"),
+    include_total: bool = Query(True, description="是否统计总数"),
     current_user: dict = Depends(get_current_user)
 ):
-    """获取我的消息列表"""
-    with get_db() as conn:
+    """
+    获取我的消息列表（个人消息和群发合并，按整数时间戳 created_ts 排序和翻页）
+    两部分各自走索引取前 N 条后再合并，不需要扫描全部群发
+    """
+    user_id = current_user["id"]
+    direct_where = "receiver_id = ?"
+    direct_params = [user_id]
+    broadcast_where = "b.audience = ? AND b.created_ts >= ?"
+    broadcast_keyset = []
+    if after:
+        clause, values = keyset_clause(["created_ts", "id"], after)
+        direct_where += f" AND {clause}"
+        direct_params.extend(values)
+        clause, values = keyset_clause(["b.created_ts", "-b.id"], after)
+        broadcast_keyset_clause = f" AND {clause}"
+        broadcast_keyset = values
+        offset = 0
+    else:
+        broadcast_keyset_clause = ""
+        offset = (page - 1) * page_size
+    # 每部分最多需要 offset + page_size + 1 条（多取一条判断是否有下一页）
+    limit = offset + page_size + 1
+
+    def _query(conn):
         cursor = conn.cursor()
-        
-        # 获取总数
-        cursor.execute(
-            "SELECT COUNT(*) FROM messages WHERE receiver_id = ?",
-            (current_user["id"],)
-        )
-        total = cursor.fetchone()[0]
-        
-        # 获取消息
-        cursor.execute("""
-            SELECT id, sender_name, title, content, is_read, created_at
-            FROM messages
-            WHERE receiver_id = ?
-            ORDER BY created_at DESC
+        scope = _broadcast_scope(cursor, user_id)
+        broadcast_params = [scope["audience"], scope["since"]]
+
+        # 获取总数（可跳过）
+        total = None
+        if include_total:
+            cursor.execute(f"""
+                SELECT (SELECT COUNT(*) FROM messages WHERE receiver_id = ?)
+                     + (SELECT COUNT(*) FROM broadcasts b WHERE {broadcast_where})
+            """, [user_id, *broadcast_params])
+            total = cursor.fetchone()[0]
+
+        # 获取消息（群发的 id 取负数，排序键 (created_ts, id) 在两部分间仍然唯一）
+        cursor.execute(f"""
+            SELECT * FROM (
+                SELECT id, sender_name, title, content, is_read, created_at, created_ts
+                FROM messages
+                WHERE {direct_where}
+                ORDER BY created_ts DESC, id DESC
+                LIMIT ?
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT -b.id AS id, b.sender_name, b.title, b.content,
+                       {BROADCAST_IS_READ} AS is_read, b.created_at, b.created_ts
+                FROM broadcasts b
+                WHERE {broadcast_where}{broadcast_keyset_clause}
+                ORDER BY b.created_ts DESC, b.id ASC
+                LIMIT ?
+            )
+            ORDER BY created_ts DESC, id DESC
             LIMIT ? OFFSET ?
-        """, (current_user["id"], page_size, (page - 1) * page_size))
-        
-        rows = cursor.fetchall()
-        
+        """, [
+            *direct_params, limit,
+            scope["read_upto"], user_id, *broadcast_params, *broadcast_keyset, limit,
+            page_size + 1, offset
+        ])
+
+        rows, next_cursor = split_page([dict(row) for row in cursor.fetchall()], page_size, ["created_ts", "id"])
+
         return {
             "items": [{
-                **dict(row),
+                **row,
                 "is_read": bool(row["is_read"])
             } for row in rows],
-            "total": total
+            "total": total,
+            "next_cursor": next_cursor
         }
 
+    return await run_db(_query)
+
 
 @router.get("/unread-count")
 async def get_unread_count(current_user: dict = Depends(get_current_user)):
-    """获取未读消息数量"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT COUNT(*) FROM messages WHERE receiver_id = ? AND is_read = 0",
-            (current_user["id"],)
-        )
-        count = cursor.fetchone()[0]
-        return {"count": count}
+    """获取未读消息数量（个人消息 + 未读群发）"""
+    return {"count": await run_db(_unread_count, current_user["id"])}
+
+
+@router.get("/stream")
+async def message_stream(
+    token: str = Query(..., description="access token（EventSource 无法设置请求头，通过参数传递）")
+):
+    """
+    消息推送（Server-Sent Events）
+    - 连接建立（含断线重连）时先推送当前未读数作为全量同步，之后只推送变化：
+      unread（未读数变化）/ message（新消息摘要）
+    - 空闲时每 HEARTBEAT_SECONDS 秒发送一次心跳注释
+    - token 过期或被吊销时发送 expired 事件并关闭，客户端刷新 token 后重连
+    """
+    payload = verify_token(token)
+    user_id = payload.get("user_id")
+    if not user_id:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="无效的认证信息")
+    current_user = await load_principal(user_id)
+
+    async def _events():
+        subscriber = hub.subscribe(user_id, current_user["role"])
+        try:
+            yield f"retry: {RECONNECT_MILLISECONDS}\n\n"
+            yield format_event("unread", {"count": await run_db(_unread_count, user_id)})
+            while True:
+                remaining = payload.get("exp", 0) - time.time()
+                if remaining <= 0 or denylist.is_revoked(payload):
+                    yield format_event("expired", {})
+                    return
+                try:
+                    event, data = await asyncio.wait_for(
+                        subscriber.queue.get(), timeout=min(HEARTBEAT_SECONDS, remaining)
+                    )
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield format_event(event, data)
+                # 积压期间丢弃过事件：发完剩余事件后重新同步一次未读数
+                if subscriber.overflowed and subscriber.queue.empty():
+                    subscriber.overflowed = False
+                    yield format_event("unread", {"count": await run_db(_unread_count, user_id)})
+        finally:
+            hub.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @router.post("/{message_id}/read", response_model=MessageResponse)
@@ -65,39 +208,78 @@ async def mark_read(
     message_id: int,
     current_user: dict = Depends(get_current_user)
 ):
-    """标记消息为已读"""
-    with get_db() as conn:
+    """标记消息为已读（负数 id 为群发）"""
+    user_id = current_user["id"]
+
+    def _mark(conn):
         cursor = conn.cursor()
-        
-        # 检查消息是否属于当前用户
+
+        if message_id < 0:
+            broadcast_id = -message_id
+            scope = _broadcast_scope(cursor, user_id)
+            cursor.execute(
+                "SELECT id FROM broadcasts WHERE id = ? AND audience = ? AND created_ts >= ?",
+                (broadcast_id, scope["audience"], scope["since"])
+            )
+            if not cursor.fetchone():
+                raise HTTPException(status_code=404, detail="消息不存在")
+            # 已读游标之前的群发本来就是已读，不再写标记
+            if broadcast_id > scope["read_upto"]:
+                cursor.execute(
+                    "INSERT OR IGNORE INTO broadcast_reads (user_id, broadcast_id) VALUES (?, ?)",
+                    (user_id, broadcast_id)
+                )
+            return _unread_count(conn, user_id)
+
+        # 只能标记属于当前用户的消息
         cursor.execute(
-            "SELECT id FROM messages WHERE id = ? AND receiver_id = ?",
-            (message_id, current_user["id"])
+            "UPDATE messages SET is_read = 1 WHERE id = ? AND receiver_id = ?",
+            (message_id, user_id)
         )
-        if not cursor.fetchone():
+        if not cursor.rowcount:
             raise HTTPException(status_code=404, detail="消息不存在")
-        
-        cursor.execute(
-            "UPDATE messages SET is_read = 1 WHERE id = ?",
-            (message_id,)
-        )
-        conn.commit()
-        
-        return MessageResponse(message="已标记为已读")
+
+        return _unread_count(conn, user_id)
+
+    # 同一用户的其他页面/设备同步未读数
+    publish_unread(user_id, await run_write(_mark))
+    return MessageResponse(message="已标记为已读")
 
 
 @router.post("/read-all", response_model=MessageResponse)
 async def mark_all_read(current_user: dict = Depends(get_current_user)):
-    """标记所有消息为已读"""
-    with get_db() as conn:
+    """
+    标记所有消息为已读
+    群发只前移已读游标，并清理游标之前的单条已读标记
+    """
+    user_id = current_user["id"]
+
+    def _mark_all(conn):
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE messages SET is_read = 1 WHERE receiver_id = ? AND is_read = 0",
-            (current_user["id"],)
+            (user_id,)
         )
-        conn.commit()
-        
-        return MessageResponse(message="所有消息已标记为已读")
+
+        cursor.execute('''
+            SELECT MAX(b.id) FROM broadcasts b
+            JOIN users u ON b.audience = u.role
+            WHERE u.id = ?
+        ''', (user_id,))
+        read_upto = cursor.fetchone()[0]
+        if read_upto:
+            cursor.execute('''
+                INSERT INTO broadcast_cursors (user_id, read_upto) VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET read_upto = MAX(read_upto, excluded.read_upto)
+            ''', (user_id, read_upto))
+            cursor.execute(
+                "DELETE FROM broadcast_reads WHERE user_id = ? AND broadcast_id <= ?",
+                (user_id, read_upto)
+            )
+
+    await run_write(_mark_all)
+    publish_unread(user_id, 0)
+    return MessageResponse(message="所有消息已标记为已读")
 
 
 @router.post("/send", response_model=MessageResponse)
@@ -105,35 +287,56 @@ async def send_notification(
     notification: NotificationCreate,
     current_user: dict = Depends(require_admin_or_super)
 ):
-    """发送通知（管理员/超管）"""
-    with get_db() as conn:
+    """
+    发送通知（管理员/超管）
+    - 未指定接收者：写入一条群发，所有学生读取时可见
+    - 指定接收者：去重、检查接收者都存在后分批 executemany 写入
+    """
+    # 确定发送者名称
+    sender_name = "admin" if current_user["role"] == "admin" else "system"
+    receiver_ids = list(dict.fromkeys(notification.receiver_ids))
+
+    def _send(conn):
         cursor = conn.cursor()
-        
-        # 确定发送者名称
-        sender_name = "admin" if current_user["role"] == "admin" else "system"
-        
-        # 确定接收者
-        if not notification.receiver_ids:
-            # 群发给所有学生
-            cursor.execute("SELECT id FROM users WHERE role = 'student'")
-            receiver_ids = [row["id"] for row in cursor.fetchall()]
-        else:
-            receiver_ids = notification.receiver_ids
-        
+
         if not receiver_ids:
-            raise HTTPException(status_code=400, detail="没有可发送的接收者")
-        
-        # 发送消息
-        for receiver_id in receiver_ids:
+            # 群发给所有学生
+            cursor.execute("SELECT COUNT(*) FROM users WHERE role = 'student'")
+            count = cursor.fetchone()[0]
+            if not count:
+                raise HTTPException(status_code=400, detail="没有可发送的接收者")
             cursor.execute("""
-                INSERT INTO messages (sender_name, receiver_id, title, content)
-                VALUES (?, ?, ?, ?)
-            """, (sender_name, receiver_id, notification.title, notification.content))
-        
-        conn.commit()
-        
-        count = len(receiver_ids)
-        return MessageResponse(message=f"已向 {count} 位用户发送通知")
+                INSERT INTO broadcasts (sender_name, audience, title, content)
+                VALUES (?, 'student', ?, ?)
+            """, (sender_name, notification.title, notification.content))
+            return count
+
+        # 不存在的接收者会让外键约束中止整批写入，先一次查出来返回 400
+        cursor.execute(
+            "SELECT value FROM json_each(?) WHERE value NOT IN (SELECT id FROM users)",
+            (json.dumps(receiver_ids),)
+        )
+        unknown = [str(row[0]) for row in cursor.fetchall()]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"接收者不存在: {', '.join(unknown)}")
+
+        rows = [(sender_name, receiver_id, notification.title, notification.content) for receiver_id in receiver_ids]
+        for start in range(0, len(rows), SEND_CHUNK_SIZE):
+            cursor.executemany(f"""
+                INSERT INTO messages (sender_name, receiver_id, title, content, created_ts)
+                VALUES (?, ?, ?, ?, {NOW_TS})
+            """, rows[start:start + SEND_CHUNK_SIZE])
+
+        return len(receiver_ids)
+
+    count = await run_write(_send)
+
+    summary = {"sender_name": sender_name, "title": notification.title}
+    if receiver_ids:
+        publish_message(receiver_ids, summary)
+    else:
+        publish_broadcast("student", summary)
+    return MessageResponse(message=f"已向 {count} 位用户发送通知")
 
 
 @router.get("/users-for-send")
@@ -142,19 +345,13 @@ async def get_users_for_send(
     current_user: dict = Depends(require_admin_or_super)
 ):
     """获取可发送消息的用户列表（管理员/超管）"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        
-        query = "SELECT id, student_id, name FROM users WHERE role = 'student'"
-        params = []
-        
-        if keyword:
-            query += " AND (student_id LIKE ? OR name LIKE ?)"
-            params.extend([f"%{keyword}%", f"%{keyword}%"])
-        
-        query += " ORDER BY name LIMIT 100"
-        
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        
-        return [dict(row) for row in rows]
+    query = "SELECT id, student_id, name FROM users WHERE role = 'student'"
+    params = []
+
+    if keyword:
+        query += " AND (student_id LIKE ? OR name LIKE ?)"
+        params.extend([f"%{keyword}%", f"%{keyword}%"])
+
+    query += " ORDER BY name LIMIT 100"
+
+    return await fetch_all(query, tuple(params))
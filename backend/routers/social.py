@@ -3,7 +3,7 @@
 """
 from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import List, Optional
-from database import get_db
+from database import run_db, fetch_all, fetch_value
 from models import ReviewCreate, ReviewResponse, FavoriteResponse, MessageResponse
 from auth import get_current_user
 
@@ -18,7 +18,7 @@ async def create_review(
     current_user: dict = Depends(get_current_user)
 ):
     """发布/更新评论"""
-    with get_db() as conn:
+    def _save(conn):
         cursor = conn.cursor()
         
         # 检查图书是否存在
@@ -52,24 +52,20 @@ async def create_review(
             conn.commit()
             return MessageResponse(message="评论发布成功")
 
+    return await run_db(_save)
+
 @router.get("/books/{book_id}/reviews", response_model=List[ReviewResponse])
 async def get_reviews(book_id: int):
     """获取图书评论"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT 
-                r.id, r.book_id, r.user_id, u.name as user_name,
-                r.rating, r.content, r.created_at
-            FROM reviews r
-            JOIN users u ON r.user_id = u.id
-            WHERE r.book_id = ?
-            ORDER BY r.created_at DESC
-        ''', (book_id,))
-        
-        rows = cursor.fetchall()
-        return [dict(row) for row in rows]
+    return await fetch_all('''
+        SELECT 
+            r.id, r.book_id, r.user_id, u.name as user_name,
+            r.rating, r.content, r.created_at
+        FROM reviews r
+        JOIN users u ON r.user_id = u.id
+        WHERE r.book_id = ?
+        ORDER BY r.created_at DESC
+    ''', (book_id,))
 
 # ==================== 收藏功能 ====================
 
@@ -79,9 +75,14 @@ async def toggle_favorite(
     current_user: dict = Depends(get_current_user)
 ):
     """收藏/取消收藏"""
-    with get_db() as conn:
+    def _toggle(conn):
         cursor = conn.cursor()
         
+        # 检查图书是否存在
+        cursor.execute("SELECT id FROM books WHERE id = ?", (book_id,))
+        if not cursor.fetchone():
+            raise HTTPException(status_code=404, detail="图书不存在")
+        
         # Check existing
         cursor.execute(
             "SELECT id FROM favorites WHERE book_id = ? AND user_id = ?",
@@ -102,37 +103,31 @@ async def toggle_favorite(
         conn.commit()
         return MessageResponse(message=message)
 
+    return await run_db(_toggle)
+
 @router.get("/books/{book_id}/is-favorite", response_model=bool)
 async def check_is_favorite(
     book_id: int,
     current_user: dict = Depends(get_current_user)
 ):
     """检查是否已收藏"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT id FROM favorites WHERE book_id = ? AND user_id = ?",
-            (book_id, current_user["id"])
-        )
-        return bool(cursor.fetchone())
+    favorite_id = await fetch_value(
+        "SELECT id FROM favorites WHERE book_id = ? AND user_id = ?",
+        (book_id, current_user["id"])
+    )
+    return bool(favorite_id)
 
 @router.get("/users/favorites", response_model=List[FavoriteResponse])
 async def get_my_favorites(current_user: dict = Depends(get_current_user)):
     """获取我的收藏列表"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT 
-                f.id, f.book_id, f.created_at,
-                b.title as book_title,
-                b.author as book_author,
-                b.cover as book_cover
-            FROM favorites f
-            JOIN books b ON f.book_id = b.id
-            WHERE f.user_id = ?
-            ORDER BY f.created_at DESC
-        ''', (current_user["id"],))
-        
-        rows = cursor.fetchall()
-        return [dict(row) for row in rows]
+    return await fetch_all('''
+        SELECT 
+            f.id, f.book_id, f.created_at,
+            b.title as book_title,
+            b.author as book_author,
+            b.cover as book_cover
+        FROM favorites f
+        JOIN books b ON f.book_id = b.id
+        WHERE f.user_id = ?
+        ORDER BY f.created_at DESC
+    ''', (current_user["id"],))
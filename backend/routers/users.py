@@ -3,9 +3,14 @@
 """
 from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import List, Optional
-from database import get_db, get_password_hash
+from database import run_db, run_write
+from passwords import hash_password_async
+from pagination import keyset_clause, split_page
 from models import UserCreate, UserInfo, MessageResponse
-from auth import require_admin_or_super
+from auth import require_admin_or_super, invalidate_user
+from cache import bump_catalog_version
+from routers.holds import cancel_user_holds, publish_hold_notices
+from audit import log_operation
 
 router = APIRouter(prefix="/api/users", tags=["users"])
 
@@ -14,10 +19,12 @@ async def get_users(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
     keyword: Optional[str] = None,
+    after: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor），传入时忽略 page"),
+    include_total: bool = Query(True, description="是否统计总数"),
     current_user: dict = Depends(require_admin_or_super)
 ):
     """获取用户列表（仅管理员）"""
-    with get_db() as conn:
+    def _query(conn):
         cursor = conn.cursor()
         
         # 构建查询条件
@@ -28,30 +35,47 @@ async def get_users(
             base_query += " AND (student_id LIKE ? OR name LIKE ?)"
             params.extend([f"%{keyword}%", f"%{keyword}%"])
             
-        # 获取总数
-        count_query = f"SELECT COUNT(*) {base_query}"
-        cursor.execute(count_query, params)
-        total = cursor.fetchone()[0]
+        # 获取总数（可跳过）
+        total = None
+        if include_total:
+            count_query = f"SELECT COUNT(*) {base_query}"
+            cursor.execute(count_query, params)
+            total = cursor.fetchone()[0]
         
-        # 获取分页数据
-        query = f"SELECT id, student_id, name, role, created_at {base_query} ORDER BY created_at DESC LIMIT ? OFFSET ?"
-        params.extend([page_size, (page - 1) * page_size])
+        # 游标分页：从上一页最后一条之后开始
+        page_query = base_query
+        if after:
+            clause, values = keyset_clause(["created_at", "id"], after)
+            page_query += f" AND {clause}"
+            params.extend(values)
+            offset = 0
+        else:
+            offset = (page - 1) * page_size
+        
+        # 获取分页数据（多取一条判断是否有下一页）
+        query = f"SELECT id, student_id, name, role, created_at {page_query} ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?"
+        params.extend([page_size + 1, offset])
         
         cursor.execute(query, params)
-        rows = cursor.fetchall()
+        rows, next_cursor = split_page([dict(row) for row in cursor.fetchall()], page_size, ["created_at", "id"])
         
         return {
-            "items": [dict(row) for row in rows],
-            "total": total
+            "items": rows,
+            "total": total,
+            "next_cursor": next_cursor
         }
 
+    return await run_db(_query)
+
 @router.post("", response_model=MessageResponse)
 async def create_user(
     user: UserCreate,
     current_user: dict = Depends(require_admin_or_super)
 ):
     """创建新用户（仅管理员）"""
-    with get_db() as conn:
+    password_hash = await hash_password_async(user.password or "12345678")
+
+    def _create(conn):
         cursor = conn.cursor()
         
         # 检查学号是否已存在
@@ -60,8 +84,6 @@ async def create_user(
             raise HTTPException(status_code=400, detail="该学号已存在")
             
         # 创建用户
-        password_hash = get_password_hash(user.password or "12345678")
-        
         cursor.execute('''
             INSERT INTO users (student_id, password_hash, name, role, first_login)
             VALUES (?, ?, ?, 'student', 1)
@@ -70,17 +92,21 @@ async def create_user(
         conn.commit()
         return MessageResponse(message=f"学生 {user.name} ({user.student_id}) 添加成功")
 
+    result = await run_db(_create)
+    log_operation(current_user["id"], "添加学生", f"{user.name} ({user.student_id})")
+    return result
+
 @router.delete("/{user_id}", response_model=MessageResponse)
 async def delete_user(
     user_id: int,
     current_user: dict = Depends(require_admin_or_super)
 ):
     """删除用户（仅管理员）"""
-    with get_db() as conn:
+    def _delete(conn):
         cursor = conn.cursor()
         
         # 检查用户是否存在
-        cursor.execute("SELECT id, role FROM users WHERE id = ?", (user_id,))
+        cursor.execute("SELECT id, student_id, name, role FROM users WHERE id = ?", (user_id,))
         target_user = cursor.fetchone()
         
         if not target_user:
@@ -99,8 +125,24 @@ async def delete_user(
         # 先删除借阅记录
         cursor.execute("DELETE FROM borrow_records WHERE user_id = ?", (user_id,))
         
+        # 取消预约，为其保留的图书顺延给下一位
+        notified = cancel_user_holds(cursor, user_id)
+        
+        # 外键约束已开启，同时清理评论、收藏、消息，并保留操作日志（去掉用户关联）
+        cursor.execute("DELETE FROM reviews WHERE user_id = ?", (user_id,))
+        cursor.execute("DELETE FROM favorites WHERE user_id = ?", (user_id,))
+        cursor.execute("DELETE FROM messages WHERE receiver_id = ?", (user_id,))
+        cursor.execute("UPDATE operation_logs SET user_id = NULL WHERE user_id = ?", (user_id,))
+        
         # 删除用户
         cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
         
-        conn.commit()
-        return MessageResponse(message="用户已删除")
+        # 删除操作与数据一起提交，不经过缓冲
+        log_operation(current_user["id"], "删除用户", f"{target_user['name']} ({target_user['student_id']})", conn=conn)
+        return MessageResponse(message="用户已删除"), notified
+
+    result, notified = await run_write(_delete)
+    invalidate_user(user_id)
+    bump_catalog_version()
+    publish_hold_notices(notified)
+    return result
@@ -0,0 +1,5 @@
+"""
+后端测试
+在 backend 目录下运行: python -m unittest discover -s tests -t .
+每个测试使用独立的临时数据库，不会读写 library.db
+"""
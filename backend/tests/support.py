@@ -0,0 +1,106 @@
+"""
+测试辅助函数
+- 连接池指向临时数据库并执行全部迁移
+- 直接写库创建用户、图书，用 create_access_token 签发 token（不走 scrypt 登录）
+- 通过 httpx 的 ASGITransport 在同一个事件循环中并发调用接口
+"""
+import math
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+import auth
+import cache
+from database import pool, get_db
+from migrations import run_migrations
+
+
+def use_temp_database(test_case, migrate: bool = True) -> Path:
+    """让连接池使用临时数据库（测试结束时自动清理），返回数据库路径；migrate=False 时为空库"""
+    temp_dir = tempfile.TemporaryDirectory()
+    original_path = pool.db_path
+
+    pool.close_all()
+    pool.db_path = Path(temp_dir.name) / "library.db"
+    _clear_caches()
+    if migrate:
+        run_migrations()
+
+    def _restore():
+        pool.close_all()
+        pool.db_path = original_path
+        _clear_caches()
+        temp_dir.cleanup()
+
+    test_case.addCleanup(_restore)
+    return pool.db_path
+
+
+def _clear_caches():
+    """不同测试的用户ID、图书ID会重复，进程内缓存需要清空"""
+    auth._token_cache.clear()
+    auth._principal_cache.clear()
+    cache.bump_catalog_version()
+
+
+def create_users(count: int, role: str = "student", prefix: str = "u") -> list:
+    """批量创建用户，返回 [{id, student_id, role, token}]（密码哈希为无法登录的占位值）"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT INTO users (student_id, password_hash, name, role, first_login) VALUES (?, '!', ?, ?, 0)",
+            [(f"{prefix}{i:06d}", f"测试用户{i}", role) for i in range(count)]
+        )
+        cursor.execute(
+            "SELECT id, student_id, role FROM users WHERE student_id LIKE ? ORDER BY id",
+            (f"{prefix}%",)
+        )
+        users = [dict(row) for row in cursor.fetchall()]
+        conn.commit()
+
+    for user in users:
+        user["token"] = auth.create_access_token({"user_id": user["id"], "role": user["role"]})
+    return users
+
+
+def create_books(count: int, total_count: int = 1, prefix: str = "978") -> list:
+    """批量创建图书，返回图书ID列表"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            """INSERT INTO books (title, author, isbn, category, total_count, available_count, location)
+               VALUES (?, ?, ?, '测试', ?, ?, 'A-01')""",
+            [
+                (f"测试图书 {i} 数据库系统概论", f"作者{i % 100}", f"{prefix}{i:010d}", total_count, total_count)
+                for i in range(count)
+            ]
+        )
+        cursor.execute("SELECT id FROM books WHERE isbn LIKE ? ORDER BY id", (f"{prefix}%",))
+        book_ids = [row["id"] for row in cursor.fetchall()]
+        conn.commit()
+    return book_ids
+
+
+def auth_headers(user: dict) -> dict:
+    return {"Authorization": f"Bearer {user['token']}"}
+
+
+def api_client() -> httpx.AsyncClient:
+    """直接调用应用的客户端（不经过网络）"""
+    from main import app
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test", timeout=None)
+
+
+async def timed(request) -> tuple:
+    """执行一个请求协程，返回 (响应, 耗时秒数)"""
+    start = time.perf_counter()
+    response = await request
+    return response, time.perf_counter() - start
+
+
+def percentile(values: list, fraction: float) -> float:
+    """最近秩百分位数"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
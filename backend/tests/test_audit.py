@@ -0,0 +1,100 @@
+"""
+操作日志缓冲写入
+- 缓冲的日志在刷新前不落库，刷新后按调用顺序批量写入；写入前用户已删除时不再关联用户
+- 攒够 AUDIT_BATCH_SIZE 条时提前刷新，停止时写入剩余日志
+- 写入失败时日志放回队列，缓冲超过上限时丢弃最旧的日志
+- 同步写入随调用方事务提交或回滚
+"""
+import asyncio
+import unittest
+from unittest import mock
+
+import audit
+from audit import AuditLogWriter, log_operation
+from database import get_db
+from tests.support import use_temp_database, create_users
+
+
+def _logged() -> list:
+    with get_db() as conn:
+        return [
+            (row["user_id"], row["action"], row["detail"])
+            for row in conn.execute("SELECT user_id, action, detail FROM operation_logs ORDER BY id")
+        ]
+
+
+class AuditWriterTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.admin, self.removed = create_users(2, role="admin", prefix="staff")
+        self.writer = AuditLogWriter()
+
+    async def test_flush_writes_buffered_logs_in_order(self):
+        self.writer.log(self.admin["id"], "操作A", "1")
+        self.writer.log(self.removed["id"], "操作B", "2")
+        self.writer.log(self.admin["id"], "操作C")
+        self.assertEqual(_logged(), [])
+        self.assertEqual(self.writer.stats()["pending"], 3)
+
+        with get_db() as conn:
+            conn.execute("DELETE FROM users WHERE id = ?", (self.removed["id"],))
+            conn.commit()
+
+        await self.writer.flush()
+        self.assertEqual(_logged(), [
+            (self.admin["id"], "操作A", "1"),
+            (None, "操作B", "2"),
+            (self.admin["id"], "操作C", None),
+        ])
+        self.assertEqual(self.writer.stats(), {"pending": 0, "written": 3, "dropped": 0, "failures": 0})
+
+    async def test_full_batch_flushes_early_and_stop_drains(self):
+        with mock.patch.object(audit, "AUDIT_FLUSH_INTERVAL", 60), mock.patch.object(audit, "AUDIT_BATCH_SIZE", 10):
+            self.writer.start()
+            self.addAsyncCleanup(self.writer.stop)
+
+            for i in range(10):
+                self.writer.log(self.admin["id"], "批量", str(i))
+            for _ in range(100):
+                if self.writer.stats()["written"]:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(len(_logged()), 10)
+
+            self.writer.log(self.admin["id"], "剩余")
+            await self.writer.stop()
+        self.assertEqual(_logged()[-1], (self.admin["id"], "剩余", None))
+        self.assertEqual(self.writer.stats()["pending"], 0)
+
+    async def test_failed_flush_keeps_logs(self):
+        self.writer.log(self.admin["id"], "操作A")
+        with mock.patch.object(audit, "run_write", side_effect=RuntimeError("database is locked")):
+            with self.assertRaises(RuntimeError):
+                await self.writer.flush()
+        self.writer.log(self.admin["id"], "操作B")
+        self.assertEqual(self.writer.stats()["failures"], 1)
+        self.assertEqual(self.writer.stats()["pending"], 2)
+
+        await self.writer.flush()
+        self.assertEqual([action for _, action, _ in _logged()], ["操作A", "操作B"])
+
+    async def test_overflow_drops_oldest(self):
+        with mock.patch.object(audit, "AUDIT_MAX_PENDING", 5):
+            for i in range(8):
+                self.writer.log(self.admin["id"], "操作", str(i))
+        self.assertEqual(self.writer.stats()["dropped"], 3)
+        await self.writer.flush()
+        self.assertEqual([detail for _, _, detail in _logged()], ["3", "4", "5", "6", "7"])
+
+    def test_synchronous_log_follows_transaction(self):
+        with get_db() as conn:
+            log_operation(self.admin["id"], "回滚", conn=conn)
+            conn.rollback()
+            log_operation(self.admin["id"], "提交", conn=conn)
+            conn.commit()
+        self.assertEqual(_logged(), [(self.admin["id"], "提交", None)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+修改密码
+修改成功后该用户此前的 access token 和刷新令牌（包括其他设备上的）全部失效，
+当前会话使用接口返回的新 token 继续访问；原密码错误时不影响已有登录状态
+"""
+import asyncio
+import unittest
+
+from database import get_db
+from passwords import hash_password
+from tests.support import use_temp_database, create_users, api_client
+
+PASSWORD = "old-password"
+
+
+class ChangePasswordTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.user = create_users(1)[0]
+        with get_db() as conn:
+            conn.execute("UPDATE users SET password_hash = ? WHERE id = ?", (hash_password(PASSWORD), self.user["id"]))
+            conn.commit()
+
+    async def _login(self, client) -> dict:
+        response = await client.post(
+            "/api/auth/login", json={"student_id": self.user["student_id"], "password": PASSWORD}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    async def _change(self, client, token: str, old_password: str):
+        return await client.post(
+            "/api/auth/change-password-with-token",
+            params={"token": token},
+            json={"old_password": old_password, "new_password": "new-password"}
+        )
+
+    async def _status(self, client, token: str) -> int:
+        response = await client.get("/api/messages/unread-count", headers={"Authorization": f"Bearer {token}"})
+        return response.status_code
+
+    async def test_change_revokes_other_sessions(self):
+        async with api_client() as client:
+            current = await self._login(client)
+            other_device = await self._login(client)
+            # 吊销按秒比较签发时间
+            await asyncio.sleep(1.1)
+
+            response = await self._change(client, current["token"], PASSWORD)
+            self.assertEqual(response.status_code, 200)
+            renewed = response.json()
+
+            self.assertEqual(await self._status(client, current["token"]), 401)
+            self.assertEqual(await self._status(client, other_device["token"]), 401)
+            for session in (current, other_device):
+                response = await client.post("/api/auth/refresh", json={"refresh_token": session["refresh_token"]})
+                self.assertEqual(response.status_code, 401)
+
+            self.assertEqual(await self._status(client, renewed["token"]), 200)
+            response = await client.post("/api/auth/refresh", json={"refresh_token": renewed["refresh_token"]})
+            self.assertEqual(response.status_code, 200)
+
+            response = await client.post(
+                "/api/auth/login", json={"student_id": self.user["student_id"], "password": "new-password"}
+            )
+            self.assertEqual(response.status_code, 200)
+
+    async def test_wrong_old_password_keeps_sessions(self):
+        async with api_client() as client:
+            session = await self._login(client)
+            await asyncio.sleep(1.1)
+
+            response = await self._change(client, session["token"], "wrong-password")
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(await self._status(client, session["token"]), 200)
+            response = await client.post("/api/auth/refresh", json={"refresh_token": session["refresh_token"]})
+            self.assertEqual(response.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
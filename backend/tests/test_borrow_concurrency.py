@@ -0,0 +1,79 @@
+"""
+并发借阅同一本书
+几百个读者同时借阅只有 N 本库存的图书：恰好 N 个成功，可借数量归零且不会为负，
+未归还的借阅记录恰好 N 条
+"""
+import asyncio
+import unittest
+
+from database import get_db
+from tests.support import use_temp_database, create_users, create_books, auth_headers, api_client
+
+COPIES = 50
+READERS = 401
+
+
+class BorrowConcurrencyTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.book_id = create_books(1, total_count=COPIES)[0]
+        self.readers = create_users(READERS)
+
+    async def test_concurrent_borrows_never_oversell(self):
+        async with api_client() as client:
+            responses = await asyncio.gather(*(
+                client.post(f"/api/borrow/{self.book_id}", json={"days": 30}, headers=auth_headers(reader))
+                for reader in self.readers
+            ))
+
+        statuses = [response.status_code for response in responses]
+        self.assertEqual(statuses.count(200), COPIES)
+        # 其余请求都是"已全部借出"，不应出现写锁冲突导致的 503 或 500
+        self.assertEqual(statuses.count(400), READERS - COPIES)
+
+        with get_db() as conn:
+            book = conn.execute(
+                "SELECT total_count, available_count FROM books WHERE id = ?", (self.book_id,)
+            ).fetchone()
+            open_records = conn.execute(
+                "SELECT COUNT(*) FROM borrow_records WHERE book_id = ? AND status = 'borrowed'", (self.book_id,)
+            ).fetchone()[0]
+
+        self.assertEqual(book["available_count"], 0)
+        self.assertEqual(open_records, COPIES)
+
+    async def test_concurrent_returns_restore_stock_once(self):
+        async with api_client() as client:
+            borrowed = await asyncio.gather(*(
+                client.post(f"/api/borrow/{self.book_id}", json={"days": 30}, headers=auth_headers(reader))
+                for reader in self.readers[:COPIES]
+            ))
+            self.assertTrue(all(response.status_code == 200 for response in borrowed))
+
+            with get_db() as conn:
+                records = conn.execute(
+                    "SELECT id, user_id FROM borrow_records WHERE book_id = ? AND status = 'borrowed'",
+                    (self.book_id,)
+                ).fetchall()
+            tokens = {reader["id"]: reader for reader in self.readers}
+
+            # 每条记录同时归还两次，只有一次成功
+            returned = await asyncio.gather(*(
+                client.post(f"/api/borrow/return/{record['id']}", headers=auth_headers(tokens[record["user_id"]]))
+                for record in records for _ in range(2)
+            ))
+
+        statuses = [response.status_code for response in returned]
+        self.assertEqual(statuses.count(200), COPIES)
+        self.assertEqual(statuses.count(404), COPIES)
+
+        with get_db() as conn:
+            available = conn.execute(
+                "SELECT available_count FROM books WHERE id = ?", (self.book_id,)
+            ).fetchone()[0]
+        self.assertEqual(available, COPIES)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+物化统计数据
+图书和借阅记录经过新增、改分类/作者、下架、恢复、删除、借出、归还之后，
+触发器维护的 catalog_stats 应与全量重算结果一致
+"""
+import unittest
+
+from database import get_db
+from migrations import compute_catalog_stats, read_catalog_stats
+from tests.support import use_temp_database, create_users, create_books, auth_headers, api_client
+
+
+class CatalogStatsTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.book_ids = create_books(20)
+        self.users = create_users(3)
+
+    def _assert_consistent(self, conn) -> dict:
+        cursor = conn.cursor()
+        expected = compute_catalog_stats(cursor)
+        self.assertEqual(read_catalog_stats(cursor), expected)
+        return expected
+
+    async def test_triggers_track_every_change(self):
+        with get_db() as conn:
+            stats = self._assert_consistent(conn)
+            self.assertEqual(stats["total_books"], 20)
+            self.assertEqual(stats["total_authors"], 20)
+            self.assertEqual(stats["total_categories"], 1)
+
+            # 新分类、新作者
+            conn.execute(
+                """INSERT INTO books (title, author, isbn, category, total_count, available_count)
+                   VALUES ('新书', '新作者', '9790000000001', '新分类', 1, 1)"""
+            )
+            conn.commit()
+            stats = self._assert_consistent(conn)
+            self.assertEqual(stats["total_categories"], 2)
+
+            # 改分类：旧分类仍有其他图书，新分类首次出现
+            conn.execute("UPDATE books SET category = '历史', author = '作者1' WHERE id = ?", (self.book_ids[0],))
+            conn.commit()
+            stats = self._assert_consistent(conn)
+            self.assertEqual(stats["total_categories"], 3)
+            self.assertEqual(stats["total_authors"], 20)
+
+            # 下架唯一一本「新分类」图书，分类数和作者数随之减少，恢复后再加回
+            conn.execute("UPDATE books SET status = 'deleted' WHERE isbn = '9790000000001'")
+            conn.commit()
+            stats = self._assert_consistent(conn)
+            self.assertEqual(stats["total_categories"], 2)
+            conn.execute("UPDATE books SET status = 'active' WHERE isbn = '9790000000001'")
+            conn.commit()
+            self._assert_consistent(conn)
+
+            # 物理删除
+            conn.execute("DELETE FROM books WHERE id = ?", (self.book_ids[1],))
+            conn.commit()
+            self.assertEqual(self._assert_consistent(conn)["total_books"], 20)
+
+            # 借出、归还、删除借阅记录
+            conn.executemany(
+                "INSERT INTO borrow_records (book_id, user_id, status) VALUES (?, ?, 'borrowed')",
+                [(self.book_ids[2 + i], user["id"]) for i, user in enumerate(self.users)]
+            )
+            conn.commit()
+            self.assertEqual(self._assert_consistent(conn)["borrowed_count"], 3)
+            conn.execute(
+                "UPDATE borrow_records SET status = 'returned', return_date = CURRENT_TIMESTAMP WHERE user_id = ?",
+                (self.users[0]["id"],)
+            )
+            conn.execute("DELETE FROM borrow_records WHERE user_id = ?", (self.users[1]["id"],))
+            conn.commit()
+            expected = self._assert_consistent(conn)
+            self.assertEqual(expected["borrowed_count"], 1)
+
+        async with api_client() as client:
+            response = await client.get("/api/books/stats", headers=auth_headers(self.users[0]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {key: response.json()[key] for key in expected},
+            expected
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
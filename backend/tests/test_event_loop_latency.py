@@ -0,0 +1,79 @@
+"""
+事件循环不被数据库操作阻塞
+大批量导出和全文检索进行期间，图书详情接口的 p99 延迟仍应保持在较低水平
+（数据库操作都在线程池中执行；如果有同步查询回到事件循环中执行，这里的延迟会接近导出的总耗时）
+"""
+import asyncio
+import unittest
+
+from tests.support import use_temp_database, create_users, create_books, auth_headers, api_client, timed, percentile
+
+EXPORT_BOOKS = 10000        # 导出的图书数量
+DETAIL_CONCURRENCY = 8      # 每轮并发的详情请求数
+MIN_SAMPLES = 200           # 导出期间至少采集的详情请求数
+P99_BOUND_SECONDS = 0.5     # 详情接口 p99 延迟上限（阻塞事件循环时会达到秒级）
+
+
+class EventLoopLatencyTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.book_ids = create_books(EXPORT_BOOKS)
+        self.admin = create_users(1, role="admin", prefix="admin")[0]
+        self.reader = create_users(1, prefix="reader")[0]
+
+    async def test_book_detail_p99_during_export_and_search(self):
+        async with api_client() as client:
+            export = asyncio.create_task(
+                client.get("/api/batch/export/books", headers=auth_headers(self.admin))
+            )
+
+            async def _search_until_export_done():
+                searches = 0
+                while not export.done():
+                    response = await client.get(
+                        "/api/books", params={"search": "数据库系统概论", "page": searches % 50 + 1},
+                        headers=auth_headers(self.reader)
+                    )
+                    self.assertEqual(response.status_code, 200)
+                    searches += 1
+                    # 命中目录缓存的请求不会让出事件循环，这里主动让出，避免测试本身阻塞事件循环
+                    await asyncio.sleep(0)
+                return searches
+
+            search = asyncio.create_task(_search_until_export_done())
+
+            latencies = []
+            next_book = 0
+            # 只统计导出进行期间发出的请求
+            while not export.done():
+                wave = []
+                for _ in range(DETAIL_CONCURRENCY):
+                    # 每次请求不同的图书，避免全部命中目录缓存
+                    book_id = self.book_ids[next_book % len(self.book_ids)]
+                    next_book += 1
+                    wave.append(timed(client.get(f"/api/books/{book_id}", headers=auth_headers(self.reader))))
+                for response, elapsed in await asyncio.gather(*wave):
+                    self.assertEqual(response.status_code, 200)
+                    latencies.append(elapsed)
+
+            exported = await export
+            searches = await search
+
+        self.assertEqual(exported.status_code, 200)
+        self.assertGreater(len(exported.content), 0)
+        self.assertGreater(searches, 0)
+        self.assertGreaterEqual(
+            len(latencies), MIN_SAMPLES,
+            f"导出过快，只采集到 {len(latencies)} 个样本，请增大 EXPORT_BOOKS"
+        )
+
+        p99 = percentile(latencies, 0.99)
+        self.assertLess(
+            p99, P99_BOUND_SECONDS,
+            f"导出期间图书详情 p99 = {p99 * 1000:.1f}ms（{len(latencies)} 个样本）"
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+流式导出
+- 跨越多个分批时 csv / ndjson / xlsx 都导出全部行，不重复不遗漏
+- csv 带 BOM，含逗号、引号的字段可以原样读回
+- 借阅记录按借阅日期筛选，不支持的格式返回 400
+"""
+import csv
+import io
+import json
+import unittest
+from unittest import mock
+
+from openpyxl import load_workbook
+
+from database import get_db
+from routers import batch
+from tests.support import use_temp_database, create_users, create_books, auth_headers, api_client
+
+BOOK_COUNT = 30
+CHUNK_SIZE = 7          # 让导出跨越多个分批
+TRICKY_TITLE = '逗号,与"引号"\n换行'
+
+
+class ExportTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        patcher = mock.patch.object(batch, "EXPORT_CHUNK_SIZE", CHUNK_SIZE)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.book_ids = create_books(BOOK_COUNT)
+        self.admin = create_users(1, role="admin", prefix="staff")[0]
+        self.reader = create_users(1)[0]
+        with get_db() as conn:
+            conn.execute("UPDATE books SET title = ? WHERE id = ?", (TRICKY_TITLE, self.book_ids[3]))
+            conn.executemany(
+                "INSERT INTO borrow_records (book_id, user_id, borrow_date, due_date, status) VALUES (?, ?, ?, ?, 'returned')",
+                [
+                    (self.book_ids[0], self.reader["id"], "2024-01-10 04:00:00", "2024-02-10 04:00:00"),
+                    (self.book_ids[1], self.reader["id"], "2024-02-10 04:00:00", "2024-03-10 04:00:00"),
+                    (self.book_ids[2], self.reader["id"], "2024-03-10 04:00:00", "2024-04-10 04:00:00"),
+                ]
+            )
+            conn.commit()
+
+    async def _export(self, client, path: str, **params):
+        return await client.get(f"/api/batch/export/{path}", params=params, headers=auth_headers(self.admin))
+
+    async def test_csv(self):
+        async with api_client() as client:
+            response = await self._export(client, "books", format="csv")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/csv"))
+        self.assertTrue(response.content.startswith(b"\xef\xbb\xbf"))
+
+        rows = list(csv.DictReader(io.StringIO(response.content.decode("utf-8-sig"))))
+        self.assertEqual([int(row["id"]) for row in rows], self.book_ids)
+        self.assertEqual(rows[3]["title"], TRICKY_TITLE)
+        self.assertEqual(list(rows[0]), batch.BOOK_EXPORT_COLUMNS)
+
+    async def test_ndjson(self):
+        async with api_client() as client:
+            response = await self._export(client, "users", format="ndjson")
+        self.assertEqual(response.status_code, 200)
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(len(rows), len(set(row["id"] for row in rows)))
+        self.assertIn(self.reader["student_id"], [row["student_id"] for row in rows])
+        self.assertTrue(all(set(row) == set(batch.USER_EXPORT_COLUMNS) for row in rows))
+
+    async def test_xlsx(self):
+        async with api_client() as client:
+            response = await self._export(client, "books")
+        self.assertEqual(response.status_code, 200)
+        sheet = load_workbook(io.BytesIO(response.content), read_only=True).active
+        rows = list(sheet.iter_rows(values_only=True))
+        self.assertEqual(list(rows[0]), batch.BOOK_EXPORT_COLUMNS)
+        self.assertEqual([row[0] for row in rows[1:]], self.book_ids)
+
+    async def test_borrow_records_date_filter(self):
+        async with api_client() as client:
+            response = await self._export(client, "borrow-records", format="ndjson")
+            self.assertEqual(len(response.text.splitlines()), 3)
+
+            response = await self._export(
+                client, "borrow-records", format="ndjson", date_from="2024-02-01", date_to="2024-02-29"
+            )
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([row["borrow_date"] for row in rows], ["2024-02-10 04:00:00"])
+        self.assertEqual(rows[0]["student_id"], self.reader["student_id"])
+
+    async def test_rejects_unknown_format(self):
+        async with api_client() as client:
+            response = await self._export(client, "books", format="pdf")
+            self.assertEqual(response.status_code, 400)
+            response = await client.get("/api/batch/export/books", headers=auth_headers(self.reader))
+            self.assertEqual(response.status_code, 403)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+"""
+预约队列与库存
+- 保留给读者的图书已从可借数量中扣除，预约结束（下架取消等）时必须退回
+- 到书、过期消息在事务提交后推送给在线读者
+"""
+import unittest
+
+from database import get_db
+from notifications import hub
+from routers.holds import expire_holds_job, HOLD_READY_TITLE, HOLD_EXPIRED_TITLE
+from tests.support import use_temp_database, create_users, create_books, auth_headers, api_client
+
+
+class HoldStockTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.book_id = create_books(1, total_count=1)[0]
+        self.borrower, self.waiter = create_users(2)
+        self.admin = create_users(1, role="admin", prefix="admin")[0]
+
+    def _book(self) -> dict:
+        with get_db() as conn:
+            return dict(conn.execute(
+                "SELECT status, total_count, available_count FROM books WHERE id = ?", (self.book_id,)
+            ).fetchone())
+
+    def _subscribe(self, user: dict):
+        subscriber = hub.subscribe(user["id"], user["role"])
+        self.addCleanup(hub.unsubscribe, subscriber)
+        return subscriber
+
+    def _pushed_titles(self, subscriber) -> list:
+        titles = []
+        while not subscriber.queue.empty():
+            event, data = subscriber.queue.get_nowait()
+            if event == "message":
+                titles.append(data["title"])
+        return titles
+
+    def _hold_status(self, hold_id: int) -> str:
+        with get_db() as conn:
+            return conn.execute("SELECT status FROM holds WHERE id = ?", (hold_id,)).fetchone()[0]
+
+    async def _reserve_for_waiter(self, client) -> int:
+        """借走唯一的一本，第二位读者排队，归还后这本书保留给排队的读者"""
+        response = await client.post(f"/api/borrow/{self.book_id}", json={"days": 30}, headers=auth_headers(self.borrower))
+        self.assertEqual(response.status_code, 200)
+        response = await client.post(f"/api/holds/{self.book_id}", headers=auth_headers(self.waiter))
+        self.assertEqual(response.status_code, 200)
+        hold_id = response.json()["id"]
+
+        with get_db() as conn:
+            record_id = conn.execute(
+                "SELECT id FROM borrow_records WHERE book_id = ? AND status = 'borrowed'", (self.book_id,)
+            ).fetchone()[0]
+        response = await client.post(f"/api/borrow/return/{record_id}", headers=auth_headers(self.borrower))
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self._hold_status(hold_id), "ready")
+        self.assertEqual(self._book()["available_count"], 0)
+        return hold_id
+
+    async def test_delete_book_returns_reserved_copy(self):
+        async with api_client() as client:
+            hold_id = await self._reserve_for_waiter(client)
+            response = await client.delete(f"/api/books/{self.book_id}", headers=auth_headers(self.admin))
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self._hold_status(hold_id), "cancelled")
+        book = self._book()
+        self.assertEqual(book["status"], "deleted")
+        self.assertEqual(book["available_count"], book["total_count"])
+
+    async def test_leave_queue_returns_reserved_copy(self):
+        async with api_client() as client:
+            hold_id = await self._reserve_for_waiter(client)
+            response = await client.delete(f"/api/holds/{hold_id}", headers=auth_headers(self.waiter))
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self._hold_status(hold_id), "cancelled")
+        self.assertEqual(self._book()["available_count"], 1)
+
+    async def test_adding_copies_serves_waiting_hold(self):
+        async with api_client() as client:
+            response = await client.post(f"/api/borrow/{self.book_id}", json={"days": 30}, headers=auth_headers(self.borrower))
+            self.assertEqual(response.status_code, 200)
+            response = await client.post(f"/api/holds/{self.book_id}", headers=auth_headers(self.waiter))
+            hold_id = response.json()["id"]
+
+            response = await client.put(
+                f"/api/books/{self.book_id}", json={"total_count": 2}, headers=auth_headers(self.admin)
+            )
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self._hold_status(hold_id), "ready")
+        book = self._book()
+        self.assertEqual(book["total_count"], 2)
+        self.assertEqual(book["available_count"], 0)
+
+    async def test_deleting_reader_passes_reserved_copy_on(self):
+        next_waiter = create_users(1, prefix="next")[0]
+        async with api_client() as client:
+            hold_id = await self._reserve_for_waiter(client)
+            response = await client.post(f"/api/holds/{self.book_id}", headers=auth_headers(next_waiter))
+            next_hold_id = response.json()["id"]
+
+            response = await client.delete(f"/api/users/{self.waiter['id']}", headers=auth_headers(self.admin))
+            self.assertEqual(response.status_code, 200)
+
+        with get_db() as conn:
+            self.assertIsNone(conn.execute("SELECT id FROM holds WHERE id = ?", (hold_id,)).fetchone())
+        self.assertEqual(self._hold_status(next_hold_id), "ready")
+        self.assertEqual(self._book()["available_count"], 0)
+
+    async def test_ready_notice_is_pushed_on_return(self):
+        subscriber = self._subscribe(self.waiter)
+        async with api_client() as client:
+            await self._reserve_for_waiter(client)
+
+        self.assertEqual(self._pushed_titles(subscriber), [HOLD_READY_TITLE])
+
+    async def test_expiry_pushes_expired_and_ready_notices(self):
+        next_waiter = create_users(1, prefix="next")[0]
+        async with api_client() as client:
+            hold_id = await self._reserve_for_waiter(client)
+            response = await client.post(f"/api/holds/{self.book_id}", headers=auth_headers(next_waiter))
+            next_hold_id = response.json()["id"]
+
+        with get_db() as conn:
+            conn.execute("UPDATE holds SET expires_at = datetime('now', '-1 hour') WHERE id = ?", (hold_id,))
+            conn.commit()
+
+        expired_subscriber = self._subscribe(self.waiter)
+        next_subscriber = self._subscribe(next_waiter)
+        await expire_holds_job()
+
+        self.assertEqual(self._hold_status(hold_id), "expired")
+        self.assertEqual(self._hold_status(next_hold_id), "ready")
+        self.assertEqual(self._pushed_titles(expired_subscriber), [HOLD_EXPIRED_TITLE])
+        self.assertEqual(self._pushed_titles(next_subscriber), [HOLD_READY_TITLE])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,191 @@
+"""
+Excel 批量导入
+- ISBN、学号按文本读取，保留前导 0
+- 每行的错误（空字段、非法数量、文件内重复、管理员学号）汇总在返回结果中，行号与 Excel 一致
+- skip 模式跳过已存在的记录，update 模式更新已存在的记录并按新馆藏调整可借数量
+- 不同的密码分批并行计算哈希
+- 不支持的导入模式、非 Excel 文件、缺少必需列返回 400
+"""
+import io
+import unittest
+from unittest import mock
+
+from openpyxl import Workbook
+
+from database import get_db
+from passwords import verify_password
+from routers import batch
+from tests.support import use_temp_database, create_users, create_books, auth_headers, api_client
+
+XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def _workbook(rows: list) -> bytes:
+    workbook = Workbook()
+    sheet = workbook.active
+    for row in rows:
+        sheet.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+class ImportTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.admin = create_users(1, role="admin", prefix="staff")[0]
+        self.student = create_users(1, prefix="2024")[0]
+        self.book_ids = create_books(2, total_count=2)
+        with get_db() as conn:
+            self.isbns = [
+                row["isbn"] for row in
+                conn.execute("SELECT isbn FROM books WHERE id IN (?, ?) ORDER BY id", self.book_ids)
+            ]
+            # 第一本借出一本，第二本已下架
+            conn.execute("UPDATE books SET available_count = 1 WHERE id = ?", (self.book_ids[0],))
+            conn.execute("UPDATE books SET status = 'deleted' WHERE id = ?", (self.book_ids[1],))
+            conn.commit()
+
+    async def _upload(self, client, path: str, rows: list, mode: str = "skip", filename: str = "data.xlsx"):
+        return await client.post(
+            f"/api/batch/import/{path}",
+            params={"mode": mode},
+            files={"file": (filename, _workbook(rows), XLSX)},
+            headers=auth_headers(self.admin)
+        )
+
+    def _book(self, isbn: str) -> dict:
+        with get_db() as conn:
+            row = conn.execute("SELECT * FROM books WHERE isbn = ?", (isbn,)).fetchone()
+        return dict(row) if row else None
+
+    async def test_books_skip_mode_reports_row_errors(self):
+        rows = [
+            ["title", "author", "isbn", "category", "total_count"],
+            ["新书", "作者", "0071234567", "计算机", "3"],
+            ["无作者", None, "9780000000101", "计算机", None],
+            ["数量非法", "作者", "9780000000102", "计算机", "-1"],
+            ["重复", "作者", "0071234567", "计算机", None],
+            ["已存在", "作者", self.isbns[0], "计算机", "5"],
+            ["默认分类", "作者", 9780000000103, None, None],
+        ]
+        async with api_client() as client:
+            response = await self._upload(client, "books", rows)
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual((result["inserted"], result["updated"], result["skipped"]), (2, 0, 1))
+        self.assertEqual(result["error_count"], 3)
+        self.assertEqual(
+            [(error["row"], error["key"]) for error in result["errors"]],
+            [(3, "9780000000101"), (4, "9780000000102"), (5, "0071234567")]
+        )
+        self.assertIn("作者", result["errors"][0]["message"])
+
+        book = self._book("0071234567")
+        self.assertEqual((book["title"], book["total_count"], book["available_count"]), ("新书", 3, 3))
+        self.assertEqual(self._book("9780000000103")["category"], "其它")
+        # skip 模式不改动已存在的图书
+        self.assertEqual(self._book(self.isbns[0])["total_count"], 2)
+
+    async def test_books_update_mode(self):
+        rows = [
+            ["title", "author", "isbn", "category", "total_count"],
+            ["改名", "作者", self.isbns[0], "历史", "4"],
+            ["重新上架", "作者", self.isbns[1], "历史", "1"],
+        ]
+        async with api_client() as client:
+            response = await self._upload(client, "books", rows, mode="update")
+            result = response.json()
+            self.assertEqual((result["inserted"], result["updated"], result["error_count"]), (0, 2, 0))
+
+            # 借出的一本仍在外，可借数量 = 新馆藏 - 1
+            book = self._book(self.isbns[0])
+            self.assertEqual((book["title"], book["category"], book["total_count"], book["available_count"]),
+                             ("改名", "历史", 4, 3))
+            book = self._book(self.isbns[1])
+            self.assertEqual((book["status"], book["total_count"], book["available_count"]), ("active", 1, 1))
+
+            # 馆藏数量不能少于已借出的数量
+            response = await self._upload(client, "books", [rows[0], ["改名", "作者", self.isbns[0], "历史", "0"]],
+                                          mode="update")
+        result = response.json()
+        self.assertEqual((result["updated"], result["error_count"]), (0, 1))
+        self.assertEqual(self._book(self.isbns[0])["total_count"], 4)
+
+    async def test_users(self):
+        rows = [
+            ["student_id", "name", "password"],
+            ["000123", "前导零", None],
+            ["000124", "自定义密码", "secret-pass"],
+            [self.student["student_id"], "改名", None],
+            ["admin", "冒充管理员", None],
+            ["000125", None, None],
+            ["000123", "重复", None],
+        ]
+        async with api_client() as client:
+            response = await self._upload(client, "users", rows, mode="update")
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual((result["inserted"], result["updated"], result["skipped"]), (2, 1, 0))
+        self.assertEqual(
+            [(error["row"], error["key"]) for error in result["errors"]],
+            [(5, "admin"), (6, "000125"), (7, "000123")]
+        )
+
+        with get_db() as conn:
+            users = {
+                row["student_id"]: row
+                for row in conn.execute("SELECT student_id, name, role, password_hash FROM users")
+            }
+        self.assertEqual(users["000123"]["name"], "前导零")
+        self.assertTrue(verify_password("12345678", users["000123"]["password_hash"]))
+        self.assertTrue(verify_password("secret-pass", users["000124"]["password_hash"]))
+        self.assertEqual(users[self.student["student_id"]]["name"], "改名")
+        self.assertEqual(users["admin"]["role"], "admin")
+        self.assertNotEqual(users["admin"]["name"], "冒充管理员")
+
+    async def test_distinct_passwords_hash_in_parallel(self):
+        in_flight = peak = 0
+        original = batch.hash_password_async
+
+        async def _tracking(password):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            try:
+                return await original(password)
+            finally:
+                in_flight -= 1
+
+        # 固定并发数，单核机器上哈希线程池只有一个线程时也能检查分批并行
+        concurrency = 3
+        count = concurrency * 2 + 1
+        rows = [["student_id", "name", "password"]] + [
+            [f"1{i:05d}", f"学生{i}", f"password-{i}"] for i in range(count)
+        ]
+        with mock.patch.object(batch, "hash_password_async", _tracking), \
+                mock.patch.object(batch, "IMPORT_HASH_CONCURRENCY", concurrency):
+            async with api_client() as client:
+                response = await self._upload(client, "users", rows)
+        self.assertEqual(response.json()["inserted"], count)
+        self.assertEqual(peak, concurrency)
+
+        with get_db() as conn:
+            hashes = dict(conn.execute("SELECT student_id, password_hash FROM users WHERE student_id LIKE '1%'"))
+        for i in (0, count - 1):
+            self.assertTrue(verify_password(f"password-{i}", hashes[f"1{i:05d}"]))
+
+    async def test_rejects_bad_requests(self):
+        async with api_client() as client:
+            response = await self._upload(client, "users", [["student_id", "name"]], mode="replace")
+            self.assertEqual(response.status_code, 400)
+            response = await self._upload(client, "users", [["student_id", "name"]], filename="data.csv")
+            self.assertEqual(response.status_code, 400)
+            response = await self._upload(client, "books", [["title", "isbn"], ["书", "978"]])
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("author", response.json()["detail"])
+
+
+if __name__ == "__main__":
+    unittest.main()
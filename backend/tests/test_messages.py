@@ -0,0 +1,153 @@
+"""
+群发通知与个人消息合并读取
+- 个人消息和群发（负数 id）交错时，游标翻页与页码翻页结果一致且不重复不遗漏
+- 未读数 = 未读个人消息 + 未读群发；单条已读、全部已读后随之变化
+- 注册之前发出的群发不可见
+"""
+import unittest
+
+from database import get_db
+from tests.support import use_temp_database, create_users, auth_headers, api_client
+
+DIRECT_COUNT = 5
+BROADCAST_COUNT = 5
+
+
+class MessagesTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.admin = create_users(1, role="admin", prefix="admin")[0]
+        self.reader, self.other = create_users(2)
+
+    async def _send(self, client, title: str, receiver_ids: list):
+        response = await client.post(
+            "/api/messages/send",
+            json={"title": title, "content": title, "receiver_ids": receiver_ids},
+            headers=auth_headers(self.admin)
+        )
+        self.assertEqual(response.status_code, 200)
+
+    async def _unread(self, client, user: dict) -> int:
+        response = await client.get("/api/messages/unread-count", headers=auth_headers(user))
+        self.assertEqual(response.status_code, 200)
+        return response.json()["count"]
+
+    async def _seed(self, client):
+        for i in range(DIRECT_COUNT):
+            await self._send(client, f"个人消息 {i}", [self.reader["id"]])
+        for i in range(BROADCAST_COUNT):
+            await self._send(client, f"群发 {i}", [])
+
+        # 让两类消息的时间戳交错，部分时间戳相同以检验 (created_ts, id) 排序键
+        with get_db() as conn:
+            conn.execute("UPDATE messages SET created_ts = 1000 + id * 2")
+            conn.execute("UPDATE broadcasts SET created_ts = 1000 + id * 2 + (id % 2)")
+            conn.execute("UPDATE users SET created_at = '1970-01-01 00:00:00'")
+            conn.commit()
+
+    async def test_merged_pagination(self):
+        async with api_client() as client:
+            await self._seed(client)
+
+            response = await client.get(
+                "/api/messages", params={"page_size": 100}, headers=auth_headers(self.reader)
+            )
+            everything = response.json()
+            self.assertEqual(everything["total"], DIRECT_COUNT + BROADCAST_COUNT)
+            expected = [(item["created_ts"], item["id"]) for item in everything["items"]]
+            self.assertEqual(expected, sorted(expected, reverse=True))
+            self.assertEqual(sum(1 for _, item_id in expected if item_id < 0), BROADCAST_COUNT)
+
+            by_cursor, after = [], None
+            while True:
+                params = {"page_size": 3, "include_total": False}
+                if after:
+                    params["after"] = after
+                response = await client.get("/api/messages", params=params, headers=auth_headers(self.reader))
+                self.assertEqual(response.status_code, 200)
+                page = response.json()
+                by_cursor.extend((item["created_ts"], item["id"]) for item in page["items"])
+                after = page["next_cursor"]
+                if not after:
+                    break
+            self.assertEqual(by_cursor, expected)
+
+            by_page = []
+            for page in range(1, 5):
+                response = await client.get(
+                    "/api/messages", params={"page": page, "page_size": 3}, headers=auth_headers(self.reader)
+                )
+                by_page.extend((item["created_ts"], item["id"]) for item in response.json()["items"])
+            self.assertEqual(by_page, expected)
+
+            # 另一位学生只看到群发
+            response = await client.get("/api/messages", headers=auth_headers(self.other))
+            self.assertEqual(response.json()["total"], BROADCAST_COUNT)
+            self.assertTrue(all(item["id"] < 0 for item in response.json()["items"]))
+
+    async def test_unread_counts_and_marking(self):
+        async with api_client() as client:
+            await self._seed(client)
+            self.assertEqual(await self._unread(client, self.reader), DIRECT_COUNT + BROADCAST_COUNT)
+
+            response = await client.get("/api/messages", headers=auth_headers(self.reader))
+            items = response.json()["items"]
+            broadcast_id = next(item["id"] for item in items if item["id"] < 0)
+            direct_id = next(item["id"] for item in items if item["id"] > 0)
+
+            for _ in range(2):
+                response = await client.post(f"/api/messages/{broadcast_id}/read", headers=auth_headers(self.reader))
+                self.assertEqual(response.status_code, 200)
+            self.assertEqual(await self._unread(client, self.reader), DIRECT_COUNT + BROADCAST_COUNT - 1)
+            # 群发的已读状态按用户区分
+            self.assertEqual(await self._unread(client, self.other), BROADCAST_COUNT)
+
+            response = await client.post(f"/api/messages/{direct_id}/read", headers=auth_headers(self.reader))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(await self._unread(client, self.reader), DIRECT_COUNT + BROADCAST_COUNT - 2)
+
+            # 不能标记别人的消息、不存在的群发
+            response = await client.post(f"/api/messages/{direct_id}/read", headers=auth_headers(self.other))
+            self.assertEqual(response.status_code, 404)
+            response = await client.post("/api/messages/-999/read", headers=auth_headers(self.reader))
+            self.assertEqual(response.status_code, 404)
+
+            response = await client.post("/api/messages/read-all", headers=auth_headers(self.reader))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(await self._unread(client, self.reader), 0)
+            response = await client.get("/api/messages", headers=auth_headers(self.reader))
+            self.assertTrue(all(item["is_read"] for item in response.json()["items"]))
+
+            # 全部已读之后的新群发仍是未读
+            await self._send(client, "新群发", [])
+            self.assertEqual(await self._unread(client, self.reader), 1)
+            self.assertEqual(await self._unread(client, self.other), BROADCAST_COUNT + 1)
+
+    async def test_unknown_receivers_are_rejected(self):
+        async with api_client() as client:
+            response = await client.post(
+                "/api/messages/send",
+                json={"title": "通知", "content": "通知", "receiver_ids": [self.reader["id"], 999999, 999998]},
+                headers=auth_headers(self.admin)
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("999999, 999998", response.json()["detail"])
+            # 整批不写入
+            self.assertEqual(await self._unread(client, self.reader), 0)
+
+    async def test_broadcasts_before_registration_are_hidden(self):
+        async with api_client() as client:
+            await self._send(client, "群发", [])
+            with get_db() as conn:
+                conn.execute("UPDATE users SET created_at = '2100-01-01 00:00:00' WHERE id = ?", (self.other["id"],))
+                conn.commit()
+
+            response = await client.get("/api/messages", headers=auth_headers(self.other))
+            self.assertEqual(response.json()["total"], 0)
+            self.assertEqual(await self._unread(client, self.other), 0)
+            self.assertEqual(await self._unread(client, self.reader), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
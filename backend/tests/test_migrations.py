@@ -0,0 +1,53 @@
+"""
+多 worker 同时启动时的迁移加锁
+另一个 worker 持有迁移锁的时间超过 busy_timeout 时，本 worker 应继续等待，
+拿到锁后发现版本已是最新，不再重复执行迁移
+"""
+import sqlite3
+import threading
+import time
+import unittest
+
+from database import pool, BUSY_TIMEOUT_MS
+from migrations import run_migrations, latest_version, get_schema_version
+from tests.support import use_temp_database
+
+
+class MigrationLockTest(unittest.TestCase):
+
+    def setUp(self):
+        # 空数据库，模拟首次部署
+        use_temp_database(self, migrate=False)
+
+    def test_waits_for_slow_migration_in_other_worker(self):
+        locked = threading.Event()
+        hold_seconds = BUSY_TIMEOUT_MS / 1000 + 1.5
+
+        def _other_worker():
+            # 另一个 worker：持有排它锁执行耗时迁移，完成后写入最新版本
+            conn = sqlite3.connect(str(pool.db_path), isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("BEGIN EXCLUSIVE")
+            locked.set()
+            time.sleep(hold_seconds)
+            conn.execute(f"PRAGMA user_version = {latest_version()}")
+            conn.execute("COMMIT")
+            conn.close()
+
+        worker = threading.Thread(target=_other_worker)
+        worker.start()
+        locked.wait()
+
+        start = time.monotonic()
+        applied = run_migrations()
+        waited = time.monotonic() - start
+        worker.join()
+
+        self.assertEqual(applied, 0)
+        self.assertGreaterEqual(waited, hold_seconds - 0.5)
+        with sqlite3.connect(str(pool.db_path)) as conn:
+            self.assertEqual(get_schema_version(conn), latest_version())
+
+
+if __name__ == "__main__":
+    unittest.main()
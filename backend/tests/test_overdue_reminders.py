@@ -0,0 +1,121 @@
+"""
+逾期提醒
+- 每个逾期用户合并为一条消息，按到期时间列出全部逾期图书
+- 提醒间隔内重复发送会跳过，间隔过后再次提醒
+- 自动提醒默认关闭，定时任务不发送
+"""
+import unittest
+
+from database import get_db
+from routers.fines import overdue_reminders_job
+from tests.support import use_temp_database, create_users, create_books, auth_headers, api_client
+
+
+class OverdueRemindersTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.super_admin = create_users(1, role="super_admin", prefix="super")[0]
+        self.late_reader, self.other_late_reader, self.punctual_reader = create_users(3)
+        self.book_ids = create_books(4)
+
+        loans = [
+            (self.book_ids[0], self.late_reader["id"], "-3 days"),
+            (self.book_ids[1], self.late_reader["id"], "-5 days"),
+            (self.book_ids[2], self.other_late_reader["id"], "-1 days"),
+            (self.book_ids[3], self.punctual_reader["id"], "+7 days"),
+        ]
+        with get_db() as conn:
+            conn.executemany(
+                """INSERT INTO borrow_records (book_id, user_id, due_date, status)
+                   VALUES (?, ?, datetime('now', ?), 'borrowed')""",
+                loans
+            )
+            conn.commit()
+
+    def _reminders(self) -> dict:
+        with get_db() as conn:
+            rows = conn.execute(
+                "SELECT receiver_id, content FROM messages WHERE title = '逾期提醒' ORDER BY id"
+            ).fetchall()
+        reminders = {}
+        for row in rows:
+            reminders.setdefault(row["receiver_id"], []).append(row["content"])
+        return reminders
+
+    async def _notify(self, client) -> str:
+        response = await client.post("/api/admin/batch-overdue-notify", headers=auth_headers(self.super_admin))
+        self.assertEqual(response.status_code, 200)
+        return response.json()["message"]
+
+    async def test_one_merged_reminder_per_user(self):
+        async with api_client() as client:
+            self.assertIn("2 位用户", await self._notify(client))
+
+        reminders = self._reminders()
+        self.assertEqual(set(reminders), {self.late_reader["id"], self.other_late_reader["id"]})
+        self.assertEqual(len(reminders[self.late_reader["id"]]), 1)
+        content = reminders[self.late_reader["id"]][0]
+        # 按到期时间排列：先到期的在前
+        self.assertLess(
+            content.index("测试图书 1 "), content.index("测试图书 0 ")
+        )
+        self.assertIn("已逾期 5 天", content)
+
+    async def test_repeat_within_window_is_skipped(self):
+        async with api_client() as client:
+            await self._notify(client)
+            self.assertIn("暂无", await self._notify(client))
+            self.assertEqual(sum(len(v) for v in self._reminders().values()), 2)
+
+            # 提醒间隔过去之后再次提醒
+            with get_db() as conn:
+                conn.execute("UPDATE overdue_reminders SET reminded_ts = reminded_ts - 25 * 3600")
+                conn.commit()
+            self.assertIn("2 位用户", await self._notify(client))
+            self.assertEqual(len(self._reminders()[self.late_reader["id"]]), 2)
+
+    async def test_reads_do_not_wait_for_refresh_job(self):
+        # 定时任务还没有运行过，逾期罚款表为空
+        async with api_client() as client:
+            response = await client.get("/api/borrow/overdue", headers=auth_headers(self.super_admin))
+            self.assertEqual(response.status_code, 200)
+            self.assertCountEqual(
+                [item["student_id"] for item in response.json()],
+                [self.late_reader["student_id"], self.late_reader["student_id"], self.other_late_reader["student_id"]]
+            )
+
+            with get_db() as conn:
+                conn.execute("DELETE FROM overdue_fines")
+                conn.commit()
+            response = await client.get("/api/fines/my", headers=auth_headers(self.late_reader))
+            self.assertEqual(response.status_code, 200)
+            fines = response.json()
+            self.assertEqual(fines["overdue_count"], 2)
+            # 罚款按默认费率 0.5 元/天：3 天 + 5 天
+            self.assertEqual(fines["accruing_fine"], 4.0)
+
+            # 只刷新本人的记录
+            with get_db() as conn:
+                others = conn.execute(
+                    "SELECT COUNT(*) FROM overdue_fines WHERE user_id != ?", (self.late_reader["id"],)
+                ).fetchone()[0]
+            self.assertEqual(others, 0)
+
+    async def test_job_respects_auto_setting(self):
+        await overdue_reminders_job()
+        self.assertEqual(self._reminders(), {})
+
+        with get_db() as conn:
+            conn.execute("UPDATE system_settings SET value = '1' WHERE key = 'overdue_reminder_auto'")
+            conn.commit()
+        await overdue_reminders_job()
+        await overdue_reminders_job()
+        self.assertEqual(
+            {user_id: len(contents) for user_id, contents in self._reminders().items()},
+            {self.late_reader["id"]: 1, self.other_late_reader["id"]: 1}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+"""
+图书全文检索
+- 3 个字符以上的词走 FTS5 trigram 索引，较短的词（如两个字的中文书名）退回 LIKE
+- 索引由触发器维护：修改书名、下架后搜索结果随之变化
+"""
+import unittest
+
+from database import get_db
+from tests.support import use_temp_database, create_users, auth_headers, api_client
+
+BOOKS = [
+    ("数据库系统概论", "王珊", "9787040406641"),
+    ("数据库系统实现", "加西亚-莫利纳", "9787111258544"),
+    ("红楼梦", "曹雪芹", "9787020002207"),
+    ("Designing Data-Intensive Applications", "Martin Kleppmann", "9781449373320"),
+]
+
+
+class SearchTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        with get_db() as conn:
+            conn.executemany(
+                """INSERT INTO books (title, author, isbn, category, total_count, available_count)
+                   VALUES (?, ?, ?, '测试', 1, 1)""",
+                BOOKS
+            )
+            conn.commit()
+            self.ids = {row["title"]: row["id"] for row in conn.execute("SELECT id, title FROM books")}
+        self.reader = create_users(1)[0]
+        self.admin = create_users(1, role="admin", prefix="admin")[0]
+
+    async def _search(self, client, term: str) -> list:
+        response = await client.get("/api/books", params={"search": term}, headers=auth_headers(self.reader))
+        self.assertEqual(response.status_code, 200)
+        return [item["title"] for item in response.json()["items"]]
+
+    async def test_trigram_match(self):
+        async with api_client() as client:
+            self.assertCountEqual(await self._search(client, "数据库系统"), ["数据库系统概论", "数据库系统实现"])
+            self.assertEqual(await self._search(client, "kleppmann"), ["Designing Data-Intensive Applications"])
+            self.assertEqual(await self._search(client, "1449373"), ["Designing Data-Intensive Applications"])
+
+    async def test_short_terms_fall_back_to_like(self):
+        async with api_client() as client:
+            self.assertEqual(await self._search(client, "红楼"), ["红楼梦"])
+            # 长词走全文检索，短词在候选结果上过滤
+            self.assertEqual(await self._search(client, "数据库 概论"), ["数据库系统概论"])
+            self.assertEqual(await self._search(client, "无此书"), [])
+
+    async def test_quotes_in_terms_are_escaped(self):
+        async with api_client() as client:
+            self.assertEqual(await self._search(client, '数据库"系统'), [])
+            self.assertEqual(await self._search(client, 'a"b'), [])
+
+    async def test_index_follows_updates_and_delisting(self):
+        async with api_client() as client:
+            book_id = self.ids["数据库系统实现"]
+            response = await client.put(
+                f"/api/books/{book_id}", json={"title": "分布式系统原理"}, headers=auth_headers(self.admin)
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(await self._search(client, "数据库系统"), ["数据库系统概论"])
+            self.assertEqual(await self._search(client, "分布式系统"), ["分布式系统原理"])
+
+            response = await client.delete(f"/api/books/{self.ids['红楼梦']}", headers=auth_headers(self.admin))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(await self._search(client, "曹雪芹"), [])
+            self.assertEqual(await self._search(client, "红楼"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+"""
+评论与收藏
+不存在的图书返回 404，不依赖外键约束报错
+"""
+import unittest
+
+from tests.support import use_temp_database, create_users, create_books, auth_headers, api_client
+
+
+class SocialTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.reader = create_users(1)[0]
+        self.book_id = create_books(1)[0]
+
+    async def test_toggle_favorite(self):
+        async with api_client() as client:
+            for expected in ("已收藏", "已取消收藏"):
+                response = await client.post(f"/api/books/{self.book_id}/favorite", headers=auth_headers(self.reader))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()["message"], expected)
+
+            response = await client.post("/api/books/999999/favorite", headers=auth_headers(self.reader))
+            self.assertEqual(response.status_code, 404)
+
+    async def test_review_unknown_book(self):
+        async with api_client() as client:
+            response = await client.post(
+                "/api/books/999999/reviews", json={"rating": 5, "content": "好书"}, headers=auth_headers(self.reader)
+            )
+        self.assertEqual(response.status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
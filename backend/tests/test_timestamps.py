@@ -0,0 +1,77 @@
+"""
+借阅和消息的整数时间戳
+应用写入时直接带上时间戳，与文本时间列一致，触发器不再额外执行 UPDATE；
+直接用 SQL 写入、未带时间戳的旧写法仍由触发器补齐
+"""
+import unittest
+
+from database import get_db
+from tests.support import use_temp_database, create_users, create_books, auth_headers, api_client
+
+BORROW_IN_SYNC = """
+    SELECT COUNT(*) FROM borrow_records
+    WHERE borrow_ts IS CAST(strftime('%s', borrow_date) AS INTEGER)
+      AND due_ts IS CAST(strftime('%s', due_date, 'utc') AS INTEGER)
+      AND return_ts IS CAST(strftime('%s', return_date) AS INTEGER)
+"""
+
+
+class EpochTimestampTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.book_id = create_books(1, total_count=2)[0]
+        self.admin, self.reader = create_users(1, role="admin", prefix="staff") + create_users(1)
+
+    async def test_app_writes_store_timestamps(self):
+        async with api_client() as client:
+            response = await client.post(f"/api/borrow/{self.book_id}", json={"days": 7}, headers=auth_headers(self.reader))
+            self.assertEqual(response.status_code, 200)
+            with get_db() as conn:
+                record_id = conn.execute("SELECT id FROM borrow_records").fetchone()[0]
+            response = await client.post(f"/api/borrow/return/{record_id}", headers=auth_headers(self.reader))
+            self.assertEqual(response.status_code, 200)
+            response = await client.post(
+                "/api/messages/send",
+                json={"receiver_ids": [self.reader["id"]], "title": "通知", "content": "内容"},
+                headers=auth_headers(self.admin)
+            )
+            self.assertEqual(response.status_code, 200)
+
+        with get_db() as conn:
+            self.assertEqual(conn.execute(BORROW_IN_SYNC).fetchone()[0], 1)
+            row = conn.execute(
+                "SELECT created_ts, CAST(strftime('%s', created_at) AS INTEGER) FROM messages"
+            ).fetchone()
+        self.assertEqual(row[0], row[1])
+
+    def test_triggers_only_fill_legacy_writes(self):
+        with get_db() as conn:
+            # 带上时间戳的写入：只有 INSERT 本身一行变化
+            before = conn.total_changes
+            conn.execute(
+                """INSERT INTO messages (sender_name, receiver_id, title, content, created_ts)
+                   VALUES ('system', ?, 't', 'c', CAST(strftime('%s', 'now') AS INTEGER))""",
+                (self.reader["id"],)
+            )
+            self.assertEqual(conn.total_changes - before, 1)
+
+            # 未带时间戳的旧写法：由触发器补齐
+            conn.execute(
+                "INSERT INTO messages (sender_name, receiver_id, title, content) VALUES ('system', ?, 't', 'c')",
+                (self.reader["id"],)
+            )
+            conn.execute(
+                "INSERT INTO borrow_records (book_id, user_id, due_date, status) VALUES (?, ?, '2030-01-01 08:00:00', 'borrowed')",
+                (self.book_id, self.reader["id"])
+            )
+            conn.execute("UPDATE borrow_records SET due_date = '2030-02-01 08:00:00'")
+            conn.commit()
+
+            missing = conn.execute("SELECT COUNT(*) FROM messages WHERE created_ts IS NULL").fetchone()[0]
+            self.assertEqual(missing, 0)
+            self.assertEqual(conn.execute(BORROW_IN_SYNC).fetchone()[0], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
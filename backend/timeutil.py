@@ -0,0 +1,22 @@
+"""
+时间工具
+- 借阅、消息、日志的时间列都有整数时间戳（UTC 秒）副本，按日期筛选时先把本地日期换算为时间戳，
+  再对时间戳列做范围查询（走索引）
+"""
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+
+# 当前时间戳（UTC 秒）的 SQL 表达式，同一条语句内与 CURRENT_TIMESTAMP 取值一致，
+# INSERT 时与文本时间列一起写入
+NOW_TS = "CAST(strftime('%s', 'now') AS INTEGER)"
+
+def local_date_ts(value: str, next_day: bool = False) -> int:
+    """将本地日期 YYYY-MM-DD 转为当天 0 点（或次日 0 点）的时间戳，格式不正确时返回 400"""
+    try:
+        day = datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"日期格式错误: {value}，应为 YYYY-MM-DD")
+    if next_day:
+        day += timedelta(days=1)
+    return int(day.timestamp())
@@ -21,14 +21,92 @@ api.interceptors.request.use(
     error => Promise.reject(error)
 )
 
-// 响应拦截器 - 处理错误
+// 清除登录状态并回到登录页
+const clearSession = () => {
+    localStorage.removeItem('token')
+    localStorage.removeItem('refresh_token')
+    localStorage.removeItem('user')
+    window.location.href = '/login'
+}
+
+// 令牌保存在各标签页共用的 localStorage 中：
+// - 同一标签页同一时间只发起一次刷新，并发的 401 请求共用结果
+// - 跨标签页用 Web Locks 串行刷新，拿到锁时刷新令牌已被其他标签页轮换则直接使用新 token
+// - 不支持 Web Locks 时两个标签页可能同时刷新，落后的一方收到 401 后改用对方存入的新 token，
+//   不能清除登录状态（否则会删掉对方刚存入的令牌，所有标签页一起退出登录）
+const REFRESH_LOCK = 'library-auth-refresh'
+const REFRESH_RACE_WAIT = 1000
+let refreshing = null
+
+const sleep = ms => new Promise(resolve => setTimeout(resolve, ms))
+
+// 刷新令牌已被其他标签页换成新的时返回新 token
+const tokenRotatedElsewhere = async (usedToken) => {
+    for (const delay of [0, REFRESH_RACE_WAIT]) {
+        await sleep(delay)
+        const latest = localStorage.getItem('refresh_token')
+        if (latest && latest !== usedToken) return localStorage.getItem('token')
+    }
+    return null
+}
+
+const rotateTokens = async (startToken) => {
+    const refresh_token = localStorage.getItem('refresh_token')
+    if (refresh_token && refresh_token !== startToken) {
+        return localStorage.getItem('token')
+    }
+    try {
+        const res = await axios.post(`${api.defaults.baseURL}/api/auth/refresh`, { refresh_token })
+        localStorage.setItem('token', res.data.token)
+        localStorage.setItem('refresh_token', res.data.refresh_token)
+        return res.data.token
+    } catch (e) {
+        if (e.response?.status === 401) {
+            const token = await tokenRotatedElsewhere(refresh_token)
+            if (token) return token
+        }
+        throw e
+    }
+}
+
+const refreshAccessToken = () => {
+    if (!refreshing) {
+        const startToken = localStorage.getItem('refresh_token')
+        const run = () => rotateTokens(startToken)
+        refreshing = (navigator.locks ? navigator.locks.request(REFRESH_LOCK, run) : run())
+            .finally(() => {
+                refreshing = null
+            })
+    }
+    return refreshing
+}
+
+// 响应拦截器 - 处理错误，access token 过期时用刷新令牌换取新 token 后重试一次
 api.interceptors.response.use(
     response => response.data,
-    error => {
+    async error => {
+        const config = error.config
         if (error.response?.status === 401) {
-            localStorage.removeItem('token')
-            localStorage.removeItem('user')
-            window.location.href = '/login'
+            const canRefresh = config && !config._retried
+                && !config.url.startsWith('/api/auth/')
+                && localStorage.getItem('refresh_token')
+            if (canRefresh) {
+                config._retried = true
+                let refreshed = false
+                try {
+                    await refreshAccessToken()
+                    refreshed = true
+                } catch (e) {
+                    // 刷新令牌失效时重新登录，网络等其他错误直接返回
+                    if (e.response?.status !== 401) {
+                        return Promise.reject(e.response?.data || e)
+                    }
+                }
+                if (refreshed) {
+                    return api(config)
+                }
+            }
+            clearSession()
         }
         return Promise.reject(error.response?.data || error)
     }
@@ -40,6 +118,13 @@ export const authApi = {
     login: (student_id, password) =>
         api.post('/api/auth/login', { student_id, password }),
 
+    // 退出登录时吊销刷新令牌，失败不影响本地退出
+    logout: () => {
+        const refresh_token = localStorage.getItem('refresh_token')
+        if (!refresh_token) return Promise.resolve()
+        return api.post('/api/auth/logout', { refresh_token }).catch(() => {})
+    },
+
     changePassword: (old_password, new_password, token) =>
         api.post('/api/auth/change-password-with-token',
             { old_password, new_password },
@@ -54,6 +139,7 @@ export const bookApi = {
     getCategories: () => api.get('/api/books/categories'),
     getStats: () => api.get('/api/books/stats'),
     getDetail: (id) => api.get(`/api/books/${id}`),
+    getBatch: (ids) => api.get('/api/books/batch', { params: { ids: ids.join(',') } }),
     create: (data) => api.post('/api/books', data),
     update: (id, data) => api.put(`/api/books/${id}`, data),
     delete: (id) => api.delete(`/api/books/${id}`)
@@ -75,11 +161,27 @@ export const borrowApi = {
     returnByIsbn: (isbn, studentId = null) => api.post('/api/borrow/return-by-isbn', null, {
         params: { isbn, student_id: studentId }
     }),
+    // operations: [{ action: 'borrow' | 'return', isbn, student_id }]
+    bulk: (operations, days = 30) => api.post('/api/borrow/bulk', { operations, days }),
     getRecords: (params = {}) => api.get('/api/borrow/records', { params }),
     getMyBorrows: () => api.get('/api/borrow/my'),
     getOverdue: () => api.get('/api/borrow/overdue')
 }
 
+// ==================== 罚款 API ====================
+
+export const fineApi = {
+    getMy: () => api.get('/api/fines/my')
+}
+
+// ==================== 预约 API ====================
+
+export const holdApi = {
+    join: (bookId) => api.post(`/api/holds/${bookId}`),
+    leave: (holdId) => api.delete(`/api/holds/${holdId}`),
+    getMy: () => api.get('/api/holds/my')
+}
+
 // ==================== 社交功能 API ====================
 
 export const socialApi = {
@@ -95,18 +197,23 @@ export const socialApi = {
 export const batchApi = {
     exportBooks: () => api.get('/api/batch/export/books', { responseType: 'blob' }),
     exportUsers: () => api.get('/api/batch/export/users', { responseType: 'blob' }),
-    importBooks: (file) => {
+    exportBorrowRecords: (params = {}) => api.get('/api/batch/export/borrow-records', { params, responseType: 'blob', timeout: 0 }),
+    importBooks: (file, mode = 'skip') => {
         const formData = new FormData()
         formData.append('file', file)
         return api.post('/api/batch/import/books', formData, {
-            headers: { 'Content-Type': 'multipart/form-data' }
+            params: { mode },
+            headers: { 'Content-Type': 'multipart/form-data' },
+            timeout: 0
         })
     },
-    importUsers: (file) => {
+    importUsers: (file, mode = 'skip') => {
         const formData = new FormData()
         formData.append('file', file)
         return api.post('/api/batch/import/users', formData, {
-            headers: { 'Content-Type': 'multipart/form-data' }
+            params: { mode },
+            headers: { 'Content-Type': 'multipart/form-data' },
+            timeout: 0
         })
     }
 }
@@ -121,6 +228,7 @@ export const adminApi = {
     deleteAdmin: (id) => api.delete(`/api/admin/admins/${id}`),
     resetAdminPassword: (id) => api.post(`/api/admin/admins/${id}/reset-password`),
     getLogs: (params = {}) => api.get('/api/admin/logs', { params }),
+    getLogActions: () => api.get('/api/admin/logs/actions'),
     batchOverdueNotify: () => api.post('/api/admin/batch-overdue-notify')
 }
 
@@ -132,7 +240,54 @@ export const messageApi = {
     markRead: (id) => api.post(`/api/messages/${id}/read`),
     markAllRead: () => api.post('/api/messages/read-all'),
     send: (data) => api.post('/api/messages/send', data),
-    getUsersForSend: (keyword = '') => api.get('/api/messages/users-for-send', { params: { keyword } })
+    getUsersForSend: (keyword = '') => api.get('/api/messages/users-for-send', { params: { keyword } }),
+    // 订阅未读数和新消息推送，返回关闭函数
+    subscribe: (handlers) => openMessageStream(handlers)
+}
+
+// 消息推送（SSE）
+// - 网络中断时浏览器按服务端 retry 自动重连，重连后服务端会先推送当前未读数
+// - token 过期（expired 事件）或连接被拒绝时，刷新 token 后重新连接
+const STREAM_RETRY_DELAY = 5000
+
+const openMessageStream = ({ onUnread, onMessage } = {}) => {
+    let source = null
+    let timer = null
+    let closed = false
+
+    const connect = () => {
+        const token = localStorage.getItem('token')
+        if (closed || !token) return
+        source = new EventSource(`${api.defaults.baseURL}/api/messages/stream?token=${encodeURIComponent(token)}`)
+        source.addEventListener('unread', e => onUnread?.(JSON.parse(e.data).count))
+        source.addEventListener('message', e => onMessage?.(JSON.parse(e.data)))
+        source.addEventListener('expired', () => reconnect(0))
+        source.onerror = () => {
+            if (source.readyState === EventSource.CLOSED) reconnect(STREAM_RETRY_DELAY)
+        }
+    }
+
+    const reconnect = (delay) => {
+        source?.close()
+        clearTimeout(timer)
+        timer = setTimeout(async () => {
+            if (closed || !localStorage.getItem('refresh_token')) return
+            try {
+                await refreshAccessToken()
+            } catch (e) {
+                // 刷新令牌也失效时停止推送，下次请求会回到登录页
+                if (e.response?.status === 401) return
+            }
+            connect()
+        }, delay)
+    }
+
+    connect()
+    return () => {
+        closed = true
+        clearTimeout(timer)
+        source?.close()
+    }
 }
 
 export default api